@@ -1,18 +1,55 @@
 import os
 
-from apistar import Include
+from apistar import Command, Include
 from apistar.backends import sqlalchemy_backend
+from apistar.exceptions import CommandLineError
 from apistar.frameworks.wsgi import WSGIApp as App
 from apistar.handlers import docs_urls, static_urls
+from apistar.interfaces import Console
+from eventsourcing.infrastructure.sqlalchemy.datastore import ActiveRecord
 
-from infrastructure.datastore import get_database
-from infrastructure.kanban_application import init_kanban_application_w_sqlalchemy
+from infrastructure.kanban_application import get_kanban_application, init_kanban_application, \
+    init_kanban_application_w_sqlalchemy
+from infrastructure.projections.rebuild import rebuild_projections
+from utility.metrics import metrics
+from utility.parse import load_blacklist_files
+from webapi.profiling import ProfilingMiddleware, sampler
+from webapi.routes.event_routes import event_routes
+from webapi.routes.metrics_routes import metrics_routes
+from webapi.routes.profiler_routes import profiler_routes
 from webapi.routes.user_routes import user_routes
 
 BASEDIR = os.path.dirname(os.path.abspath(__file__))
 DB_HOST = f"sqlite:///{BASEDIR}/infrastructure/event.db"
+BLACKLIST_DOMAIN_FILES = os.getenv('BLACKLIST_DOMAIN_FILES')
+# 'memory' keeps events in memory, for tests and benchmarks.
+EVENT_STORE = os.getenv('EVENT_STORE', 'sqlalchemy')
+# Set PROFILER=1 to install the request profiler, started and stopped at /admin/profiler.
+PROFILER = os.getenv('PROFILER', '0') == '1'
+
+if BLACKLIST_DOMAIN_FILES:
+    load_blacklist_files(*BLACKLIST_DOMAIN_FILES.split(os.pathsep))
+
+if EVENT_STORE == 'memory':
+    init_kanban_application(backend='memory')
+else:
+    init_kanban_application_w_sqlalchemy(db_host=DB_HOST)
+
+
+def rebuild_read_models(console: Console, workers: int=0):
+    """
+    Rebuild the read model projections from the event store, in parallel.
+
+    Args:
+      console: The console to write the number of rows rebuilt to.
+      workers: Number of worker processes. Defaults to the number of CPUs.
+    """
+    if EVENT_STORE == 'memory':
+        raise CommandLineError("Projections can only be rebuilt from a database event store.")
+    counts = rebuild_projections(get_kanban_application(), DB_HOST, workers=workers or None)
+    for name, count in sorted(counts.items()):
+        console.echo(f"{name}: {count} rows")
 
-init_kanban_application_w_sqlalchemy(db_host=DB_HOST)
 
 routes = [
     Include('/docs', docs_urls),
@@ -20,20 +57,38 @@ routes = [
 ]
 
 routes += user_routes
+routes += event_routes
 
-settings = {
-    "DATABASE": {
+# Set METRICS=1 to record latency histograms and serve them from /metrics.
+if metrics.enabled:
+    routes += metrics_routes
+
+if PROFILER:
+    routes += profiler_routes
+
+settings = {}
+commands = [Command('rebuild_read_models', rebuild_read_models)]
+components = []
+
+# The memory event store has no database, so apistar's SQLAlchemy backend, and its
+# create_tables command, aren't pointed at event.db.
+if EVENT_STORE != 'memory':
+    settings["DATABASE"] = {
         "URL": DB_HOST,
-        "METADATA": get_database()._base.metadata
+        "METADATA": ActiveRecord.metadata
     }
-}
+    commands = sqlalchemy_backend.commands + commands
+    components = sqlalchemy_backend.components
 
 app = App(
     routes=routes,
     settings=settings,
-    commands=sqlalchemy_backend.commands,
-    components=sqlalchemy_backend.components
+    commands=commands,
+    components=components
 )
 
+if PROFILER:
+    app = ProfilingMiddleware(app, sampler)
+
 if __name__ == '__main__':
     app.main()
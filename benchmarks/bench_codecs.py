@@ -0,0 +1,51 @@
+"""Measures payload size and encode/decode throughput of each event codec.
+
+The payloads are a User.Created event and a snapshot of a user with ten domains.
+
+    $ python -m benchmarks.bench_codecs
+"""
+import timeit
+from uuid import uuid4
+
+from eventsourcing.domain.model.snapshot import Snapshot
+from eventsourcing.domain.model.events import topic_from_domain_class
+
+from benchmarks.bench_snapshotting import PASSWORD_HASH
+from infrastructure.transcoding import CODECS
+from kanban.domain.model.user import User
+
+NUMBER = 20000
+
+
+def payloads():
+    user_id = uuid4()
+    created = User.Created(originator_id=user_id, user_id=user_id, name="Name", password=PASSWORD_HASH,
+                           email='email@dot.com', default_domain='dot.com')
+    user = created.mutate(cls=User)
+    for i in range(10):
+        user.add_domain(f'domain{i}.com')
+    state = dict(user.__dict__)
+    state.pop('_pending_events')
+    snapshot = Snapshot(originator_id=user_id, originator_version=user.version,
+                        topic=topic_from_domain_class(User), state=state)
+    return {'created': created.__dict__, 'snapshot': snapshot.__dict__}
+
+
+def measure(codec, event_attrs, number=NUMBER):
+    """Returns payload bytes, and encodes and decodes per second."""
+    data = codec.encode(event_attrs)
+    encode = number / timeit.timeit(lambda: codec.encode(event_attrs), number=number)
+    decode = number / timeit.timeit(lambda: codec.decode(data), number=number)
+    return len(data.encode('utf-8')), encode, decode
+
+
+def main():
+    print(f"{'payload':>10} {'codec':>8} {'bytes':>8} {'encode/s':>10} {'decode/s':>10}")
+    for payload, event_attrs in payloads().items():
+        for name, codec in sorted(CODECS.items()):
+            size, encode, decode = measure(codec, event_attrs)
+            print(f"{payload:>10} {name:>8} {size:>8} {encode:>10.0f} {decode:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Compares the compiled blacklist DomainIndex with a scan of the BLACKLIST_DOMAINS list.
+
+    $ python -m benchmarks.bench_domain_index
+"""
+import random
+import timeit
+
+from utility.domain_index import DomainIndex
+from utility.fixtures import BLACKLIST_DOMAINS
+
+NUMBER = 10000
+
+
+def sample_domains(n=100, seed=0):
+    """Mix of blacklisted, blacklisted-subdomain and clean domains."""
+    rnd = random.Random(seed)
+    domains = []
+    for i in range(n):
+        kind = i % 3
+        if kind == 0:
+            domains.append(rnd.choice(BLACKLIST_DOMAINS))
+        elif kind == 1:
+            domains.append('mail.' + rnd.choice(BLACKLIST_DOMAINS))
+        else:
+            domains.append(f'company{i}.example.com')
+    return domains
+
+
+def main():
+    domains = sample_domains()
+    build = timeit.timeit(lambda: DomainIndex(BLACKLIST_DOMAINS), number=10) / 10
+    index = DomainIndex(BLACKLIST_DOMAINS)
+
+    def list_scan():
+        for domain in domains:
+            domain in BLACKLIST_DOMAINS
+
+    def index_lookup():
+        for domain in domains:
+            domain in index
+
+    list_time = timeit.timeit(list_scan, number=NUMBER // len(domains)) / NUMBER
+    index_time = timeit.timeit(index_lookup, number=NUMBER // len(domains)) / NUMBER
+    print(f"blacklist size:        {len(BLACKLIST_DOMAINS)}")
+    print(f"index build:           {build * 1e3:.2f} ms")
+    print(f"list scan lookup:      {list_time * 1e6:.2f} us")
+    print(f"domain index lookup:   {index_time * 1e6:.2f} us")
+    print(f"speedup:               {list_time / index_time:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Compares event write and read throughput of field-level and full-record encryption.
+
+Each row maps a User.Created event to a sequenced item and back. Field-level encryption
+encrypts the password and email. Full-record encryption encrypts the whole payload, with
+the library's AESCipher and with the cached KanbanAESCipher.
+
+    $ python -m benchmarks.bench_encryption
+"""
+import timeit
+from uuid import uuid4
+
+from eventsourcing.domain.services.aes_cipher import AESCipher
+
+from benchmarks.bench_snapshotting import PASSWORD_HASH
+from infrastructure.ciphers import get_cipher
+from infrastructure.transcoding import KanbanSequencedItemMapper
+from kanban.domain.model.user import User
+
+AES_KEY = '0123456789abcdef'
+NUMBER = 5000
+
+
+def construct_mapper(**kwargs):
+    return KanbanSequencedItemMapper(sequence_id_attr_name='originator_id',
+                                     position_attr_name='originator_version', codec='json', **kwargs)
+
+
+MAPPERS = (
+    ('none', construct_mapper(), True),
+    ('fields', construct_mapper(cipher=get_cipher(AES_KEY)), True),
+    ('fields, no decrypt', construct_mapper(cipher=get_cipher(AES_KEY)), False),
+    ('record', construct_mapper(cipher=get_cipher(AES_KEY), always_encrypt=True,
+                                encrypted_fields={User.Created: ()}), True),
+    ('record, library', construct_mapper(cipher=AESCipher(AES_KEY), always_encrypt=True,
+                                         encrypted_fields={User.Created: ()}), True),
+)
+
+
+def measure(mapper, decrypt, number=NUMBER):
+    """Returns events written and read per second."""
+    user_id = uuid4()
+    event = User.Created(originator_id=user_id, user_id=user_id, name="Name", password=PASSWORD_HASH,
+                         email='email@dot.com', default_domain='dot.com')
+    item = mapper.to_sequenced_item(event)
+    write = number / timeit.timeit(lambda: mapper.to_sequenced_item(event), number=number)
+    read = number / timeit.timeit(lambda: mapper.from_sequenced_item(item, decrypt=decrypt), number=number)
+    return write, read
+
+
+def main():
+    print(f"{'encryption':>20} {'writes/s':>10} {'reads/s':>10}")
+    for name, mapper, decrypt in MAPPERS:
+        write, read = measure(mapper, decrypt)
+        print(f"{name:>20} {write:>10.0f} {read:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
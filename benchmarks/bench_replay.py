@@ -0,0 +1,80 @@
+"""Measures how fast User events are replayed, and how much memory each event takes.
+
+Replays users with a Created event followed by AttributeChanged and DomainAdded events,
+both from events already in memory and from stored sequenced items, which adds the cost
+of decoding them.
+
+    $ python -m benchmarks.bench_replay
+"""
+import timeit
+import tracemalloc
+from functools import reduce
+
+from benchmarks.bench_snapshotting import PASSWORD_HASH
+from infrastructure.kanban_application import KanbanApplication, in_memory_application_kwargs
+from kanban.domain.model.user import User
+
+N_USERS = 200
+N_EVENTS = 50
+NUMBER = 5
+
+
+def create_events(app, n_users=N_USERS, n_events=N_EVENTS):
+    """Returns the stored items of each user."""
+    histories = []
+    for i in range(n_users):
+        user = User.create("Name", PASSWORD_HASH, f'email{i}@dot.com', 'dot.com')
+        for j in range(1, n_events):
+            if j % 2:
+                user.change_attribute('name', f"Name {j}")
+            else:
+                user.add_domain(f'domain{j}.com')
+        user.save()
+        histories.append(app.entity_event_store.active_record_strategy.get_items(user.id))
+    return histories
+
+
+def bytes_per_event(mapper, histories):
+    n_events = sum(map(len, histories))
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        events = [mapper.from_sequenced_item(item) for items in histories for item in items]
+        return (tracemalloc.get_traced_memory()[0] - before) / n_events
+    finally:
+        del events
+        tracemalloc.stop()
+
+
+def measure(number=NUMBER):
+    """Returns events replayed per second from memory and from stored items, and bytes per decoded event."""
+    app = KanbanApplication(**in_memory_application_kwargs())
+    try:
+        histories = create_events(app)
+        n_events = sum(map(len, histories)) * number
+        mapper = app.entity_event_store.sequenced_item_mapper
+        decoded = [[mapper.from_sequenced_item(item) for item in items] for items in histories]
+
+        def replay_events():
+            for events in decoded:
+                reduce(User._mutate, events, None)
+
+        def replay_items():
+            for items in histories:
+                reduce(User._mutate, map(mapper.from_sequenced_item, items), None)
+
+        from_events = n_events / timeit.timeit(replay_events, number=number)
+        from_items = n_events / timeit.timeit(replay_items, number=number)
+        return from_events, from_items, bytes_per_event(mapper, histories)
+    finally:
+        app.close()
+
+
+def main():
+    from_events, from_items, size = measure()
+    print(f"{'events/s':>10} {'items/s':>10} {'bytes/event':>12}")
+    print(f"{from_events:>10.0f} {from_items:>10.0f} {size:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Compares User create and replay times of the segment file store and SQLite.
+
+Both stores write to files in a temporary directory. Snapshotting is off, so replay
+reads every event.
+
+    $ python -m benchmarks.bench_segment_store
+"""
+import os
+import tempfile
+import time
+
+from eventsourcing.infrastructure.sqlalchemy.activerecords import IntegerSequencedItemRecord
+from eventsourcing.infrastructure.sqlalchemy.datastore import SQLAlchemySettings
+
+from benchmarks.bench_snapshotting import create_user_with_history
+from infrastructure.datastore import KanbanSQLAlchemyDatastore
+from infrastructure.kanban_application import KanbanApplication
+from infrastructure.record_strategies import EventLogRecord, KanbanSQLAlchemyActiveRecordStrategy
+from infrastructure.segment_store import SegmentFileActiveRecordStrategy
+
+N_USERS = 200
+HISTORY_LENGTH = 50
+SAVE_EVERY = 1
+
+
+def construct_sqlite_strategy(directory):
+    db = KanbanSQLAlchemyDatastore(
+        profile='throughput',
+        settings=SQLAlchemySettings(uri=f"sqlite:///{os.path.join(directory, 'event.db')}"),
+        tables=(IntegerSequencedItemRecord, EventLogRecord),
+    )
+    db.setup_connection()
+    db.setup_tables()
+    return KanbanSQLAlchemyActiveRecordStrategy(
+        active_record_class=IntegerSequencedItemRecord,
+        session=db.session,
+        read_session=db.read_session,
+        log_record_class=EventLogRecord
+    )
+
+
+def construct_segment_strategy(directory):
+    return SegmentFileActiveRecordStrategy(os.path.join(directory, 'segments'))
+
+
+def measure(construct_strategy, n_users=N_USERS, history_length=HISTORY_LENGTH):
+    """Returns mean seconds to create (saving every event) and to replay a user."""
+    with tempfile.TemporaryDirectory() as directory:
+        strategy = construct_strategy(directory)
+        app = KanbanApplication(entity_active_record_strategy=strategy)
+        try:
+            started = time.perf_counter()
+            user_ids = [create_user_with_history(history_length, batch_size=SAVE_EVERY) for _ in range(n_users)]
+            create = (time.perf_counter() - started) / n_users
+            started = time.perf_counter()
+            for user_id in user_ids:
+                app.user_repository.get_entity(user_id)
+            replay = (time.perf_counter() - started) / n_users
+            return create, replay
+        finally:
+            app.close()
+            if isinstance(strategy, SegmentFileActiveRecordStrategy):
+                strategy.close()
+
+
+def main():
+    print(f"{N_USERS} users of {HISTORY_LENGTH} events, each event saved on its own")
+    print(f"{'store':>10} {'create ms':>12} {'replay ms':>12}")
+    for name, construct_strategy in (('sqlite', construct_sqlite_strategy),
+                                     ('segments', construct_segment_strategy)):
+        create, replay = measure(construct_strategy)
+        print(f"{name:>10} {create * 1e3:>12.2f} {replay * 1e3:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Measures User load latency against history length, with and without snapshotting.
+
+    $ python -m benchmarks.bench_snapshotting
+"""
+import timeit
+
+from eventsourcing.infrastructure.sqlalchemy.activerecords import IntegerSequencedItemRecord, \
+    SQLAlchemyActiveRecordStrategy, SnapshotRecord
+from eventsourcing.infrastructure.sqlalchemy.datastore import ActiveRecord
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from infrastructure.kanban_application import KanbanApplication
+from kanban.domain.model.user import User
+
+PASSWORD_HASH = ('$pbkdf2-sha512$200000$rrU25pxTSsn5n5NyjvH.Pw$PKLSamXKl5S/guVvYVAodJr3tcCGkvEdRt0OtnZizsuGrWo'
+                 'whqVxzumih13hfnssE2jbJONXaAYXcm0ZZTa/dw')
+HISTORY_LENGTHS = (10, 100, 1000, 5000)
+NUMBER = 20
+
+
+def construct_application(snapshotting, uri='sqlite://'):
+    engine = create_engine(uri)
+    ActiveRecord.metadata.create_all(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    snapshot_active_record_strategy = None
+    if snapshotting:
+        snapshot_active_record_strategy = SQLAlchemyActiveRecordStrategy(
+            active_record_class=SnapshotRecord,
+            session=session
+        )
+    return KanbanApplication(
+        entity_active_record_strategy=SQLAlchemyActiveRecordStrategy(
+            active_record_class=IntegerSequencedItemRecord,
+            session=session
+        ),
+        snapshot_active_record_strategy=snapshot_active_record_strategy,
+    )
+
+
+def create_user_with_history(n_events, batch_size=100):
+    user = User.create("Name", PASSWORD_HASH, 'email@dot.com', 'dot.com')
+    for i in range(1, n_events):
+        user.change_attribute('name', f"Name {i}")
+        if not i % batch_size:
+            user.save()
+    user.save()
+    return user.id
+
+
+def measure(snapshotting, history_lengths=HISTORY_LENGTHS, number=NUMBER):
+    """Returns mean seconds to load a user, for each history length."""
+    app = construct_application(snapshotting)
+    try:
+        results = {}
+        for n_events in history_lengths:
+            user_id = create_user_with_history(n_events)
+            results[n_events] = timeit.timeit(lambda: app.user_repository[user_id], number=number) / number
+        return results
+    finally:
+        app.close()
+
+
+def main():
+    replay = measure(snapshotting=False)
+    snapshotted = measure(snapshotting=True)
+    print(f"{'events':>8} {'replay ms':>12} {'snapshot ms':>12}")
+    for n_events in HISTORY_LENGTHS:
+        print(f"{n_events:>8} {replay[n_events] * 1e3:>12.2f} {snapshotted[n_events] * 1e3:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
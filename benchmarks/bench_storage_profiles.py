@@ -0,0 +1,84 @@
+"""Measures event append throughput of each SQLite storage profile.
+
+Each event is appended, and committed, on its own: first from one thread, then from
+several threads through the group-commit strategy.
+
+    $ python -m benchmarks.bench_storage_profiles
+"""
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from eventsourcing.infrastructure.sequenceditem import SequencedItem
+from eventsourcing.infrastructure.sqlalchemy.activerecords import IntegerSequencedItemRecord
+from eventsourcing.infrastructure.sqlalchemy.datastore import SQLAlchemySettings
+
+from infrastructure.datastore import KanbanSQLAlchemyDatastore, STORAGE_PROFILES
+from infrastructure.record_strategies import EventLogRecord, GroupCommitActiveRecordStrategy, \
+    KanbanSQLAlchemyActiveRecordStrategy
+
+N_EVENTS = 2000
+THREADS = 8
+DATA = '{"name":"Name","value":"Changed"}'
+
+
+def construct_datastore(profile, path):
+    db = KanbanSQLAlchemyDatastore(
+        profile=profile,
+        settings=SQLAlchemySettings(uri=f'sqlite:///{path}'),
+        tables=(IntegerSequencedItemRecord, EventLogRecord),
+    )
+    db.setup_connection()
+    db.setup_tables()
+    return db
+
+
+def append_events(strategy, sequence_id, n_events):
+    for position in range(n_events):
+        strategy.append(SequencedItem(sequence_id, position, 'topic', DATA))
+
+
+def measure(profile, n_events=N_EVENTS, threads=THREADS):
+    """Returns events/sec appended serially and concurrently."""
+    with tempfile.TemporaryDirectory() as directory:
+        db = construct_datastore(profile, os.path.join(directory, 'bench.db'))
+        try:
+            strategy = KanbanSQLAlchemyActiveRecordStrategy(
+                active_record_class=IntegerSequencedItemRecord,
+                session=db.session,
+                read_session=db.read_session,
+                log_record_class=EventLogRecord
+            )
+            started = time.perf_counter()
+            append_events(strategy, uuid4(), n_events)
+            serial = n_events / (time.perf_counter() - started)
+
+            strategy = GroupCommitActiveRecordStrategy(
+                active_record_class=IntegerSequencedItemRecord,
+                session=db.session,
+                read_session=db.read_session,
+                log_record_class=EventLogRecord
+            )
+            per_thread = n_events // threads
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                futures = [executor.submit(append_events, strategy, uuid4(), per_thread) for _ in range(threads)]
+                for future in futures:
+                    future.result()
+            concurrent = per_thread * threads / (time.perf_counter() - started)
+            return serial, concurrent
+        finally:
+            db.drop_connection()
+
+
+def main():
+    print(f"{'profile':>12} {'serial ev/s':>12} {f'{THREADS} threads ev/s':>18}")
+    for profile in sorted(STORAGE_PROFILES):
+        serial, concurrent = measure(profile)
+        print(f"{profile:>12} {serial:>12.0f} {concurrent:>18.0f}")
+
+
+if __name__ == '__main__':
+    main()
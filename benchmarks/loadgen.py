@@ -0,0 +1,252 @@
+"""Generates load against the app, and reports latency histograms and throughput per route.
+
+Requests are replayed from a JSONL file, one {"method", "path", "json", "params"} object
+per line, or synthesized with Faker as /NewUser requests, like the hypothesis tests. They
+are sent to the app in process through apistar's TestClient, to a server at a URL, or to a
+local gunicorn started for the run.
+
+By default the load is closed loop: each of --concurrency workers sends its next request
+as soon as the last one completes. With --rate, it is open loop: requests arrive at that
+mean rate with exponential gaps whatever the response times, and latency is measured from
+when each request was due, so time spent queued behind slow requests is counted.
+
+    $ python -m benchmarks.loadgen --synthesize 200 --concurrency 4
+    $ python -m benchmarks.loadgen --replay traffic.jsonl --rate 20 --target http://127.0.0.1:8000
+    $ python -m benchmarks.loadgen --synthesize 500 --rate 50 --gunicorn 4 --output load.json
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+import requests
+from apistar import TestClient
+from faker import Faker
+
+from utility.histogram import Histogram, exponential_buckets
+
+VALID_PASSWORDS = ['z$XsntEXK%I73Z$c', 'Mk91Q^U%']
+# 0.5 milliseconds to about 65 seconds.
+LATENCY_BUCKETS = exponential_buckets(0.0005, 2, 18)
+SEED = 0
+
+Record = namedtuple('Record', ['method', 'path', 'json', 'params'])
+
+
+def read_records(path):
+    """Yields the request records in a JSONL file. Only 'path' is required; 'method' defaults to GET."""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield Record(record.get('method', 'GET').upper(), record['path'], record.get('json'),
+                             record.get('params'))
+
+
+def synthesize_records(n, seed=SEED):
+    """Returns n /NewUser requests generated from seed.
+
+    Emails are prefixed with an ID unique to the run, so runs against a database that
+    already holds earlier runs' users don't conflict.
+    """
+    fake = Faker()
+    fake.seed(seed)
+    rnd = random.Random(seed)
+    run_id = uuid4().hex[:8]
+    return [
+        Record('POST', '/NewUser', {
+            'name': fake.name(),
+            'password': rnd.choice(VALID_PASSWORDS),
+            'email': f'{run_id}.{i}.{fake.email()}',
+            'default_domain': fake.domain_name(),
+        }, None)
+        for i in range(n)
+    ]
+
+
+class RouteStats(object):
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statuses = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, seconds, status):
+        self.latency.observe(seconds)
+        with self._lock:
+            self.statuses[status] += 1
+
+
+class LoadGenerator(object):
+    """Sends request records to a target, with one session per worker thread.
+
+    :param target: 'testclient' to call the app in process, or the base URL of a server.
+    """
+
+    def __init__(self, target='testclient', concurrency=1, rate=None, seed=SEED):
+        self.target = target
+        self.concurrency = concurrency
+        self.rate = rate
+        self.seed = seed
+        self.stats = OrderedDict()
+        self.elapsed = None
+        self._app = None
+        if target == 'testclient':
+            # Imported before the run starts, so the first requests aren't charged with setting up the app.
+            os.environ.setdefault('EVENT_STORE', 'memory')
+            from app import app
+            self._app = app
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            if self._app is not None:
+                session = TestClient(self._app)
+            else:
+                session = requests.Session()
+            self._local.session = session
+        return session
+
+    def _url(self, path):
+        return path if self.target == 'testclient' else self.target.rstrip('/') + path
+
+    def _route_stats(self, record):
+        route = f'{record.method} {record.path}'
+        stats = self.stats.get(route)
+        if stats is None:
+            with self._stats_lock:
+                stats = self.stats.setdefault(route, RouteStats())
+        return stats
+
+    def send(self, record, due):
+        """Sends a record and records its latency from due, a perf_counter time.
+
+        A request that fails without a response is recorded with the exception's class name as its status.
+        """
+        try:
+            response = self._session().request(record.method, self._url(record.path), json=record.json,
+                                               params=record.params)
+            status = response.status_code
+        except Exception as e:
+            # Runs on an executor thread that nothing waits on, so errors are only seen as statuses,
+            # e.g. an exception raised by the app under the test client.
+            status = type(e).__name__
+        self._route_stats(record).record(time.perf_counter() - due, status)
+
+    def run(self, records):
+        """Sends every record, then returns the stats of each route."""
+        rnd = random.Random(self.seed)
+        slots = threading.BoundedSemaphore(self.concurrency)
+        started = time.perf_counter()
+        due = started
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            for record in records:
+                if self.rate:
+                    due += rnd.expovariate(self.rate)
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    executor.submit(self.send, record, due)
+                else:
+                    slots.acquire()
+                    future = executor.submit(self.send, record, time.perf_counter())
+                    future.add_done_callback(lambda _: slots.release())
+        self.elapsed = time.perf_counter() - started
+        return self.stats
+
+    def report(self):
+        """Returns the results as a dict of route -> requests, throughput, statuses, quantiles and buckets."""
+        report = OrderedDict()
+        for route, stats in self.stats.items():
+            snapshot = stats.latency.snapshot()
+            report[route] = {
+                'requests': snapshot['count'],
+                'per_second': snapshot['count'] / self.elapsed,
+                'statuses': {str(status): n for status, n in stats.statuses.items()},
+                'mean_seconds': snapshot['sum'] / snapshot['count'],
+                'quantiles': {str(q): stats.latency.quantile(q) for q in (0.5, 0.9, 0.99)},
+                'buckets': [(bound, n) for bound, n in snapshot['buckets'][:-1]] + [('+Inf', snapshot['count'])],
+            }
+        return report
+
+
+def start_gunicorn(workers, port=None):
+    """Starts gunicorn serving app:app on a free local port, and waits until it accepts connections."""
+    if port is None:
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+                                '--bind', f'127.0.0.1:{port}', 'app:app'])
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.terminate()
+                raise RuntimeError("gunicorn didn't start.")
+            time.sleep(0.1)
+
+
+def print_report(report, elapsed):
+    print(f"{elapsed:.2f} s")
+    for route, result in report.items():
+        quantiles = result['quantiles']
+        print(f"\n{route}: {result['requests']} requests, {result['per_second']:.1f}/s, "
+              f"statuses {result['statuses']}")
+        print(f"  mean {result['mean_seconds'] * 1e3:.1f} ms, p50 <= {quantiles['0.5'] * 1e3:.1f} ms, "
+              f"p90 <= {quantiles['0.9'] * 1e3:.1f} ms, p99 <= {quantiles['0.99'] * 1e3:.1f} ms")
+        previous = 0
+        for bound, cumulative in result['buckets']:
+            n = cumulative - previous
+            previous = cumulative
+            if n:
+                label = '+Inf' if bound == '+Inf' else f'{bound * 1e3:.1f} ms'
+                print(f"  <= {label:>10} {n:>7} {'#' * max(1, round(40 * n / result['requests']))}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generates load against the app.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--replay', help="JSONL file of request records to send.")
+    source.add_argument('--synthesize', type=int, help="Number of /NewUser requests to synthesize.")
+    parser.add_argument('--target', default='testclient', help="'testclient', or the base URL of a server.")
+    parser.add_argument('--gunicorn', type=int, help="Start gunicorn with this many workers as the target.")
+    parser.add_argument('--concurrency', type=int, default=1, help="Requests in flight at once.")
+    parser.add_argument('--rate', type=float, help="Mean arrivals per second, for open loop load.")
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--output', help="File to write the report to, as JSON.")
+    args = parser.parse_args(argv)
+
+    records = read_records(args.replay) if args.replay else synthesize_records(args.synthesize, seed=args.seed)
+    gunicorn = None
+    target = args.target
+    if args.gunicorn:
+        gunicorn, target = start_gunicorn(args.gunicorn)
+    try:
+        generator = LoadGenerator(target, concurrency=args.concurrency, rate=args.rate, seed=args.seed)
+        generator.run(records)
+    finally:
+        if gunicorn is not None:
+            gunicorn.terminate()
+            gunicorn.wait()
+    report = generator.report()
+    print_report(report, generator.elapsed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'elapsed': generator.elapsed, 'routes': report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+"""Runs the benchmark suite, writes the results as JSON, and compares them with a baseline.
+
+Covers the domain model, the application with real and stubbed password hashing,
+repository loads against history length with and without snapshots, and /NewUser
+through apistar's TestClient. Datasets are generated from a fixed seed, so every run
+measures the same work. Each result is the best of REPEAT runs, in seconds per operation.
+
+    $ python -m benchmarks.suite --output baseline.json
+    $ python -m benchmarks.suite --baseline baseline.json --threshold 0.2
+
+Exits with status 1 if any benchmark is slower than the baseline by more than the
+threshold, a fraction of the baseline time.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import reduce
+from uuid import uuid4
+
+from benchmarks.bench_snapshotting import PASSWORD_HASH, construct_application, create_user_with_history
+from infrastructure.kanban_application import KanbanApplication, in_memory_application_kwargs
+from kanban.domain.model.user import User
+
+REPEAT = 3
+THRESHOLD = 0.1
+SEED = 0
+HISTORY_LENGTHS = (10, 100, 1000)
+PASSWORD = 'Mk91Q^U%'
+NAMES = ('Ada', 'Grace', 'Alan', 'Edsger', 'Barbara', 'Donald', 'Frances', 'Ken')
+DOMAINS = tuple(f'company{i}.example.com' for i in range(10))
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    """Registers a function returning seconds per operation as the benchmark called name."""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def best_of(func, number, repeat=REPEAT):
+    """Returns the fastest of repeat runs of func, in seconds per call."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def synthetic_users(seed=SEED):
+    """Yields an endless, reproducible sequence of (name, email, default_domain) with unique emails."""
+    rnd = random.Random(seed)
+    for i in itertools.count():
+        name = rnd.choice(NAMES)
+        domain = rnd.choice(DOMAINS)
+        yield f"{name} {i}", f'{name.lower()}.{i}@{domain}', domain
+
+
+class StubHashingExecutor(object):
+    """Returns a fixed password hash instead of hashing, to measure everything else."""
+
+    def submit(self, password):
+        future = Future()
+        future.set_result(PASSWORD_HASH)
+        return future
+
+    def map(self, passwords, on_progress=None):
+        return [PASSWORD_HASH for _ in passwords]
+
+    def shutdown(self, wait=True):
+        pass
+
+
+#
+# Domain.
+#
+@benchmark('domain.user_create')
+def user_create():
+    users = synthetic_users()
+
+    def create():
+        name, email, domain = next(users)
+        User.create(name, PASSWORD_HASH, email, domain)
+    return best_of(create, number=2000)
+
+
+@benchmark('domain.user_replay_per_event')
+def user_replay(n_events=100):
+    name, email, domain = next(synthetic_users())
+    user = User.create(name, PASSWORD_HASH, email, domain)
+    for i in range(1, n_events):
+        user.change_attribute('name', f"{name} {i}")
+    events = list(user._pending_events)
+    return best_of(lambda: reduce(User._mutate, events, None), number=200) / n_events
+
+
+#
+# Application.
+#
+def _new_user_benchmark(number, hashing_executor=None):
+    app = KanbanApplication(hashing_executor=hashing_executor, **in_memory_application_kwargs())
+    users = synthetic_users()
+
+    def new_user():
+        name, email, domain = next(users)
+        app.new_user(name, PASSWORD, email, domain)
+    try:
+        return best_of(new_user, number=number)
+    finally:
+        app.close()
+
+
+@benchmark('application.new_user')
+def new_user():
+    return _new_user_benchmark(number=5)
+
+
+@benchmark('application.new_user_stubbed_hashing')
+def new_user_stubbed_hashing():
+    return _new_user_benchmark(number=200, hashing_executor=StubHashingExecutor())
+
+
+#
+# Repository.
+#
+def _repository_load_benchmark(n_events, snapshotting):
+    def load():
+        app = construct_application(snapshotting)
+        try:
+            user_id = create_user_with_history(n_events)
+            return best_of(lambda: app.user_repository.get_entity(user_id), number=20)
+        finally:
+            app.close()
+    return load
+
+
+for _n_events in HISTORY_LENGTHS:
+    benchmark(f'repository.load_{_n_events}_events')(_repository_load_benchmark(_n_events, False))
+    benchmark(f'repository.load_{_n_events}_events_snapshotted')(_repository_load_benchmark(_n_events, True))
+
+
+#
+# HTTP.
+#
+@benchmark('http.new_user_stubbed_hashing')
+def http_new_user():
+    """Hashing takes hundreds of milliseconds, so it is stubbed to measure the request handling around it."""
+    os.environ.setdefault('EVENT_STORE', 'memory')
+    from apistar import TestClient
+    from app import app
+    from infrastructure.kanban_application import get_kanban_application
+
+    application = get_kanban_application()
+    hashing_executor, application.hashing_executor = application.hashing_executor, StubHashingExecutor()
+    client = TestClient(app)
+    users = synthetic_users()
+    # Emails must be unique, including across runs against a database event store.
+    run_id = uuid4().hex[:12]
+
+    def post():
+        name, email, domain = next(users)
+        response = client.post('/NewUser', json={
+            'name': name, 'password': PASSWORD, 'email': f'{run_id}.{email}', 'default_domain': domain})
+        assert response.status_code == 202, response.content
+    try:
+        return best_of(post, number=200)
+    finally:
+        application.hashing_executor = hashing_executor
+
+
+#
+# Results.
+#
+def run(pattern=None):
+    """Runs the benchmarks whose names contain pattern, or all of them.
+
+    :returns: Dict of benchmark name -> seconds per operation.
+    """
+    results = OrderedDict()
+    for name, func in BENCHMARKS.items():
+        if pattern is None or pattern in name:
+            results[name] = func()
+    return results
+
+
+def to_json(results):
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': {name: {'seconds': seconds, 'per_second': 1 / seconds} for name, seconds in results.items()},
+    }
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """Returns the benchmarks slower than in the baseline by more than threshold.
+
+    :param results: Dict of benchmark name -> seconds per operation.
+    :param baseline: Results previously written by to_json().
+    :param threshold: Allowed slowdown, as a fraction of the baseline time.
+    :returns: List of (name, baseline seconds, seconds) for each regression.
+    """
+    regressions = []
+    for name, seconds in results.items():
+        base = baseline['results'].get(name)
+        if base is not None and seconds > base['seconds'] * (1 + threshold):
+            regressions.append((name, base['seconds'], seconds))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the benchmark suite.")
+    parser.add_argument('--output', help="File to write the results to, as JSON.")
+    parser.add_argument('--baseline', help="Results file to compare the results with.")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help="Slowdown, as a fraction of the baseline time, that counts as a regression.")
+    parser.add_argument('--filter', help="Only run benchmarks whose names contain this.")
+    args = parser.parse_args(argv)
+
+    results = run(args.filter)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print(f"{'benchmark':<48} {'ms':>10} {'per second':>12} {'baseline ms':>12}")
+    for name, seconds in results.items():
+        base = baseline and baseline['results'].get(name)
+        base_ms = f"{base['seconds'] * 1e3:.3f}" if base else '-'
+        print(f"{name:<48} {seconds * 1e3:>10.3f} {1 / seconds:>12.0f} {base_ms:>12}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(to_json(results), f, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name, base, seconds in regressions:
+            print(f"REGRESSION {name}: {base * 1e3:.3f} ms -> {seconds * 1e3:.3f} ms "
+                  f"(+{seconds / base - 1:.0%})")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
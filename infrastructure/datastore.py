@@ -1,18 +1,141 @@
 import os
+from collections import namedtuple
 
-from eventsourcing.domain.services.aes_cipher import AESCipher
+from eventsourcing.infrastructure.datastore import DatastoreConnectionError
 from eventsourcing.infrastructure.sqlalchemy.activerecords import IntegerSequencedItemRecord, SnapshotRecord
 from eventsourcing.infrastructure.sqlalchemy.datastore import SQLAlchemyDatastore, SQLAlchemySettings
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from infrastructure.ciphers import get_cipher
+from infrastructure.projections.runner import ProjectionCheckpointRecord
+from infrastructure.projections.user_details import UserDetailsRecord
+from infrastructure.projections.user_domain_index import UserDomainRecord
+from infrastructure.projections.user_email_index import UserEmailRecord
+from infrastructure.record_strategies import EventLogRecord
 
 BASEDIR = os.path.dirname(os.path.abspath(__file__))
 DB_HOST = os.getenv('DB_HOST', f'sqlite:///{BASEDIR}/event.db')
 AES_KEY = os.getenv('AES_KEY', '0123456789abcdef')
-cipher = AESCipher(AES_KEY)
+cipher = get_cipher(AES_KEY)
+
+StorageProfile = namedtuple('StorageProfile', [
+    'journal_mode',  # PRAGMA journal_mode. WAL lets readers run alongside the writer.
+    'synchronous',  # PRAGMA synchronous. NORMAL in WAL mode can lose the last commits on power loss, not corrupt.
+    'mmap_size',  # PRAGMA mmap_size, in bytes. Reads through the mapping avoid a copy per page.
+    'cache_size',  # PRAGMA cache_size. Negative values are KiB.
+    'busy_timeout',  # PRAGMA busy_timeout, in milliseconds to wait for a lock before failing.
+    'writer_pool_size',
+    'reader_pool_size',
+])
+
+STORAGE_PROFILES = {
+    'durable': StorageProfile(journal_mode='WAL', synchronous='FULL', mmap_size=0, cache_size=-2000,
+                              busy_timeout=5000, writer_pool_size=5, reader_pool_size=10),
+    'throughput': StorageProfile(journal_mode='WAL', synchronous='NORMAL', mmap_size=256 * 2 ** 20,
+                                 cache_size=-64000, busy_timeout=5000, writer_pool_size=5, reader_pool_size=20),
+    'test': StorageProfile(journal_mode='MEMORY', synchronous='OFF', mmap_size=0, cache_size=-2000,
+                           busy_timeout=1000, writer_pool_size=5, reader_pool_size=5),
+}
+STORAGE_PROFILE = os.getenv('STORAGE_PROFILE', 'durable')
 
 _event_datastore = None
 
 
-def init_database(**kwargs):
+def _is_sqlite_file(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def _set_sqlite_pragmas(engine, profile, query_only=False):
+    """Applies profile to every connection the engine opens."""
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA journal_mode={profile.journal_mode}")
+            cursor.execute(f"PRAGMA synchronous={profile.synchronous}")
+            cursor.execute(f"PRAGMA mmap_size={int(profile.mmap_size)}")
+            cursor.execute(f"PRAGMA cache_size={int(profile.cache_size)}")
+            cursor.execute(f"PRAGMA busy_timeout={int(profile.busy_timeout)}")
+            if query_only:
+                cursor.execute("PRAGMA query_only=ON")
+        finally:
+            cursor.close()
+
+
+class KanbanSQLAlchemyDatastore(SQLAlchemyDatastore):
+    """
+    Datastore with separate writer and reader engines, configured by a storage profile.
+
+    Writes go through session and reads may go through read_session, so queries don't
+    wait for connections held by writers. An in-memory SQLite database only exists on
+    its own connection, so there both sessions share the writer engine.
+    """
+
+    def __init__(self, profile=None, **kwargs):
+        """
+        :param profile: Name of a STORAGE_PROFILES entry, or a StorageProfile. Defaults to STORAGE_PROFILE.
+        """
+        super(KanbanSQLAlchemyDatastore, self).__init__(**kwargs)
+        profile = profile or STORAGE_PROFILE
+        self.profile = STORAGE_PROFILES[profile] if isinstance(profile, str) else profile
+        self._read_engine = None
+        self._read_session = None
+
+    def setup_connection(self):
+        assert isinstance(self.settings, SQLAlchemySettings), self.settings
+        if not _is_sqlite_file(self.settings.uri):
+            super(KanbanSQLAlchemyDatastore, self).setup_connection()
+            self._read_engine = self._engine
+            return
+        self._engine = create_engine(
+            self.settings.uri,
+            poolclass=QueuePool,
+            pool_size=self.profile.writer_pool_size,
+            connect_args={'check_same_thread': False},
+        )
+        _set_sqlite_pragmas(self._engine, self.profile)
+        self._read_engine = create_engine(
+            self.settings.uri,
+            poolclass=QueuePool,
+            pool_size=self.profile.reader_pool_size,
+            connect_args={'check_same_thread': False},
+        )
+        _set_sqlite_pragmas(self._read_engine, self.profile, query_only=True)
+
+    def drop_connection(self):
+        if self._read_session:
+            self._read_session.close()
+        self._read_session = None
+        # Closes the pooled connections, which would otherwise stay open until garbage collected.
+        if self._read_engine is not None and self._read_engine is not self._engine:
+            self._read_engine.dispose()
+        self._read_engine = None
+        if self._engine is not None:
+            self._engine.dispose()
+        super(KanbanSQLAlchemyDatastore, self).drop_connection()
+
+    @property
+    def read_session(self):
+        if self._read_engine is None:
+            raise DatastoreConnectionError("Need to call setup_connection() first")
+        if self._read_engine is self._engine:
+            return self.session
+        if self._read_session is None:
+            self._read_session = scoped_session(sessionmaker(bind=self._read_engine))
+        return self._read_session
+
+
+def init_database(profile=None, **kwargs):
+    """Constructs the global datastore.
+
+    :param uri: Database URI. Defaults to event.db beside this module.
+    :param profile: Name of a STORAGE_PROFILES entry. Defaults to STORAGE_PROFILE.
+    """
     global _event_datastore
     if kwargs['uri'] is None:
         kwargs.pop('uri')
@@ -21,9 +144,11 @@ def init_database(**kwargs):
         uri = kwargs.pop('uri')
     if _event_datastore is not None:
         raise AssertionError("init_database() has already been called.")
-    _event_datastore = SQLAlchemyDatastore(
+    _event_datastore = KanbanSQLAlchemyDatastore(
+        profile=profile,
         settings=SQLAlchemySettings(uri=uri),
-        tables=(IntegerSequencedItemRecord, SnapshotRecord,),
+        tables=(IntegerSequencedItemRecord, EventLogRecord, SnapshotRecord, UserEmailRecord, UserDomainRecord,
+                UserDetailsRecord, ProjectionCheckpointRecord,),
         **kwargs
     )
     return _event_datastore
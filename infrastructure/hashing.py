@@ -0,0 +1,144 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+from passlib.handlers.pbkdf2 import pbkdf2_sha512
+
+from utility.metrics import metrics
+
+HASHING_WORKERS = int(os.getenv('HASHING_WORKERS', 0)) or os.cpu_count() or 1
+HASHING_QUEUE_DEPTH = int(os.getenv('HASHING_QUEUE_DEPTH', 0)) or HASHING_WORKERS * 4
+
+
+def encrypt_password(password):
+    return pbkdf2_sha512.encrypt(password, rounds=200000, salt_size=16)
+
+
+def encrypt_passwords(passwords):
+    return [encrypt_password(password) for password in passwords]
+
+
+class HashingQueueFull(Exception):
+    """Raised when too many passwords are already waiting to be hashed."""
+
+
+class PasswordHashingExecutor(object):
+    """
+    Hashes passwords in a pool of worker processes.
+
+    The number of passwords submitted but not yet hashed is bounded, so callers fail fast
+    instead of queueing behind a backlog of hundreds of milliseconds per hash. Batches
+    count against the same bound, and only take up to half of it at a time. The time from
+    submitting each password to its hash being ready is recorded as kanban_password_hash_seconds.
+    """
+
+    def __init__(self, max_workers=None, max_queue_depth=None):
+        self.max_workers = max_workers or HASHING_WORKERS
+        self.max_queue_depth = max_queue_depth or HASHING_QUEUE_DEPTH
+        self._slots = BoundedSemaphore(self.max_queue_depth)
+        self._executor = None
+        self._lock = Lock()
+
+    @property
+    def executor(self):
+        # The pool is started on first use, so constructing an application doesn't fork workers.
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, password):
+        """Submits a password for hashing.
+
+        :param password: Unencrypted password.
+        :raises HashingQueueFull: If max_queue_depth passwords are already waiting.
+        :returns: Future resolving to the password hash.
+        """
+        return self._submit(encrypt_password, password, 1)
+
+    def map(self, passwords, on_progress=None):
+        """Hashes a batch of passwords across the pool, blocking until all are hashed.
+
+        Batches are split into chunks so each worker hashes several passwords per round trip.
+        Each password takes a slot in the queue, as submitted ones do, and the chunks in
+        flight take at most half of max_queue_depth, so interactive submissions are queued
+        in between them.
+
+        :param passwords: Iterable of unencrypted passwords.
+        :param on_progress: Called with the number of passwords hashed so far, as each chunk is collected.
+        :raises HashingQueueFull: If the queue has no room for the next chunk.
+        :returns: List of password hashes, in the same order.
+        """
+        passwords = list(passwords)
+        window = max(1, self.max_queue_depth // 2)
+        chunksize = max(1, window // self.max_workers)
+        hashes = []
+        # (future, number of passwords) of each chunk. Their slots are released as they're
+        # collected, so the next chunk can't find the queue full of its own finished chunks.
+        in_flight = deque()
+        try:
+            for i in range(0, len(passwords), chunksize):
+                chunk = passwords[i:i + chunksize]
+                while in_flight and len(in_flight) * chunksize + len(chunk) > window:
+                    hashes.extend(self._collect(*in_flight.popleft()))
+                    if on_progress is not None:
+                        on_progress(len(hashes))
+                in_flight.append((self._submit(encrypt_passwords, chunk, len(chunk), release=False), len(chunk)))
+            while in_flight:
+                hashes.extend(self._collect(*in_flight.popleft()))
+                if on_progress is not None:
+                    on_progress(len(hashes))
+        except BaseException:
+            for future, n_passwords in in_flight:
+                future.cancel()
+                future.add_done_callback(lambda _, n=n_passwords: self._release_slots(n))
+            raise
+        return hashes
+
+    def _submit(self, fn, arg, n_passwords, release=True):
+        acquired = 0
+        try:
+            while acquired < n_passwords:
+                if not self._slots.acquire(blocking=False):
+                    raise HashingQueueFull(f"Password hashing queue is full ({self.max_queue_depth} pending).")
+                acquired += 1
+            future = self.executor.submit(fn, arg)
+        except BaseException:
+            self._release_slots(acquired)
+            raise
+        if release:
+            future.add_done_callback(lambda _: self._release_slots(n_passwords))
+        if metrics.enabled:
+            future.add_done_callback(self._timer(n_passwords))
+        return future
+
+    @staticmethod
+    def _timer(n_passwords):
+        """Returns a done callback recording, for each password of a future, the time since it was submitted."""
+        histogram = metrics.histogram('kanban_password_hash_seconds')
+        started = time.perf_counter()
+
+        def record(future):
+            if not future.cancelled():
+                seconds = time.perf_counter() - started
+                for _ in range(n_passwords):
+                    histogram.observe(seconds)
+        return record
+
+    def _collect(self, future, n_passwords):
+        try:
+            return future.result()
+        finally:
+            self._release_slots(n_passwords)
+
+    def _release_slots(self, n):
+        for _ in range(n):
+            self._slots.release()
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -1,13 +1,37 @@
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from uuid import uuid4
+
 from eventsourcing.application.base import ApplicationWithPersistencePolicies
+from eventsourcing.domain.model.events import publish
+from eventsourcing.domain.model.snapshot import Snapshot
+from eventsourcing.exceptions import RepositoryKeyError
 from eventsourcing.infrastructure.snapshotting import EventSourcedSnapshotStrategy
-from eventsourcing.infrastructure.sqlalchemy.activerecords import SQLAlchemyActiveRecordStrategy, \
-    IntegerSequencedItemRecord
-from passlib.handlers.pbkdf2 import pbkdf2_sha512
+from eventsourcing.infrastructure.sqlalchemy.activerecords import IntegerSequencedItemRecord, SnapshotRecord
+from eventsourcing.infrastructure.sqlalchemy.datastore import ActiveRecord
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
 
 from infrastructure import datastore
 from infrastructure.datastore import get_database
+from infrastructure.hashing import PasswordHashingExecutor
 from infrastructure.kanban_repositories import UserRepository
+from infrastructure.projections.kanban_domain_policies import KanbanSnapshottingPolicy, SNAPSHOT_MAX_EVENTS
+from infrastructure.projections.runner import ProjectionRunner
+from infrastructure.projections.user_details import UserDetailsPolicy, user_details
+from infrastructure.projections.user_domain_index import UserDomainIndexPolicy
+from infrastructure.projections.user_email_index import EmailAlreadyRegistered, UserEmailIndexPolicy, \
+    normalize_email
+from infrastructure.record_strategies import EventLogRecord, GroupCommitActiveRecordStrategy, \
+    InMemoryActiveRecordStrategy, KanbanSQLAlchemyActiveRecordStrategy
+from infrastructure.transcoding import EVENT_CODEC, KanbanJSONDecoder, KanbanJSONEncoder, \
+    KanbanSequencedItemMapper, get_codec
 from kanban.domain.model.user import User
+from utility.metrics import metrics
 from utility.parse import valid_unencrypted_password, whitelist_domain
 
 PASSWORD_VALIDATION_MESSAGE = """Invalid password. Password must be at least 8 characters and contain:
@@ -15,6 +39,13 @@ PASSWORD_VALIDATION_MESSAGE = """Invalid password. Password must be at least 8 c
 * Number
 * Non-alphanumeric character: !@#$%^&*<>?"""
 SANITIZED_PASSWORD = "********"
+DEFAULT_DOMAIN = 'public.example.com'
+EXPORT_PAGE_SIZE = int(os.getenv('EXPORT_PAGE_SIZE', 1000))
+SNAPSHOTTING = os.getenv('SNAPSHOTTING', '1') == '1'
+# Threads that save users created by new_user_async() once their passwords are hashed.
+CREATE_USER_WORKERS = int(os.getenv('CREATE_USER_WORKERS', 4))
+
+NewUserResult = namedtuple('NewUserResult', ['user', 'error'])
 
 
 class KanbanApplication(ApplicationWithPersistencePolicies):
@@ -22,8 +53,22 @@ class KanbanApplication(ApplicationWithPersistencePolicies):
     An event source application
     """
 
-    def __init__(self, **kwargs):
+    def __init__(self, session=None, hashing_executor=None, snapshot_max_events=SNAPSHOT_MAX_EVENTS,
+                 snapshot_max_replay_time=None, codec=None, **kwargs):
+        """
+        :param session: SQLAlchemy session for read model projections. Without it, emails aren't kept unique.
+        :param hashing_executor: Executor used to hash passwords.
+        :param snapshot_max_events: Events since a user's last snapshot that trigger a snapshot.
+        :param snapshot_max_replay_time: Seconds taken to replay a user that trigger a snapshot.
+        :param codec: Name of the codec events are written with: 'json', 'ujson' or 'binary'.
+            Defaults to EVENT_CODEC. Events written with any codec can be read.
+        """
+        # Set before the event stores, and their sequenced item mappers, are constructed.
+        self.codec = get_codec(codec or EVENT_CODEC)
         super(KanbanApplication, self).__init__(**kwargs)
+        self.hashing_executor = hashing_executor or PasswordHashingExecutor()
+        # Threads are only started when users are first created through new_user_async().
+        self._create_user_executor = ThreadPoolExecutor(max_workers=CREATE_USER_WORKERS)
         self.snapshot_strategy = None
         if self.snapshot_event_store:
             self.snapshot_strategy = EventSourcedSnapshotStrategy(
@@ -35,6 +80,45 @@ class KanbanApplication(ApplicationWithPersistencePolicies):
             snapshot_strategy=self.snapshot_strategy,
 
         )
+        self.user_email_index = None
+        self.user_domain_index = None
+        self.user_details = None
+        self.projection_runner = None
+        if session is not None:
+            event_log = self.entity_event_store.active_record_strategy
+            self.user_email_index = UserEmailIndexPolicy(session=session, event_log=event_log)
+            self.user_domain_index = UserDomainIndexPolicy(session=session, event_log=event_log)
+            self.user_details = UserDetailsPolicy(session=session, event_log=event_log,
+                                                  repository=self.user_repository)
+            self.projection_runner = ProjectionRunner(
+                session=session,
+                sequenced_item_mapper=self.entity_event_store.sequenced_item_mapper,
+                active_record_strategy=self.entity_event_store.active_record_strategy,
+                projections=(self.user_email_index, self.user_domain_index, self.user_details),
+            )
+        self.snapshotting_policy = None
+        if self.snapshot_strategy:
+            self.snapshotting_policy = KanbanSnapshottingPolicy(
+                repository=self.user_repository,
+                max_events=snapshot_max_events,
+                max_replay_time=snapshot_max_replay_time,
+            )
+
+    def construct_sequenced_item_mapper(self, sequenced_item_class, event_sequence_id_attr, event_position_attr,
+                                        json_encoder_class=KanbanJSONEncoder, json_decoder_class=KanbanJSONDecoder,
+                                        always_encrypt=False, cipher=None):
+        return KanbanSequencedItemMapper(
+            sequenced_item_class=sequenced_item_class,
+            sequence_id_attr_name=event_sequence_id_attr,
+            position_attr_name=event_position_attr,
+            json_encoder_class=json_encoder_class,
+            json_decoder_class=json_decoder_class,
+            always_encrypt=always_encrypt,
+            cipher=cipher,
+            codec=self.codec,
+            # Snapshots hold the encrypted fields of the events they replace.
+            encrypted_fields={Snapshot: ('state',)}
+        )
 
     @staticmethod
     def _sanitize_user(user):
@@ -45,9 +129,45 @@ class KanbanApplication(ApplicationWithPersistencePolicies):
             return user
 
     @staticmethod
-    def get_encrypted_password(password):
-        return pbkdf2_sha512.encrypt(password, rounds=200000, salt_size=16)
+    def _validate_unencrypted_password(password):
+        try:
+            assert isinstance(password, str) and valid_unencrypted_password(password)
+        except AssertionError:
+            raise AttributeError(PASSWORD_VALIDATION_MESSAGE)
+
+    def _reserve_email(self, email):
+        """Reserves email for a new user, returning the ID the user must be created with."""
+        User._validate_email(email)
+        user_id = uuid4()
+        if self.user_email_index is not None:
+            self.user_email_index.reserve(email, user_id)
+        return user_id
+
+    def _release_email(self, email, user_id):
+        if self.user_email_index is not None:
+            self.user_email_index.release(email, user_id)
+
+    def _release_email_unless_stored(self, email, user_id, version):
+        """Releases email for user_id unless the user's event at version was stored.
 
+        Events are stored before the other policies handle them, so one of those failing
+        leaves the event, and the user it created or changed, in the event store. Their
+        email must stay reserved, or another user could register it.
+        """
+        strategy = self.entity_event_store.active_record_strategy
+        if not strategy.get_items(user_id, gte=version, lte=version):
+            self._release_email(email, user_id)
+
+    def _create_user(self, user_id, name, password_hash, email, default_domain):
+        try:
+            user = User.create(name, password_hash, email, default_domain, user_id=user_id)
+            user.save()
+        except Exception:
+            self._release_email_unless_stored(email, user_id, 0)
+            raise
+        return self._sanitize_user(user)
+
+    @metrics.timed('kanban_new_user_seconds')
     def new_user(self, name, password, email, default_domain) -> User:
         # def new_user(self, name, default_domain='public.example.com') -> User:
         """Creates a new user.
@@ -56,19 +176,278 @@ class KanbanApplication(ApplicationWithPersistencePolicies):
         :param password: Unencrypted password.
         :param default_domain: Valid domain name.
         :raises AttributeError: If any user attributes are invalid.
+        :raises EmailAlreadyRegistered: If another user has the same email.
+        :raises HashingQueueFull: If the password hashing queue is full.
         :returns: User object.
         """
-        # TODO: Make email unique constraint
+        self._validate_unencrypted_password(password)
+        whitelisted_domain = whitelist_domain(default_domain)
+        user_id = self._reserve_email(email)
         try:
-            assert valid_unencrypted_password(password)
-        except AssertionError:
-            raise AttributeError(PASSWORD_VALIDATION_MESSAGE)
-        else:
-            whitelisted_domain = whitelist_domain(default_domain)
-            password_hash = self.get_encrypted_password(password)
-            user = User.create(name, password_hash, email, whitelisted_domain)
+            password_hash = self.hashing_executor.submit(password).result()
+        except Exception:
+            self._release_email(email, user_id)
+            raise
+        return self._create_user(user_id, name, password_hash, email, whitelisted_domain)
+
+    def new_user_async(self, name, password, email, default_domain) -> Future:
+        """Creates a new user once the password has been hashed by the hashing executor.
+
+        The password is validated before this returns. Once the password is hashed, the user
+        is created and saved in a thread of its own, not in the thread that completes the
+        hashing future, which delivers the results of every other hash in flight.
+        :param name: Full name of user.
+        :param email: Valid email of user.
+        :param password: Unencrypted password.
+        :param default_domain: Valid domain name.
+        :raises AttributeError: If the password or email is invalid.
+        :raises EmailAlreadyRegistered: If another user has the same email.
+        :raises HashingQueueFull: If the password hashing queue is full.
+        :returns: Future resolving to the User object.
+        """
+        self._validate_unencrypted_password(password)
+        whitelisted_domain = whitelist_domain(default_domain)
+        user_id = self._reserve_email(email)
+        try:
+            hashed = self.hashing_executor.submit(password)
+        except Exception:
+            self._release_email(email, user_id)
+            raise
+        created = Future()
+
+        def create_user(future):
+            try:
+                password_hash = future.result()
+            except Exception as e:
+                self._release_email(email, user_id)
+                created.set_exception(e)
+                return
+            try:
+                user = self._create_user(user_id, name, password_hash, email, whitelisted_domain)
+            except Exception as e:
+                created.set_exception(e)
+            else:
+                created.set_result(user)
+
+        hashed.add_done_callback(lambda future: self._create_user_executor.submit(create_user, future))
+        return created
+
+    def change_user_email(self, user_id, email):
+        """Changes a user's email, reserving the new address first so it stays unique.
+        :param user_id: ID of the user.
+        :param email: New email address.
+        :raises AttributeError: If email is invalid.
+        :raises EmailAlreadyRegistered: If another user has the email.
+        :raises RepositoryKeyError: If there is no such user.
+        :returns: User object.
+        """
+        User._validate_email(email)
+        user = self.user_repository[user_id]
+        index = self.user_email_index
+        if index is not None and index.get_user_id(email) != user_id:
+            index.reserve(email, user_id)
+        version = user.version
+        try:
+            user.change_attribute('email', email)
             user.save()
-            return self._sanitize_user(user)
+        except Exception:
+            self._release_email_unless_stored(email, user_id, version)
+            raise
+        return self._sanitize_user(user)
+
+    def new_users(self, batch):
+        """Creates many users at once, e.g. when onboarding an organization.
+
+        Every row is validated, and its email reserved, before any password is hashed. The
+        passwords of valid rows are hashed in parallel, renewing the reservations while they
+        are, and all of their User.Created events are stored in a single transaction.
+        :param batch: Iterable of dicts with 'name', 'password', 'email' and optionally 'default_domain'.
+        :raises HashingQueueFull: If the password hashing queue fills up. No users are created.
+        :returns: List of NewUserResult, one per row in order. Each has either the created User or
+            the error that rejected the row: KeyError, AttributeError or EmailAlreadyRegistered.
+        """
+        results = []
+        valid = []
+        seen_emails = set()
+        for row, data in enumerate(batch):
+            try:
+                name, password, email, default_domain = self._validate_new_user_row(data)
+                if normalize_email(email) in seen_emails:
+                    raise EmailAlreadyRegistered(f"{email!r} appears more than once in the batch.")
+                seen_emails.add(normalize_email(email))
+            except (KeyError, AttributeError) as e:
+                results.append(NewUserResult(None, e))
+            else:
+                results.append(None)
+                valid.append((row, name, password, email, default_domain))
+
+        user_ids = {email: uuid4() for _, _, _, email, _ in valid}
+        rejected = set()
+        if self.user_email_index is not None and user_ids:
+            rejected = self.user_email_index.reserve_many(user_ids)
+        for row, _, _, email, _ in valid:
+            if email in rejected:
+                results[row] = NewUserResult(None, EmailAlreadyRegistered(f"{email!r} is already registered."))
+        valid = [(row, name, password, email, default_domain)
+                 for row, name, password, email, default_domain in valid if email not in rejected]
+
+        index = self.user_email_index
+        reserved = {email: user_ids[email] for _, _, _, email, _ in valid}
+        lost = set()
+        renewed_on = time.time()
+
+        def renew_reservations(n_hashed=0):
+            # Hashing a large batch outlasts the reservation timeout, after which another
+            # user could take the reservations over as abandoned, so they're renewed as it goes.
+            nonlocal renewed_on
+            if index is not None and time.time() - renewed_on > index.reservation_timeout / 4:
+                lost.update(index.renew(reserved))
+                renewed_on = time.time()
+
+        try:
+            password_hashes = self.hashing_executor.map(
+                (password for _, _, password, _, _ in valid), on_progress=renew_reservations)
+            renew_reservations()
+            if lost:
+                for row, _, _, email, _ in valid:
+                    if email in lost:
+                        results[row] = NewUserResult(None, EmailAlreadyRegistered(f"{email!r} is already registered."))
+                kept = [i for i, (_, _, _, email, _) in enumerate(valid) if email not in lost]
+                valid = [valid[i] for i in kept]
+                password_hashes = [password_hashes[i] for i in kept]
+            users = [
+                User.create(name, password_hash, email, default_domain, user_id=user_ids[email])
+                for (_, name, _, email, default_domain), password_hash in zip(valid, password_hashes)
+            ]
+        except Exception:
+            for _, _, _, email, _ in valid:
+                self._release_email(email, user_ids[email])
+            raise
+        # Publish every user's pending events as one batch, so they are stored in one transaction.
+        events = []
+        for user in users:
+            events.extend(user._pending_events)
+            user._pending_events.clear()
+        try:
+            if events:
+                publish(events)
+        except Exception:
+            # The events are stored all together or not at all, so the first user tells for every one.
+            if not self.entity_event_store.active_record_strategy.get_items(users[0].id, lte=0):
+                for _, _, _, email, _ in valid:
+                    self._release_email(email, user_ids[email])
+            raise
+        for (row, _, _, _, _), user in zip(valid, users):
+            results[row] = NewUserResult(self._sanitize_user(user), None)
+        return results
+
+    @classmethod
+    def _validate_new_user_row(cls, data):
+        if not isinstance(data, dict):
+            raise AttributeError(f"{data!r} is not a valid user. Each user must be an object.")
+        name, password, email = data['name'], data['password'], data['email']
+        default_domain = data.get('default_domain', DEFAULT_DOMAIN)
+        cls._validate_unencrypted_password(password)
+        User._validate_name(name)
+        User._validate_email(email)
+        if not isinstance(default_domain, str):
+            raise AttributeError(f"{default_domain!r} is not a valid User domain.")
+        default_domain = User._validate_domain(whitelist_domain(default_domain))
+        return name, password, email, default_domain
+
+    def catch_up_projections(self):
+        """Applies events the read model projections missed, e.g. while the application was down.
+        :returns: Dict of the number of events applied to each projection.
+        """
+        if self.projection_runner is None:
+            return {}
+        return self.projection_runner.catch_up()
+
+    def get_user(self, user_id, version=None, at=None):
+        """Returns the details of a user, or of the user as it was at a past version or time.
+
+        The current user is read from the user details read model when there is one, so
+        it isn't replayed. Users the read model has no row for, e.g. because applying their
+        Created event failed, and past states are replayed from the event store.
+        :param user_id: ID of the user.
+        :param version: Version the user had, i.e. the number of events applied to it.
+        :param at: Unix timestamp the user is read as of.
+        :returns: Dict of the user's details and version, with its password sanitized, or None
+            if it doesn't exist (or didn't then).
+        """
+        if version is None and at is None:
+            details = None
+            if self.user_details is not None:
+                details = self.user_details.get_details(user_id)
+            if details is None:
+                try:
+                    details = user_details(self.user_repository[user_id])
+                except RepositoryKeyError:
+                    details = None
+        else:
+            user = self.user_repository.get_as_of(user_id, version=version, at=at)
+            details = user_details(user) if user is not None else None
+        if details is not None:
+            details['password'] = SANITIZED_PASSWORD
+        return details
+
+    def export_events(self, from_position=1, topic=None, originator_id=None, page_size=EXPORT_PAGE_SIZE):
+        """Yields the stored events in the order they were written, reading a page at a time.
+
+        Only one page is held in memory, and each page is read in its own short query, so the
+        export can be consumed as slowly as a client likes. Encrypted fields stay encrypted.
+        :param from_position: Log position of the first event to export.
+        :param topic: Only export events with this topic.
+        :param originator_id: Only export events of this entity.
+        :param page_size: Number of events read per query.
+        :returns: Generator of dicts with the log position, originator ID and version, topic
+            and attributes of each event.
+        """
+        active_record_strategy = self.entity_event_store.active_record_strategy
+        sequenced_item_mapper = self.entity_event_store.sequenced_item_mapper
+        field_names = active_record_strategy.field_names
+        after = from_position - 1
+        while True:
+            page = active_record_strategy.get_log_page(after, limit=page_size, topic=topic,
+                                                       sequence_id=originator_id)
+            for after, item in page:
+                yield {
+                    "position": after,
+                    "originator_id": str(getattr(item, field_names.sequence_id)),
+                    "originator_version": getattr(item, field_names.position),
+                    "topic": getattr(item, field_names.topic),
+                    "data": sequenced_item_mapper.to_jsonable_attrs(item),
+                }
+            if len(page) < page_size:
+                return
+
+    def list_users(self, domain_namespace, cursor=None, limit=100):
+        """Lists the IDs of users occupying a domain, one page at a time.
+        :param domain_namespace: Domain namespace, e.g. 'public.example.com'.
+        :param cursor: Cursor returned with the previous page, or None for the first page.
+        :param limit: Maximum number of user IDs in the page.
+        :returns: Tuple of (user IDs, cursor for the next page or None).
+        """
+        assert self.user_domain_index is not None, "Listing users needs the read model session."
+        return self.user_domain_index.list_user_ids(domain_namespace, after=cursor, limit=limit)
+
+    def close(self):
+        self.user_repository.close()
+        if self.snapshotting_policy is not None:
+            self.snapshotting_policy.close()
+            self.snapshotting_policy = None
+        if self.user_email_index is not None:
+            self.user_email_index.close()
+            self.user_email_index = None
+        if self.user_domain_index is not None:
+            self.user_domain_index.close()
+            self.user_domain_index = None
+        if self.user_details is not None:
+            self.user_details.close()
+            self.user_details = None
+        self.hashing_executor.shutdown()
+        self._create_user_executor.shutdown()
+        super(KanbanApplication, self).close()
 
 
 def construct_kanban_application(**kwargs):
@@ -79,13 +458,51 @@ def construct_kanban_application(**kwargs):
 _kanban_application = None
 
 
-def init_kanban_application(**kwargs):
+def _memory_database_engine():
+    """Returns an engine on a new in-memory SQLite database that threads take turns to use.
+
+    A pool of one connection serializes the sessions of concurrent threads: each waits to
+    check the connection out, and has it to itself until its session is closed, so their
+    transactions don't interleave on it. The database is shared-cache and held open by a
+    connection of its own, so it outlives any connection the pool replaces.
+    """
+    uri = f'file:kanban-{uuid4().hex}?mode=memory&cache=shared'
+
+    def connect(_database=sqlite3.connect(uri, uri=True, check_same_thread=False)):
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+    return create_engine('sqlite://', creator=connect, poolclass=QueuePool, pool_size=1, max_overflow=0)
+
+
+def in_memory_application_kwargs(snapshotting=SNAPSHOTTING):
+    """Returns KanbanApplication arguments that keep events in memory.
+
+    The read model projections use an in-memory SQLite database, one thread at a time.
+    """
+    engine = _memory_database_engine()
+    ActiveRecord.metadata.create_all(engine)
+    snapshot_active_record_strategy = None
+    if snapshotting:
+        snapshot_active_record_strategy = InMemoryActiveRecordStrategy(active_record_class=SnapshotRecord)
+    return dict(
+        entity_active_record_strategy=InMemoryActiveRecordStrategy(active_record_class=IntegerSequencedItemRecord),
+        snapshot_active_record_strategy=snapshot_active_record_strategy,
+        session=scoped_session(sessionmaker(bind=engine)),
+    )
+
+
+def init_kanban_application(backend=None, **kwargs):
     """
     Constructs single global instance of application.
+    :param backend: 'memory' to keep events in memory, for tests and benchmarks. By default
+        the given active record strategies are used.
     """
     global _kanban_application
     if _kanban_application is not None:
         raise AssertionError("init_kanban_application() has already been called.")
+    if backend == 'memory':
+        kwargs = dict(in_memory_application_kwargs(), **kwargs)
+    elif backend is not None:
+        raise ValueError(f"Unknown backend {backend!r}.")
     _kanban_application = construct_kanban_application(**kwargs)
 
 
@@ -109,14 +526,29 @@ def close_kanban_application():
     _kanban_application = None
 
 
-def init_kanban_application_w_sqlalchemy(db_host=None):
-    datastore.init_database(uri=db_host)
+def init_kanban_application_w_sqlalchemy(db_host=None, snapshotting=SNAPSHOTTING, storage_profile=None):
+    datastore.init_database(uri=db_host, profile=storage_profile)
     db = get_database()
     db.setup_connection()
     db.setup_tables()
+    snapshot_active_record_strategy = None
+    if snapshotting:
+        snapshot_active_record_strategy = KanbanSQLAlchemyActiveRecordStrategy(
+            active_record_class=SnapshotRecord,
+            session=db.session,
+            read_session=db.read_session
+        )
     init_kanban_application(
-        entity_active_record_strategy=SQLAlchemyActiveRecordStrategy(
+        entity_active_record_strategy=GroupCommitActiveRecordStrategy(
             active_record_class=IntegerSequencedItemRecord,
-            session=db.session
-        )
+            session=db.session,
+            read_session=db.read_session,
+            log_record_class=EventLogRecord
+        ),
+        snapshot_active_record_strategy=snapshot_active_record_strategy,
+        session=db.session,
+        cipher=datastore.cipher
     )
+    # Databases written before the event log was kept are numbered by rowid, as they were read.
+    get_kanban_application().entity_event_store.active_record_strategy.backfill_log()
+    get_kanban_application().catch_up_projections()
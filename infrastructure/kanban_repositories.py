@@ -1,12 +1,282 @@
+import os
+import time
+from collections import OrderedDict, namedtuple
+from copy import deepcopy
+from threading import Lock
+
+from eventsourcing.domain.model.events import subscribe, unsubscribe
 from eventsourcing.example.domainmodel import AbstractExampleRepository
 from eventsourcing.infrastructure.eventsourcedrepository import EventSourcedRepository
+from eventsourcing.infrastructure.snapshotting import entity_from_snapshot
 
 from kanban.domain.model.user import User
 
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 1000))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 300))
+USER_AS_OF_CACHE_SIZE = int(os.getenv('USER_AS_OF_CACHE_SIZE', 100))
+
+CachedUser = namedtuple('CachedUser', ['user', 'expires'])
+
 
 class UserRepository(EventSourcedRepository, AbstractExampleRepository):
     """
     Event sourced repository for the User domain model entity.
+
+    Keeps a bounded LRU cache of users. Events published in this process are applied to
+    cached users; before a cached user is returned its version is checked against the
+    last stored event, so users changed by other writers are replayed again.
+
+    Remembers how long the most recent replay of each user took, so snapshotting can
+    be triggered by measured replay cost.
+
+    Past states of users read with get_as_of() never change, so the most recently read
+    are kept in a separate LRU cache without expiry.
     """
     __page_size__ = 1000
-    mutator = User._mutate
\ No newline at end of file
+    __replay_times_size__ = 10000
+    __get_many_batch_size__ = 200
+    mutator = User._mutate
+
+    def __init__(self, *args, cache_size=USER_CACHE_SIZE, cache_ttl=USER_CACHE_TTL,
+                 as_of_cache_size=USER_AS_OF_CACHE_SIZE, **kwargs):
+        """
+        :param cache_size: Maximum number of cached users. Zero disables the cache.
+        :param cache_ttl: Seconds a user stays cached after it was loaded.
+        :param as_of_cache_size: Maximum number of cached past states of users. Zero disables the cache.
+        """
+        super(UserRepository, self).__init__(*args, **kwargs)
+        self._replay_times = OrderedDict()
+        self._replay_times_lock = Lock()
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._users = OrderedDict()
+        self._users_lock = Lock()
+        self._cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.as_of_cache_size = as_of_cache_size
+        self._past_users = OrderedDict()
+        if self.cache_size:
+            subscribe(predicate=self._is_user_event, handler=self._update_cached_users)
+
+    def close(self):
+        if self.cache_size:
+            unsubscribe(predicate=self._is_user_event, handler=self._update_cached_users)
+        self._users.clear()
+        self._past_users.clear()
+
+    @property
+    def cache_stats(self):
+        """Returns counts of cache hits, misses and evictions."""
+        return dict(self._cache_stats)
+
+    def __getitem__(self, entity_id):
+        if not self.cache_size:
+            return super(UserRepository, self).__getitem__(entity_id)
+        cached = self._users.get(entity_id)
+        if cached is not None:
+            if cached.expires > time.monotonic() and cached.user.version == self._get_stored_version(entity_id):
+                with self._users_lock:
+                    self._cache_stats['hits'] += 1
+                    if entity_id in self._users:
+                        self._users.move_to_end(entity_id)
+                    return deepcopy(cached.user)
+            self._evict(entity_id)
+        with self._users_lock:
+            self._cache_stats['misses'] += 1
+        user = super(UserRepository, self).__getitem__(entity_id)
+        self._cache_user(user)
+        return deepcopy(user)
+
+    def _get_stored_version(self, entity_id):
+        """Returns the version a user has after its last stored event, without replaying it."""
+        active_record_strategy = self.event_store.active_record_strategy
+        items = active_record_strategy.get_items(
+            sequence_id=entity_id, limit=1, query_ascending=False, results_ascending=False)
+        if items:
+            return getattr(items[0], active_record_strategy.field_names.position) + 1
+
+    def get_snapshot_version(self, entity_id):
+        """Returns the version of a user's last snapshot, or None if it has none, without decoding it."""
+        if self._snapshot_strategy is None:
+            return None
+        active_record_strategy = self._snapshot_strategy.event_store.active_record_strategy
+        if hasattr(active_record_strategy, 'get_last_items'):
+            item = active_record_strategy.get_last_items([entity_id]).get(entity_id)
+        else:
+            items = active_record_strategy.get_items(
+                sequence_id=entity_id, limit=1, query_ascending=False, results_ascending=False)
+            item = items[0] if items else None
+        if item is not None:
+            return getattr(item, active_record_strategy.field_names.position)
+
+    def _cache_user(self, user):
+        with self._users_lock:
+            self._users[user.id] = CachedUser(deepcopy(user), time.monotonic() + self.cache_ttl)
+            self._users.move_to_end(user.id)
+            while len(self._users) > self.cache_size:
+                self._users.popitem(last=False)
+                self._cache_stats['evictions'] += 1
+
+    def _evict(self, entity_id):
+        with self._users_lock:
+            if self._users.pop(entity_id, None) is not None:
+                self._cache_stats['evictions'] += 1
+
+    def _is_user_event(self, event):
+        if isinstance(event, (list, tuple)):
+            return any(map(self._is_user_event, event))
+        return isinstance(event, User.Event)
+
+    def _update_cached_users(self, event):
+        events = event if isinstance(event, (list, tuple)) else [event]
+        for e in events:
+            cached = self._users.get(e.originator_id)
+            if cached is None:
+                continue
+            if cached.user.version != e.originator_version or isinstance(e, User.Discarded):
+                self._evict(e.originator_id)
+            else:
+                with self._users_lock:
+                    self.mutator(cached.user, e)
+
+    def get_entity(self, entity_id, lt=None, lte=None):
+        started = time.perf_counter()
+        entity = super(UserRepository, self).get_entity(entity_id, lt=lt, lte=lte)
+        if lt is None and lte is None:
+            self._set_replay_time(entity_id, time.perf_counter() - started)
+        return entity
+
+    def get_as_of(self, entity_id, version=None, at=None):
+        """Returns a user as it was at a past version or time.
+
+        The user is replayed from its nearest snapshot at or before that version, with only
+        the events between the two. Given both a version and a time, the earlier is used.
+
+        :param version: Version the user had, i.e. the number of events applied to it.
+        :param at: Unix timestamp. The user as it was after its last event at or before it.
+        :returns: User object, or None if it didn't exist yet or had been discarded.
+        """
+        stored_version = self._get_stored_version(entity_id)
+        if stored_version is None:
+            return None
+        version = stored_version if version is None else min(version, stored_version)
+        if at is not None:
+            version = min(version, self._get_version_at(entity_id, at, stored_version))
+        if version <= 0:
+            return None
+        key = (entity_id, version)
+        with self._users_lock:
+            user = self._past_users.get(key)
+            if user is not None:
+                self._past_users.move_to_end(key)
+                return deepcopy(user)
+        user = self.get_entity(entity_id, lt=version)
+        if user is not None and self.as_of_cache_size:
+            with self._users_lock:
+                self._past_users[key] = deepcopy(user)
+                while len(self._past_users) > self.as_of_cache_size:
+                    self._past_users.popitem(last=False)
+        return user
+
+    def _get_version_at(self, entity_id, at, stored_version):
+        """Returns the number of a user's events with timestamps at or before at.
+
+        Event timestamps increase with their positions, so the positions are bisected,
+        reading one event per step.
+        """
+        active_record_strategy = self.event_store.active_record_strategy
+        mapper = self.event_store.sequenced_item_mapper
+        low, high = 0, stored_version
+        while low < high:
+            middle = (low + high) // 2
+            item = active_record_strategy.get_item(entity_id, middle)
+            if mapper.from_sequenced_item(item, decrypt=False).timestamp <= at:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get_many(self, entity_ids):
+        """Yields the users with the given IDs, in order, skipping any that don't exist or are discarded.
+
+        Users are loaded in batches: one query for the batch's latest snapshots and one for the
+        events after them, which are grouped by user and replayed. Bypasses the user cache.
+
+        :param entity_ids: Iterable of user IDs.
+        :returns: Generator of User objects.
+        """
+        entity_ids = list(entity_ids)
+        active_record_strategy = self.event_store.active_record_strategy
+        if not hasattr(active_record_strategy, 'get_items_after'):
+            for entity_id in entity_ids:
+                user = self.get_entity(entity_id)
+                if user is not None:
+                    yield user
+            return
+        for i in range(0, len(entity_ids), self.__get_many_batch_size__):
+            yield from self._get_batch(entity_ids[i:i + self.__get_many_batch_size__])
+
+    def _get_batch(self, entity_ids):
+        users = {}
+        positions = dict.fromkeys(entity_ids)
+        if self._snapshot_strategy is not None:
+            snapshot_store = self._snapshot_strategy.event_store
+            for entity_id, item in snapshot_store.active_record_strategy.get_last_items(entity_ids).items():
+                snapshot = snapshot_store.sequenced_item_mapper.from_sequenced_item(item)
+                users[entity_id] = entity_from_snapshot(snapshot)
+                positions[entity_id] = snapshot.originator_version
+        mapper = self.event_store.sequenced_item_mapper
+        for item in self.event_store.active_record_strategy.get_items_after(positions):
+            event = mapper.from_sequenced_item(item)
+            users[event.originator_id] = self.mutator(users.get(event.originator_id), event)
+        for entity_id in entity_ids:
+            user = users.get(entity_id)
+            if user is not None:
+                yield user
+
+    def scan(self, predicate=None, start=None, stop=None):
+        """Yields every user, in order of ID, holding at most one page of events and one user at a time.
+
+        Events are read in pages of __page_size__ rows ordered by originator and version, and
+        each user's events are replayed as they arrive. A user is yielded once its last event
+        has been read, and dropped before the next one is built. Discarded users are skipped.
+        Bypasses the user cache and snapshots.
+
+        :param predicate: Callable given each user; users for which it returns False aren't yielded.
+        :param start: Lowest user ID to scan, passed down to the query.
+        :param stop: User ID before which to stop, passed down to the query.
+        :returns: Generator of User objects.
+        """
+        active_record_strategy = self.event_store.active_record_strategy
+        mapper = self.event_store.sequenced_item_mapper
+        field_names = active_record_strategy.field_names
+        user, after = None, None
+        while True:
+            page = active_record_strategy.get_page(after=after, limit=self.__page_size__, start=start, stop=stop)
+            for item in page:
+                event = mapper.from_sequenced_item(item)
+                if user is not None and user.id != event.originator_id:
+                    if predicate is None or predicate(user):
+                        yield user
+                    user = None
+                user = self.mutator(user, event)
+            if len(page) < self.__page_size__:
+                break
+            last = page[-1]
+            after = (getattr(last, field_names.sequence_id), getattr(last, field_names.position))
+        if user is not None and (predicate is None or predicate(user)):
+            yield user
+
+    def get_replay_time(self, entity_id):
+        """Returns seconds taken by the last full replay of the entity, or None if not measured."""
+        return self._replay_times.get(entity_id)
+
+    def forget_replay_time(self, entity_id):
+        with self._replay_times_lock:
+            self._replay_times.pop(entity_id, None)
+
+    def _set_replay_time(self, entity_id, seconds):
+        with self._replay_times_lock:
+            self._replay_times[entity_id] = seconds
+            self._replay_times.move_to_end(entity_id)
+            if len(self._replay_times) > self.__replay_times_size__:
+                self._replay_times.popitem(last=False)
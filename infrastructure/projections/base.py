@@ -0,0 +1,94 @@
+from eventsourcing.domain.model.events import subscribe, unsubscribe
+
+from infrastructure.projections.runner import ProjectionCheckpointRecord
+from utility.metrics import metrics
+
+
+class ProjectionPolicy(object):
+    """
+    Keeps a read model up to date by applying published domain events to it.
+
+    Subclasses select events with is_event() and update their tables in apply(). Changes
+    made by apply() are committed once per published event or batch of events. The name
+    identifies the projection's checkpoint when it is caught up by a ProjectionRunner.
+    Projections that don't read encrypted event fields set decrypts to False, so the
+    runner doesn't decrypt them.
+
+    Given the event log, i.e. the entity active record strategy, a policy advances its
+    checkpoint past the events it handles in the transaction it applies them in. If it
+    fails to apply them, it holds the checkpoint before them until the runner applies them.
+
+    Projections that can be rebuilt from the current state of each user set record_class
+    to the table they write, and return the rows they hold for a user from rows(). The
+    table needs a user_id column, which rebuilding partitions it by.
+    """
+    name = None
+    decrypts = True
+    record_class = None
+
+    def __init__(self, session, event_log=None):
+        self.session = session
+        self.event_log = event_log
+        subscribe(predicate=self.trigger, handler=self.handle)
+
+    def close(self):
+        unsubscribe(predicate=self.trigger, handler=self.handle)
+
+    def trigger(self, event):
+        if isinstance(event, (list, tuple)):
+            return any(map(self.is_event, event))
+        return self.is_event(event)
+
+    def handle(self, event):
+        events = event if isinstance(event, (list, tuple)) else [event]
+        # The events were just stored, in this thread, by the persistence policy.
+        log_positions = self.event_log.get_appended_log_positions() if self.event_log is not None else None
+        with metrics.timer('kanban_policy_seconds', policy=self.name):
+            try:
+                for e in events:
+                    if self.is_event(e):
+                        self.apply(e)
+                if log_positions is not None:
+                    self._advance_checkpoint(log_positions[1])
+                self.session.commit()
+            except Exception:
+                self.session.rollback()
+                if log_positions is not None:
+                    self._hold_checkpoint(log_positions[0] - 1)
+                raise
+            finally:
+                self.session.close()
+
+    def _advance_checkpoint(self, position):
+        self.session.query(ProjectionCheckpointRecord).filter(
+            ProjectionCheckpointRecord.name == self.name,
+            ProjectionCheckpointRecord.position < position,
+            ProjectionCheckpointRecord.hold.is_(None),
+        ).update({'position': position}, synchronize_session=False)
+
+    def _hold_checkpoint(self, position):
+        try:
+            record = self.session.query(ProjectionCheckpointRecord).get(self.name)
+            if record is not None:
+                record.position = min(record.position, position)
+                record.hold = position if record.hold is None else min(record.hold, position)
+            self.session.commit()
+        except Exception:
+            # The error applying the events is raised either way.
+            self.session.rollback()
+
+    def is_event(self, event):
+        raise NotImplementedError()
+
+    def apply(self, event):
+        raise NotImplementedError()
+
+    @classmethod
+    def rows(cls, user):
+        """Returns the rows of record_class the projection holds for a user, as dicts."""
+        raise NotImplementedError()
+
+    @classmethod
+    def filter_rebuilt(cls, query):
+        """Filters a query of record_class to the rows rows() rebuilds. Defaults to all of them."""
+        return query
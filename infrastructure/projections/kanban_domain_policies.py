@@ -1,12 +1,41 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+
 from eventsourcing.domain.model.events import subscribe, unsubscribe
 
 from kanban.domain.model.user import User
+from utility.metrics import metrics
+
+SNAPSHOT_MAX_EVENTS = int(os.getenv('SNAPSHOT_MAX_EVENTS', 100))
+SNAPSHOT_MAX_REPLAY_MS = float(os.getenv('SNAPSHOT_MAX_REPLAY_MS', 0)) or None
 
 
 class KanbanSnapshottingPolicy(object):
-    def __init__(self, repository, period=2):
+    """
+    Snapshots a User when replaying it has become expensive.
+
+    Replay cost is measured as the number of events since the user's last snapshot and,
+    if max_replay_time is set, the time the repository took to replay the user last
+    time it was loaded. The version of each user's last snapshot is remembered for the
+    most recently snapshotted users, and read from the snapshot store for the others.
+    """
+    __snapshot_versions_size__ = 10000
+
+    def __init__(self, repository, max_events=SNAPSHOT_MAX_EVENTS, max_replay_time=None):
+        """
+        :param repository: UserRepository with a snapshot strategy.
+        :param max_events: Events since the last snapshot that trigger a new snapshot.
+        :param max_replay_time: Seconds of measured replay time that trigger a new snapshot.
+        """
+        if max_replay_time is None and SNAPSHOT_MAX_REPLAY_MS is not None:
+            max_replay_time = SNAPSHOT_MAX_REPLAY_MS / 1000
         self.repository = repository
-        self.period = period
+        self.max_events = max_events
+        self.max_replay_time = max_replay_time
+        # Version of each user's last snapshot, or -1 for none, as far as this process knows.
+        self._snapshot_versions = OrderedDict()
+        self._snapshot_versions_lock = Lock()
         subscribe(predicate=self.trigger, handler=self.take_snapshot)
 
     def close(self):
@@ -15,15 +44,43 @@ class KanbanSnapshottingPolicy(object):
     def trigger(self, event):
         if isinstance(event, (list)):
             return True
-        is_period = not (event.originator_version + 1) % self.period
-        is_type = isinstance(event, User.Event)
-        is_trigger = is_type and is_period
-        return is_trigger
+        if not isinstance(event, User.Event) or isinstance(event, User.Discarded):
+            return False
+        snapshot_version = self._snapshot_versions.get(event.originator_id)
+        # Users with fewer events than max_events can't need a snapshot, so aren't looked up.
+        if snapshot_version is None and event.originator_version + 1 >= self.max_events:
+            snapshot_version = self.repository.get_snapshot_version(event.originator_id)
+            snapshot_version = -1 if snapshot_version is None else snapshot_version
+            self._remember_snapshot_version(event.originator_id, snapshot_version)
+        events_since_snapshot = event.originator_version - (-1 if snapshot_version is None else snapshot_version)
+        if events_since_snapshot >= self.max_events:
+            return True
+        if self.max_replay_time is not None:
+            replay_time = self.repository.get_replay_time(event.originator_id)
+            return replay_time is not None and replay_time >= self.max_replay_time
+        return False
 
+    @metrics.timed('kanban_policy_seconds', policy='snapshotting')
     def take_snapshot(self, event):
         if isinstance(event, list):
+            # Only the last triggering event of each user in a batch needs a snapshot.
+            last_events = OrderedDict()
             for e in event:
                 if self.trigger(e):
-                    self.take_snapshot(e)
+                    last_events[e.originator_id] = e
+            for e in last_events.values():
+                self._take_snapshot(e)
         else:
-            self.repository.take_snapshot(event.originator_id, lte=event.originator_version)
+            self._take_snapshot(event)
+
+    def _take_snapshot(self, event):
+        self.repository.take_snapshot(event.originator_id, lte=event.originator_version)
+        self.repository.forget_replay_time(event.originator_id)
+        self._remember_snapshot_version(event.originator_id, event.originator_version)
+
+    def _remember_snapshot_version(self, entity_id, version):
+        with self._snapshot_versions_lock:
+            self._snapshot_versions[entity_id] = version
+            self._snapshot_versions.move_to_end(entity_id)
+            if len(self._snapshot_versions) > self.__snapshot_versions_size__:
+                self._snapshot_versions.popitem(last=False)
@@ -0,0 +1,180 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from uuid import UUID
+
+from eventsourcing.infrastructure.eventstore import EventStore
+from eventsourcing.infrastructure.sqlalchemy.activerecords import IntegerSequencedItemRecord
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql.expression import and_, or_
+
+from infrastructure import datastore
+from infrastructure.kanban_repositories import UserRepository
+from infrastructure.projections.runner import ProjectionCheckpointRecord
+from infrastructure.projections.user_details import UserDetailsPolicy
+from infrastructure.projections.user_domain_index import UserDomainIndexPolicy
+from infrastructure.projections.user_email_index import UserEmailIndexPolicy
+from infrastructure.record_strategies import KanbanSQLAlchemyActiveRecordStrategy
+from infrastructure.transcoding import KanbanJSONDecoder, KanbanJSONEncoder, KanbanSequencedItemMapper
+
+PROJECTIONS = {projection.name: projection
+               for projection in (UserEmailIndexPolicy, UserDomainIndexPolicy, UserDetailsPolicy)}
+# More partitions than workers, so a slow partition doesn't hold up the others, and the
+# rows of each partition are inserted, and freed, while the other partitions are read.
+PARTITIONS_PER_WORKER = 4
+# Rows whose keys are looked up per DELETE, when replacing rows keyed by something other than user_id.
+DELETE_KEYS_BATCH_SIZE = 100
+
+
+def partition_bounds(n):
+    """Splits the user ID space into n ranges of equal size.
+
+    User IDs are random UUIDs, so each range holds about the same number of users, and
+    the bounds are passed down to the query that reads the range.
+
+    :returns: List of (start, stop) UUIDs, where None is unbounded.
+    """
+    size = 2 ** 128 // n
+    bounds = [None] + [UUID(int=i * size) for i in range(1, n)] + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def project_partition(db_host, names, start, stop):
+    """Returns the rows each projection holds for the users with IDs in [start, stop).
+
+    Runs in a worker process. Users are streamed from the event store one at a time,
+    through a user repository without a cache, which doesn't subscribe to events.
+
+    :returns: Dict of projection name -> list of row dicts.
+    """
+    engine = create_engine(db_host, poolclass=NullPool)
+    try:
+        active_record_strategy = KanbanSQLAlchemyActiveRecordStrategy(
+            active_record_class=IntegerSequencedItemRecord,
+            session=scoped_session(sessionmaker(bind=engine))
+        )
+        repository = UserRepository(
+            event_store=EventStore(
+                active_record_strategy=active_record_strategy,
+                sequenced_item_mapper=KanbanSequencedItemMapper(
+                    sequenced_item_class=active_record_strategy.sequenced_item_class,
+                    sequence_id_attr_name='originator_id',
+                    position_attr_name='originator_version',
+                    json_encoder_class=KanbanJSONEncoder,
+                    json_decoder_class=KanbanJSONDecoder,
+                    cipher=datastore.cipher
+                ),
+            ),
+            cache_size=0
+        )
+        rows = {name: [] for name in names}
+        for user in repository.scan(start=start, stop=stop):
+            for name in names:
+                rows[name].extend(PROJECTIONS[name].rows(user))
+        return rows
+    finally:
+        engine.dispose()
+
+
+def _unique_rows(record_class, rows, keys):
+    """Returns the rows whose primary keys aren't in keys, and adds their keys to it."""
+    key_names = [column.name for column in inspect(record_class).primary_key]
+    unique_rows = []
+    for row in rows:
+        key = tuple(row[name] for name in key_names)
+        if key not in keys:
+            keys.add(key)
+            unique_rows.append(row)
+    return unique_rows
+
+
+def _replace_partition(session, projection, rows, start, stop, keys):
+    """Replaces the rows a projection holds for the users with IDs in [start, stop) with rows.
+
+    Rows keyed by something other than the user ID, such as emails, can be held by users
+    outside the partition, e.g. after their email changed, so those are replaced as well.
+
+    :returns: Number of rows inserted.
+    """
+    record_class = projection.record_class
+    rows = _unique_rows(record_class, rows, keys)
+    query = session.query(record_class)
+    if start is not None:
+        query = query.filter(record_class.user_id >= start)
+    if stop is not None:
+        query = query.filter(record_class.user_id < stop)
+    projection.filter_rebuilt(query).delete(synchronize_session=False)
+    key_columns = inspect(record_class).primary_key
+    if all(column.name != 'user_id' for column in key_columns):
+        for i in range(0, len(rows), DELETE_KEYS_BATCH_SIZE):
+            session.query(record_class).filter(or_(*(
+                and_(*(column == row[column.name] for column in key_columns))
+                for row in rows[i:i + DELETE_KEYS_BATCH_SIZE]
+            ))).delete(synchronize_session=False)
+    session.bulk_insert_mappings(record_class, rows)
+    return len(rows)
+
+
+def rebuild_projections(application, db_host, names=None, workers=None):
+    """Rebuilds read model projections from scratch, reading the users in parallel.
+
+    The user ID space is split into partitions that worker processes read from the event
+    store at db_host, replaying each user and returning the projections' rows for it. Each
+    partition's rows replace those of the users in its range in a short transaction of its
+    own, so writers wait for at most one partition at a time rather than the whole rebuild.
+    Rows the projections don't rebuild, such as the email reservations of users not yet
+    created, are kept. Once every partition is replaced, the checkpoints are set to the
+    head of the log as it was before the partitions were read. Events stored while
+    rebuilding are applied again by the next catch up, which is safe because projections
+    apply events idempotently.
+
+    :param application: KanbanApplication with a read model session.
+    :param db_host: URI of the database holding the events.
+    :param names: Names of the projections to rebuild. Defaults to all of them.
+    :param workers: Number of worker processes. Defaults to the number of CPUs.
+    :returns: Dict of the number of rows inserted into each projection.
+    """
+    runner = application.projection_runner
+    assert runner is not None, "Rebuilding projections needs the read model session."
+    names = list(names or runner.projections)
+    workers = workers or os.cpu_count()
+    head = runner.get_head_position()
+    counts = dict.fromkeys(names, 0)
+    # Users created before a projection's key was kept unique can share a key. The first row
+    # read is kept, where catching up would keep the row of the last event stored.
+    keys = {name: set() for name in names}
+    session = runner.session
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {
+            executor.submit(project_partition, db_host, names, start, stop): (start, stop)
+            for start, stop in partition_bounds(workers * PARTITIONS_PER_WORKER)
+        }
+        try:
+            for future in as_completed(futures):
+                start, stop = futures[future]
+                rows = future.result()
+                try:
+                    for name in names:
+                        counts[name] += _replace_partition(session, PROJECTIONS[name], rows[name], start, stop,
+                                                           keys[name])
+                    session.commit()
+                except Exception:
+                    session.rollback()
+                    raise
+                finally:
+                    session.close()
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+    try:
+        for name in names:
+            session.merge(ProjectionCheckpointRecord(name=name, position=head))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    return counts
@@ -0,0 +1,119 @@
+from functools import partial
+
+from eventsourcing.infrastructure.sqlalchemy.datastore import ActiveRecord
+from sqlalchemy.sql.schema import Column
+from sqlalchemy.sql.sqltypes import BigInteger, String
+
+from utility.metrics import metrics
+
+
+class ProjectionCheckpointRecord(ActiveRecord):
+    __tablename__ = 'projection_checkpoints'
+
+    # Name of the projection.
+    name = Column(String(255), primary_key=True)
+
+    # Application log position of the last record applied to the projection.
+    position = Column(BigInteger(), nullable=False)
+
+    # Set to the position before an event a policy failed to apply. Policies don't advance
+    # the checkpoint while it is held, and the runner releases it once it applies the event.
+    hold = Column(BigInteger())
+
+
+class ProjectionRunner(object):
+    """
+    Catches projections up with the events stored in the application log.
+
+    The log is read a page at a time through the get_log_page() method of the entity
+    active record strategy, which numbers the stored items in the order they were
+    written. Each page of records is applied to a projection and its checkpoint is
+    advanced in the same transaction, so a runner that is stopped part way resumes from
+    the last page it committed.
+
+    Projections need a 'name', the session they write to, 'decrypts', and is_event() and
+    apply() methods, as ProjectionPolicy has. apply() must be idempotent: events a policy
+    already applied when they were published are applied again while catching up. Policies
+    advance the checkpoints as they handle published events, so the lag of each projection,
+    which is exported as the kanban_projection_lag gauge, counts the events it has missed.
+    """
+    __page_size__ = 1000
+
+    def __init__(self, session, sequenced_item_mapper, active_record_strategy, projections=(), page_size=None):
+        """
+        :param session: Session the checkpoints are kept in.
+        :param active_record_strategy: Entity active record strategy the log is read from.
+        """
+        self.session = session
+        self.sequenced_item_mapper = sequenced_item_mapper
+        self.active_record_strategy = active_record_strategy
+        self.page_size = page_size or self.__page_size__
+        self.projections = {}
+        for projection in projections:
+            self.register(projection)
+
+    def register(self, projection):
+        self.projections[projection.name] = projection
+        metrics.gauge('kanban_projection_lag', partial(self.get_lag, projection.name), projection=projection.name)
+
+    def get_head_position(self):
+        """Returns the log position of the most recently stored record (0 if none)."""
+        return self.active_record_strategy.get_last_log_position()
+
+    def get_checkpoint(self, name):
+        """Returns the log position a projection has been applied up to (0 if never run)."""
+        try:
+            record = self.session.query(ProjectionCheckpointRecord).get(name)
+            return record.position if record is not None else 0
+        finally:
+            self.session.close()
+
+    def get_lag(self, name):
+        """Returns the number of log positions a projection is behind the head of the log."""
+        return self.get_head_position() - self.get_checkpoint(name)
+
+    def lag(self):
+        """Returns the number of log positions each projection is behind the head of the log."""
+        head = self.get_head_position()
+        return {name: head - self.get_checkpoint(name) for name in self.projections}
+
+    def catch_up(self):
+        """Applies all records stored since each projection's checkpoint.
+
+        :returns: Dict of the number of events applied to each projection.
+        """
+        return {name: self.run(projection) for name, projection in self.projections.items()}
+
+    def run(self, projection):
+        """Applies stored records to a projection, page by page, until it reaches the head of the log."""
+        applied = 0
+        position = self.get_checkpoint(projection.name)
+        while True:
+            page = self.active_record_strategy.get_log_page(position, limit=self.page_size)
+            session = projection.session
+            try:
+                for position, item in page:
+                    event = self.sequenced_item_mapper.from_sequenced_item(item, decrypt=projection.decrypts)
+                    if projection.is_event(event):
+                        projection.apply(event)
+                        applied += 1
+                self._save_checkpoint(session, projection.name, position)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+            if len(page) < self.page_size:
+                return applied
+
+    @staticmethod
+    def _save_checkpoint(session, name, position):
+        # The checkpoint is saved even if there was nothing to apply, so policies have one to advance.
+        record = session.query(ProjectionCheckpointRecord).get(name)
+        if record is None:
+            session.add(ProjectionCheckpointRecord(name=name, position=position))
+        else:
+            record.position = position
+            if record.hold is not None and position > record.hold:
+                record.hold = None
@@ -0,0 +1,184 @@
+import json
+from threading import local
+
+from eventsourcing.exceptions import RepositoryKeyError
+from eventsourcing.infrastructure.sqlalchemy.datastore import ActiveRecord
+from sqlalchemy.sql.schema import Column
+from sqlalchemy.sql.sqltypes import Float, Integer, String, Text
+from sqlalchemy_utils.types.uuid import UUIDType
+
+from infrastructure.projections.base import ProjectionPolicy
+from kanban.domain.model.user import User
+
+# User attributes AttributeChanged events can change that the read model holds.
+DETAIL_ATTRIBUTES = ('name', 'email', 'default_domain')
+
+
+class UserDetailsRecord(ActiveRecord):
+    __tablename__ = 'user_details'
+
+    # ID of the User aggregate.
+    user_id = Column(UUIDType(), primary_key=True)
+
+    name = Column(String(255), nullable=False)
+    email = Column(String(255), nullable=False)
+    default_domain = Column(String(255), nullable=False)
+
+    # JSON array of the user's domains, sorted.
+    domains = Column(Text(), nullable=False)
+
+    # Version of the user after the last event applied to the record.
+    version = Column(Integer(), nullable=False)
+
+    created_on = Column(Float(), nullable=False)
+    last_modified_on = Column(Float(), nullable=False)
+
+
+def user_details(user):
+    """Returns the details of a User entity in the form get_details() returns them."""
+    return {
+        'user_id': user.id,
+        'name': user.name,
+        'email': user.email,
+        'default_domain': user.default_domain,
+        'domains': sorted(user.domains),
+        'version': user.version,
+        '_created_on': user.created_on,
+        '_last_modified_on': user.last_modified_on,
+    }
+
+
+class UserDetailsPolicy(ProjectionPolicy):
+    """
+    Maintains one denormalized row per user, behind GetUser.
+
+    Reading a user is then a primary key lookup instead of a replay, and the row's
+    version tells whether a client's copy is current without loading the user. A user's
+    row is only inserted by its Created event if there isn't one, and other events are
+    only applied to the row at the version they follow. Applying an event again while
+    catching up leaves the row as it is. An event that arrives after a gap, e.g. after
+    an event the policy failed to apply, brings the row up to date by replaying the user.
+    """
+    name = 'user_details'
+    record_class = UserDetailsRecord
+
+    def __init__(self, session, event_log=None, repository=None):
+        """
+        :param repository: User repository that rows that missed events are replayed from.
+            Without one, the row is left for the runner to catch up.
+        """
+        super(UserDetailsPolicy, self).__init__(session, event_log=event_log)
+        self.repository = repository
+        self._behind = local()
+
+    def handle(self, event):
+        # Users whose rows missed events are replayed once the transaction the other events
+        # are applied in is over, since reading the event store may close the session.
+        self._behind.user_ids = set()
+        try:
+            super(UserDetailsPolicy, self).handle(event)
+        finally:
+            user_ids, self._behind.user_ids = self._behind.user_ids, None
+        for user_id in user_ids:
+            self._replay(user_id)
+
+    def is_event(self, event):
+        return isinstance(event, (User.Created, User.AttributeChanged, User.DomainAdded, User.DomainDiscarded,
+                                  User.Discarded))
+
+    def apply(self, event):
+        if isinstance(event, User.Created):
+            if self.session.query(UserDetailsRecord).get(event.originator_id) is not None:
+                return
+            self.session.add(UserDetailsRecord(**self._to_record({
+                'user_id': event.originator_id,
+                'name': event.name,
+                'email': event.email,
+                'default_domain': event.default_domain,
+                'domains': [event.default_domain],
+                'version': event.originator_version + 1,
+                '_created_on': event.timestamp,
+                '_last_modified_on': event.timestamp,
+            })))
+        elif isinstance(event, User.Discarded):
+            self.session.query(UserDetailsRecord).filter(
+                UserDetailsRecord.user_id == event.originator_id,
+            ).delete(synchronize_session=False)
+        else:
+            record = self.session.query(UserDetailsRecord).get(event.originator_id)
+            if record is None or record.version > event.originator_version:
+                return
+            if record.version < event.originator_version:
+                behind = getattr(self._behind, 'user_ids', None)
+                if behind is not None:
+                    behind.add(event.originator_id)
+                return
+            if isinstance(event, User.AttributeChanged):
+                if event.name in DETAIL_ATTRIBUTES:
+                    setattr(record, event.name, event.value)
+            else:
+                domains = set(json.loads(record.domains))
+                if isinstance(event, User.DomainAdded):
+                    domains.add(event.domain)
+                else:
+                    domains.discard(event.domain)
+                record.domains = json.dumps(sorted(domains))
+            record.version = event.originator_version + 1
+            record.last_modified_on = event.timestamp
+
+    def _replay(self, user_id):
+        if self.repository is None:
+            return
+        try:
+            user = self.repository[user_id]
+        except RepositoryKeyError:
+            user = None
+        try:
+            record = self.session.query(UserDetailsRecord).get(user_id)
+            if record is not None and user is None:
+                self.session.delete(record)
+            elif record is not None and record.version < user.version:
+                for name, value in self._to_record(user_details(user)).items():
+                    setattr(record, name, value)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        finally:
+            self.session.close()
+
+    @classmethod
+    def rows(cls, user):
+        return [cls._to_record(user_details(user))]
+
+    @staticmethod
+    def _to_record(details):
+        return dict(
+            user_id=details['user_id'],
+            name=details['name'],
+            email=details['email'],
+            default_domain=details['default_domain'],
+            domains=json.dumps(sorted(details['domains'])),
+            version=details['version'],
+            created_on=details['_created_on'],
+            last_modified_on=details['_last_modified_on'],
+        )
+
+    def get_details(self, user_id):
+        """Returns a dict of the user's details, including its version, or None if there is no such user."""
+        try:
+            record = self.session.query(UserDetailsRecord).get(user_id)
+            if record is None:
+                return None
+            return {
+                'user_id': record.user_id,
+                'name': record.name,
+                'email': record.email,
+                'default_domain': record.default_domain,
+                'domains': json.loads(record.domains),
+                'version': record.version,
+                '_created_on': record.created_on,
+                '_last_modified_on': record.last_modified_on,
+            }
+        finally:
+            self.session.close()
@@ -0,0 +1,74 @@
+from eventsourcing.infrastructure.sqlalchemy.datastore import ActiveRecord
+from sqlalchemy.sql.schema import Column
+from sqlalchemy.sql.sqltypes import String
+from sqlalchemy_utils.types.uuid import UUIDType
+
+from infrastructure.projections.base import ProjectionPolicy
+from kanban.domain.model.user import User
+from utility.domain_index import normalize_domain
+
+
+class UserDomainRecord(ActiveRecord):
+    __tablename__ = 'user_domains'
+
+    # Normalized domain namespace.
+    domain = Column(String(255), primary_key=True)
+
+    # ID of a User aggregate occupying the domain.
+    user_id = Column(UUIDType(), primary_key=True, index=True)
+
+
+class UserDomainIndexPolicy(ProjectionPolicy):
+    """
+    Maintains the domain -> user_ids read model behind ListUsers.
+
+    The (domain, user_id) primary key lets a page of a domain's users be read with an
+    index range scan that starts after the previous page's last user_id.
+    """
+    name = 'user_domain_index'
+    decrypts = False
+    record_class = UserDomainRecord
+
+    def is_event(self, event):
+        return isinstance(event, (User.Created, User.DomainAdded, User.DomainDiscarded, User.Discarded))
+
+    def apply(self, event):
+        if isinstance(event, User.Created):
+            self._add(event.default_domain, event.originator_id)
+        elif isinstance(event, User.DomainAdded):
+            self._add(event.domain, event.originator_id)
+        elif isinstance(event, User.DomainDiscarded):
+            self.session.query(UserDomainRecord).filter(
+                UserDomainRecord.domain == normalize_domain(event.domain),
+                UserDomainRecord.user_id == event.originator_id,
+            ).delete(synchronize_session=False)
+        elif isinstance(event, User.Discarded):
+            self.session.query(UserDomainRecord).filter(
+                UserDomainRecord.user_id == event.originator_id,
+            ).delete(synchronize_session=False)
+
+    @classmethod
+    def rows(cls, user):
+        return [dict(domain=domain, user_id=user.id) for domain in set(map(normalize_domain, user.domains))]
+
+    def _add(self, domain, user_id):
+        self.session.merge(UserDomainRecord(domain=normalize_domain(domain), user_id=user_id))
+
+    def list_user_ids(self, domain, after=None, limit=100):
+        """Returns a page of the IDs of users in a domain, ordered by ID.
+
+        :param domain: Domain namespace.
+        :param after: Cursor returned with the previous page, or None for the first page.
+        :param limit: Maximum number of IDs in the page.
+        :returns: Tuple of (user IDs, cursor for the next page or None if this is the last page).
+        """
+        try:
+            query = self.session.query(UserDomainRecord.user_id).filter(
+                UserDomainRecord.domain == normalize_domain(domain))
+            if after is not None:
+                query = query.filter(UserDomainRecord.user_id > after)
+            user_ids = [user_id for user_id, in query.order_by(UserDomainRecord.user_id).limit(limit)]
+        finally:
+            self.session.close()
+        next_cursor = user_ids[-1] if len(user_ids) == limit else None
+        return user_ids, next_cursor
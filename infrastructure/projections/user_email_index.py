@@ -0,0 +1,211 @@
+import time
+
+from eventsourcing.infrastructure.sqlalchemy.datastore import ActiveRecord
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.schema import Column
+from sqlalchemy.sql.sqltypes import Boolean, Float, String
+from sqlalchemy_utils.types.uuid import UUIDType
+
+from infrastructure.projections.base import ProjectionPolicy
+from kanban.domain.model.user import User
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class EmailAlreadyRegistered(AttributeError):
+    """Raised when an email address already belongs to, or is reserved for, another user."""
+
+
+class UserEmailRecord(ActiveRecord):
+    __tablename__ = 'user_emails'
+
+    # Normalized email address.
+    email = Column(String(255), primary_key=True)
+
+    # ID of the User aggregate that owns (or is being created with) the address.
+    user_id = Column(UUIDType(), nullable=False, index=True)
+
+    # False while the address is only reserved by a create in progress.
+    is_confirmed = Column(Boolean(), nullable=False, default=False)
+
+    # When the reservation was made, used to expire abandoned reservations.
+    reserved_on = Column(Float())
+
+
+class UserEmailIndexPolicy(ProjectionPolicy):
+    """
+    Maintains the email -> user_id index used to keep User emails unique.
+
+    New users reserve their address before they are created. The primary key on the
+    normalized email means only one of two concurrent reservations can succeed. The
+    reservation is confirmed when the User.Created event is published.
+    """
+    name = 'user_email_index'
+    record_class = UserEmailRecord
+    reservation_timeout = 60
+    __in_clause_size__ = 500
+
+    def is_event(self, event):
+        if isinstance(event, User.AttributeChanged):
+            return event.name == 'email'
+        return isinstance(event, (User.Created, User.Discarded))
+
+    def apply(self, event):
+        if isinstance(event, User.Created):
+            self._confirm(event.email, event.originator_id)
+        elif isinstance(event, User.AttributeChanged):
+            if self._is_owned_by_other_user(event.value, event.originator_id):
+                return
+            self._delete(event.originator_id)
+            self._confirm(event.value, event.originator_id)
+        elif isinstance(event, User.Discarded):
+            self._delete(event.originator_id)
+
+    @classmethod
+    def rows(cls, user):
+        return [dict(email=normalize_email(user.email), user_id=user.id, is_confirmed=True, reserved_on=None)]
+
+    @classmethod
+    def filter_rebuilt(cls, query):
+        # Reservations of users that haven't been created yet aren't in the event store.
+        return query.filter(UserEmailRecord.is_confirmed.is_(True))
+
+    def _confirm(self, email, user_id):
+        """Confirms user_id's reservation of email, or registers it if it is free.
+
+        An address registered or reserved by another user is left to them: an event that
+        got past reserve() mustn't take over another user's address.
+        """
+        record = self.session.query(UserEmailRecord).get(normalize_email(email))
+        if record is None:
+            self.session.add(UserEmailRecord(
+                email=normalize_email(email),
+                user_id=user_id,
+                is_confirmed=True,
+                reserved_on=None,
+            ))
+        elif record.user_id == user_id:
+            record.is_confirmed = True
+            record.reserved_on = None
+
+    def _is_owned_by_other_user(self, email, user_id):
+        record = self.session.query(UserEmailRecord).get(normalize_email(email))
+        return record is not None and record.user_id != user_id
+
+    def _delete(self, user_id):
+        self.session.query(UserEmailRecord).filter(UserEmailRecord.user_id == user_id).delete()
+
+    def get_user_id(self, email):
+        """Returns the ID of the user registered with email, or None."""
+        try:
+            record = self.session.query(UserEmailRecord).get(normalize_email(email))
+            if record is not None and record.is_confirmed:
+                return record.user_id
+        finally:
+            self.session.close()
+
+    def reserve(self, email, user_id):
+        """Reserves email for a user that is about to be created.
+
+        :param email: Email address.
+        :param user_id: ID the new User will be created with.
+        :raises EmailAlreadyRegistered: If email is registered or reserved by a create in progress.
+        """
+        email = normalize_email(email)
+        now = time.time()
+        try:
+            self.session.add(UserEmailRecord(email=email, user_id=user_id, is_confirmed=False, reserved_on=now))
+            self.session.commit()
+        except IntegrityError:
+            self.session.rollback()
+            # Take over a reservation left behind by a create that never completed.
+            taken_over = self.session.query(UserEmailRecord).filter(
+                UserEmailRecord.email == email,
+                UserEmailRecord.is_confirmed.is_(False),
+                UserEmailRecord.reserved_on < now - self.reservation_timeout,
+            ).update({'user_id': user_id, 'reserved_on': now}, synchronize_session=False)
+            self.session.commit()
+            if not taken_over:
+                raise EmailAlreadyRegistered(f"{email!r} is already registered.")
+        finally:
+            self.session.close()
+
+    def reserve_many(self, emails):
+        """Reserves emails for users that are about to be created together.
+
+        Free addresses are reserved with one bulk INSERT. Taken addresses are retried one
+        at a time, so abandoned reservations are still taken over.
+
+        :param emails: Dict of email -> ID the new User will be created with.
+        :returns: Set of the emails (as given) that are already registered or reserved.
+        """
+        by_email = {normalize_email(email): (email, user_id) for email, user_id in emails.items()}
+        now = time.time()
+        taken = set()
+        try:
+            for chunk in _chunks(list(by_email), self.__in_clause_size__):
+                query = self.session.query(UserEmailRecord.email).filter(UserEmailRecord.email.in_(chunk))
+                taken.update(email for email, in query)
+            self.session.bulk_insert_mappings(UserEmailRecord, [
+                dict(email=email, user_id=user_id, is_confirmed=False, reserved_on=now)
+                for email, (_, user_id) in by_email.items() if email not in taken
+            ])
+            self.session.commit()
+        except IntegrityError:
+            # Another create reserved one of the addresses since we looked.
+            self.session.rollback()
+            taken = set(by_email)
+        finally:
+            self.session.close()
+        rejected = set()
+        for email in taken:
+            original, user_id = by_email[email]
+            try:
+                self.reserve(original, user_id)
+            except EmailAlreadyRegistered:
+                rejected.add(original)
+        return rejected
+
+    def renew(self, emails):
+        """Renews reservations made by reserve() or reserve_many() for users still being created.
+
+        Renewed reservations aren't taken over as abandoned for another reservation_timeout.
+
+        :param emails: Dict of email -> ID the new User will be created with.
+        :returns: Set of the emails (as given) that are no longer reserved for their user.
+        """
+        by_email = {normalize_email(email): (email, user_id) for email, user_id in emails.items()}
+        now = time.time()
+        held = set()
+        try:
+            for chunk in _chunks(list(by_email), self.__in_clause_size__):
+                reserved = self.session.query(UserEmailRecord).filter(
+                    UserEmailRecord.email.in_(chunk),
+                    UserEmailRecord.user_id.in_([by_email[email][1] for email in chunk]),
+                    UserEmailRecord.is_confirmed.is_(False),
+                )
+                reserved.update({'reserved_on': now}, synchronize_session=False)
+                held.update(email for email, in reserved.with_entities(UserEmailRecord.email))
+            self.session.commit()
+        finally:
+            self.session.close()
+        return {email for normalized, (email, _) in by_email.items() if normalized not in held}
+
+    def release(self, email, user_id):
+        """Releases a reservation made by reserve() if the user was not created."""
+        try:
+            self.session.query(UserEmailRecord).filter(
+                UserEmailRecord.email == normalize_email(email),
+                UserEmailRecord.user_id == user_id,
+                UserEmailRecord.is_confirmed.is_(False),
+            ).delete(synchronize_session=False)
+            self.session.commit()
+        finally:
+            self.session.close()
@@ -0,0 +1,541 @@
+import os
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from functools import wraps
+from threading import Condition, RLock, local
+
+from eventsourcing.exceptions import SequencedItemError
+from eventsourcing.infrastructure.activerecord import AbstractActiveRecordStrategy
+from eventsourcing.infrastructure.sqlalchemy.activerecords import SQLAlchemyActiveRecordStrategy
+from eventsourcing.infrastructure.sqlalchemy.datastore import ActiveRecord
+from sqlalchemy import Index, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.expression import and_, func, literal_column, or_
+from sqlalchemy.sql.schema import Column
+from sqlalchemy.sql.sqltypes import BigInteger, Integer
+from sqlalchemy_utils.types.uuid import UUIDType
+
+from utility.histogram import Histogram, exponential_buckets
+from utility.metrics import metrics
+
+GROUP_COMMIT_WINDOW_MS = float(os.getenv('GROUP_COMMIT_WINDOW_MS', 2))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv('GROUP_COMMIT_MAX_BATCH', 500))
+
+
+class EventLogRecord(ActiveRecord):
+    """
+    The application log: one row per stored event, numbered in the order the events were written.
+
+    The log position is an explicit AUTOINCREMENT key rather than SQLite's implicit rowid,
+    which VACUUM may renumber and other databases don't have, and positions of deleted
+    rows are never reused, so checkpoints and export cursors stay valid.
+    """
+    __tablename__ = 'event_log'
+    __table_args__ = (
+        Index('event_log_item_index', 'sequence_id', 'position', unique=True),
+        {'sqlite_autoincrement': True},
+    )
+
+    # Position of the event in the log. SQLite only autoincrements an INTEGER primary key.
+    log_position = Column(BigInteger().with_variant(Integer(), 'sqlite'), primary_key=True, autoincrement=True)
+
+    # Sequence ID and position of the event's record in the integer sequenced items table.
+    sequence_id = Column(UUIDType(), nullable=False)
+    position = Column(BigInteger(), nullable=False)
+
+
+def _timed(operation):
+    """Decorates a strategy method to record its time in kanban_store_seconds, if metrics are enabled."""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not metrics.enabled:
+                return method(self, *args, **kwargs)
+            with metrics.timer('kanban_store_seconds', table=self.active_record_class.__tablename__,
+                               operation=operation):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class KanbanSQLAlchemyActiveRecordStrategy(SQLAlchemyActiveRecordStrategy):
+    """
+    Active record strategy that writes a list of sequenced items with one bulk INSERT.
+
+    The base strategy builds and flushes an ORM object per item, which dominates the cost
+    of appending thousands of events at once, e.g. when importing users in bulk.
+
+    Queries can be given their own session, e.g. on a reader engine, so reads don't
+    compete with writers for connections.
+
+    Given a log_record_class, each appended item is also numbered in the application log,
+    in the same transaction, which is what get_log_page() and the projection runner read.
+    """
+
+    def __init__(self, session, *args, read_session=None, log_record_class=None, **kwargs):
+        """
+        :param read_session: Session queries are made in. Defaults to session.
+        :param log_record_class: Active record class of the application log, e.g. EventLogRecord.
+        """
+        super(KanbanSQLAlchemyActiveRecordStrategy, self).__init__(session, *args, **kwargs)
+        self.read_session = read_session or session
+        self.log_record_class = log_record_class
+        self._appended = local()
+
+    def filter(self, **kwargs):
+        query = self.read_session.query(self.active_record_class)
+        return query.filter_by(**kwargs)
+
+    @_timed('get_item')
+    def get_item(self, sequence_id, eq):
+        try:
+            return super(KanbanSQLAlchemyActiveRecordStrategy, self).get_item(sequence_id, eq)
+        finally:
+            self.read_session.close()
+
+    @_timed('get_items')
+    def get_items(self, *args, **kwargs):
+        try:
+            return super(KanbanSQLAlchemyActiveRecordStrategy, self).get_items(*args, **kwargs)
+        finally:
+            self.read_session.close()
+
+    @property
+    def _sequence_id_field(self):
+        return getattr(self.active_record_class, self.field_names.sequence_id)
+
+    @property
+    def _position_field(self):
+        return getattr(self.active_record_class, self.field_names.position)
+
+    @_timed('get_last_items')
+    def get_last_items(self, sequence_ids):
+        """Returns a dict of sequence ID -> last item in the sequence, read in one query."""
+        if not sequence_ids:
+            return {}
+        sequence_id, position = self._sequence_id_field, self._position_field
+        last = self.read_session.query(
+            sequence_id.label('sequence_id'), func.max(position).label('position')
+        ).filter(sequence_id.in_(sequence_ids)).group_by(sequence_id).subquery()
+        try:
+            query = self.read_session.query(self.active_record_class).join(
+                last, and_(sequence_id == last.c.sequence_id, position == last.c.position))
+            items = map(self.from_active_record, query)
+            return {getattr(item, self.field_names.sequence_id): item for item in items}
+        finally:
+            self.read_session.close()
+
+    @_timed('get_items_after')
+    def get_items_after(self, positions):
+        """Returns the items of several sequences, read in one query, ordered by sequence and position.
+
+        :param positions: Dict of sequence ID -> position after which to read, or None to read all items.
+        """
+        if not positions:
+            return []
+        sequence_id, position = self._sequence_id_field, self._position_field
+        whole = [s for s, p in positions.items() if p is None]
+        conditions = [sequence_id.in_(whole)] if whole else []
+        conditions.extend(and_(sequence_id == s, position > p) for s, p in positions.items() if p is not None)
+        try:
+            query = self.read_session.query(self.active_record_class).filter(or_(*conditions))
+            return list(map(self.from_active_record, query.order_by(sequence_id, position)))
+        finally:
+            self.read_session.close()
+
+    @_timed('get_page')
+    def get_page(self, after=None, limit=1000, start=None, stop=None):
+        """Returns up to limit items, ordered by sequence and position, read in one query.
+
+        Pages are keyed on the last item read, so each is an index range scan however far
+        into the table it starts, and no read transaction is held between pages.
+
+        :param after: (sequence ID, position) of the last item of the previous page.
+        :param start: Lowest sequence ID to read.
+        :param stop: Sequence ID before which to stop.
+        """
+        sequence_id, position = self._sequence_id_field, self._position_field
+        query = self.read_session.query(self.active_record_class)
+        if after is not None:
+            query = query.filter(or_(sequence_id > after[0], and_(sequence_id == after[0], position > after[1])))
+        if start is not None:
+            query = query.filter(sequence_id >= start)
+        if stop is not None:
+            query = query.filter(sequence_id < stop)
+        try:
+            return list(map(self.from_active_record, query.order_by(sequence_id, position).limit(limit)))
+        finally:
+            self.read_session.close()
+
+    @_timed('get_log_page')
+    def get_log_page(self, after=0, limit=1000, topic=None, sequence_id=None):
+        """Returns up to limit (log position, item) pairs, in the order the items were written.
+
+        Each page is one query that starts from the last position read, so no read
+        transaction is held between pages.
+
+        :param after: Log position of the last item of the previous page.
+        :param topic: Only return items with this topic.
+        :param sequence_id: Only return items of this sequence.
+        """
+        assert self.log_record_class is not None, "Reading the log needs a log_record_class."
+        log = self.log_record_class
+        query = self.read_session.query(log.log_position, self.active_record_class).join(
+            self.active_record_class,
+            and_(self._sequence_id_field == log.sequence_id, self._position_field == log.position)
+        ).filter(log.log_position > after)
+        if topic is not None:
+            query = query.filter(getattr(self.active_record_class, self.field_names.topic) == topic)
+        if sequence_id is not None:
+            query = query.filter(log.sequence_id == sequence_id)
+        try:
+            return [(position, self.from_active_record(record))
+                    for position, record in query.order_by(log.log_position).limit(limit)]
+        finally:
+            self.read_session.close()
+
+    @_timed('get_last_log_position')
+    def get_last_log_position(self):
+        """Returns the log position of the most recently stored item (0 if none)."""
+        assert self.log_record_class is not None, "Reading the log needs a log_record_class."
+        try:
+            return self.read_session.query(func.max(self.log_record_class.log_position)).scalar() or 0
+        finally:
+            self.read_session.close()
+
+    def get_appended_log_positions(self):
+        """Returns the log positions of the first and last items the current thread last appended, or None."""
+        return getattr(self._appended, 'log_positions', None)
+
+    def backfill_log(self):
+        """Numbers the items stored before the log was kept, if the log is empty.
+
+        Items are numbered by SQLite's rowid, which was the log position until then, so
+        projection checkpoints stay where they were. Only SQLite databases were read by
+        rowid, and other databases have no rowid, so nothing is backfilled on them.
+
+        :returns: Number of items added to the log.
+        """
+        assert self.log_record_class is not None, "Backfilling the log needs a log_record_class."
+        log = self.log_record_class
+        try:
+            if self.session.get_bind().dialect.name != 'sqlite':
+                return 0
+            if self.session.query(log.log_position).first() is not None:
+                return 0
+            rowid = literal_column(f'{self.active_record_class.__tablename__}.rowid')
+            items = select([rowid, self._sequence_id_field, self._position_field]).order_by(rowid)
+            result = self.session.execute(insert(log.__table__).from_select(
+                ['log_position', 'sequence_id', 'position'], items))
+            self.session.commit()
+            return result.rowcount
+        except Exception:
+            self.session.rollback()
+            raise
+        finally:
+            self.session.close()
+
+    @_timed('append')
+    def append(self, sequenced_item_or_items):
+        if not isinstance(sequenced_item_or_items, list):
+            if self.log_record_class is None:
+                return super(KanbanSQLAlchemyActiveRecordStrategy, self).append(sequenced_item_or_items)
+            sequenced_item_or_items = [sequenced_item_or_items]
+        if not sequenced_item_or_items:
+            return
+        log_positions = None
+        try:
+            rows = [self.get_field_kwargs(item) for item in sequenced_item_or_items]
+            self.session.bulk_insert_mappings(self.active_record_class, rows)
+            if self.log_record_class is not None:
+                # Log rows are inserted in the order of the items, and take their positions in it.
+                sequence_id, position = self.field_names.sequence_id, self.field_names.position
+                self.session.bulk_insert_mappings(self.log_record_class, [
+                    {'sequence_id': row[sequence_id], 'position': row[position]} for row in rows])
+                log = self.log_record_class
+                log_positions = tuple(self.session.query(
+                    func.min(log.log_position), func.max(log.log_position)
+                ).filter(or_(*(
+                    and_(log.sequence_id == row[sequence_id], log.position == row[position])
+                    for row in (rows[0], rows[-1])
+                ))).one())
+            self.session.commit()
+            self._appended.log_positions = log_positions
+        except IntegrityError as e:
+            self.session.rollback()
+            self.raise_sequenced_item_error(sequenced_item_or_items, e)
+        finally:
+            self.session.close()
+
+
+class _PendingAppend(object):
+    def __init__(self, sequenced_item_or_items):
+        self.sequenced_item_or_items = sequenced_item_or_items
+        if isinstance(sequenced_item_or_items, list):
+            self.items = sequenced_item_or_items
+        else:
+            self.items = [sequenced_item_or_items]
+        self.enqueued = time.monotonic()
+        self.done = False
+        self.error = None
+        self.log_positions = None
+
+
+class GroupCommitActiveRecordStrategy(KanbanSQLAlchemyActiveRecordStrategy):
+    """
+    Active record strategy that commits appends from concurrent callers together.
+
+    The first caller to arrive becomes the leader. It waits up to commit_window seconds,
+    or until max_batch_size appends are queued, then writes every queued append in one
+    transaction while the other callers wait. Appends that arrive during the commit
+    queue up for the next leader, so batches grow with load even with a zero window.
+
+    Each caller still gets its own result. If the batch conflicts, the appends are
+    retried one at a time, so only the callers whose items already exist see the
+    SequencedItemError.
+    """
+
+    def __init__(self, *args, commit_window=None, max_batch_size=None, **kwargs):
+        """
+        :param commit_window: Seconds the leader waits for more appends. Defaults to GROUP_COMMIT_WINDOW_MS.
+        :param max_batch_size: Queued appends that end the window early.
+        """
+        super(GroupCommitActiveRecordStrategy, self).__init__(*args, **kwargs)
+        self.commit_window = GROUP_COMMIT_WINDOW_MS / 1000 if commit_window is None else commit_window
+        self.max_batch_size = max_batch_size or GROUP_COMMIT_MAX_BATCH
+        self.batch_sizes = Histogram(exponential_buckets(1, 2, 12))
+        self.wait_times = Histogram(exponential_buckets(0.0001, 2, 16))
+        table = self.active_record_class.__tablename__
+        metrics.register('kanban_group_commit_batch_size', self.batch_sizes, table=table)
+        metrics.register('kanban_group_commit_wait_seconds', self.wait_times, table=table)
+        self._condition = Condition()
+        self._queue = []
+        self._leader_active = False
+
+    @property
+    def stats(self):
+        """Histograms of appends per commit and of seconds each append waited for its commit."""
+        return {
+            'batch_size': self.batch_sizes.snapshot(),
+            'wait_time': self.wait_times.snapshot(),
+        }
+
+    def append(self, sequenced_item_or_items):
+        pending = _PendingAppend(sequenced_item_or_items)
+        with self._condition:
+            self._queue.append(pending)
+            self._condition.notify_all()
+            while not pending.done:
+                if self._leader_active:
+                    self._condition.wait()
+                    continue
+                self._leader_active = True
+                try:
+                    self._lead()
+                finally:
+                    self._leader_active = False
+                    self._condition.notify_all()
+        self.wait_times.observe(time.monotonic() - pending.enqueued)
+        if pending.error is not None:
+            raise pending.error
+        self._appended.log_positions = pending.log_positions
+
+    def _lead(self):
+        # Called holding the lock. Releases it while the batch is written.
+        deadline = time.monotonic() + self.commit_window
+        while len(self._queue) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._condition.wait(remaining)
+        batch, self._queue = self._queue, []
+        self._condition.release()
+        try:
+            self._write(batch)
+        finally:
+            self._condition.acquire()
+
+    def _write(self, batch):
+        self.batch_sizes.observe(len(batch))
+        try:
+            super(GroupCommitActiveRecordStrategy, self).append([item for p in batch for item in p.items])
+        except SequencedItemError as e:
+            if len(batch) == 1:
+                batch[0].error = e
+            else:
+                self._write_one_at_a_time(batch)
+        except Exception as e:
+            for pending in batch:
+                pending.error = e
+        else:
+            # The callers are given the positions of the whole batch they were written in.
+            for pending in batch:
+                pending.log_positions = self.get_appended_log_positions()
+        for pending in batch:
+            pending.done = True
+
+    def _write_one_at_a_time(self, batch):
+        for pending in batch:
+            try:
+                super(GroupCommitActiveRecordStrategy, self).append(pending.sequenced_item_or_items)
+            except Exception as e:
+                pending.error = e
+            else:
+                pending.log_positions = self.get_appended_log_positions()
+
+
+class InMemoryActiveRecordStrategy(AbstractActiveRecordStrategy):
+    """
+    Active record strategy that keeps sequenced items in memory, for tests and benchmarks.
+
+    Each sequence is a sorted array of positions with a parallel list of items, so a
+    position range is found with two bisections. Like the database strategies, appending
+    an item at a position that is already taken raises SequencedItemError, and a list of
+    items is appended all or nothing.
+
+    The records are the sequenced items themselves; active_record_class is only used to
+    tell stores apart.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(InMemoryActiveRecordStrategy, self).__init__(*args, **kwargs)
+        self._sequences = {}
+        self._sequence_ids = []
+        self._log = []
+        self._lock = RLock()
+        self._appended = local()
+
+    def append(self, sequenced_item_or_items):
+        if isinstance(sequenced_item_or_items, list):
+            items = sequenced_item_or_items
+        else:
+            items = [sequenced_item_or_items]
+        with self._lock:
+            taken = set()
+            for item in items:
+                key = (item.sequence_id, item.position)
+                positions, _ = self._sequences.get(item.sequence_id, ((), ()))
+                i = bisect_left(positions, item.position)
+                if key in taken or (i < len(positions) and positions[i] == item.position):
+                    self.raise_sequenced_item_error(item, "position already taken")
+                taken.add(key)
+            for item in items:
+                if item.sequence_id not in self._sequences:
+                    insort(self._sequence_ids, item.sequence_id)
+                positions, sequence = self._sequences.setdefault(item.sequence_id, (array('q'), []))
+                i = bisect_left(positions, item.position)
+                positions.insert(i, item.position)
+                sequence.insert(i, item)
+                self._log.append(item)
+            self._appended.log_positions = (len(self._log) - len(items) + 1, len(self._log))
+
+    def get_item(self, sequence_id, eq):
+        with self._lock:
+            positions, sequence = self._sequences.get(sequence_id, ((), ()))
+            i = bisect_left(positions, eq)
+            if i < len(positions) and positions[i] == eq:
+                return sequence[i]
+        self.raise_index_error(eq)
+
+    def get_items(self, sequence_id, gt=None, gte=None, lt=None, lte=None, limit=None,
+                  query_ascending=True, results_ascending=True):
+        assert limit is None or limit >= 1, limit
+        with self._lock:
+            positions, sequence = self._sequences.get(sequence_id, ((), ()))
+            start, stop = 0, len(positions)
+            if gt is not None:
+                start = max(start, bisect_right(positions, gt))
+            if gte is not None:
+                start = max(start, bisect_left(positions, gte))
+            if lt is not None:
+                stop = min(stop, bisect_left(positions, lt))
+            if lte is not None:
+                stop = min(stop, bisect_right(positions, lte))
+            if limit is not None:
+                if query_ascending:
+                    stop = min(stop, start + limit)
+                else:
+                    start = max(start, stop - limit)
+            items = list(sequence[start:stop])
+        if not results_ascending:
+            items.reverse()
+        return items
+
+    def get_last_items(self, sequence_ids):
+        last_items = {}
+        with self._lock:
+            for sequence_id in sequence_ids:
+                _, sequence = self._sequences.get(sequence_id, ((), ()))
+                if sequence:
+                    last_items[sequence_id] = sequence[-1]
+        return last_items
+
+    def get_items_after(self, positions):
+        items = []
+        for sequence_id, position in sorted(positions.items(), key=lambda p: p[0]):
+            items.extend(self.get_items(sequence_id, gt=position))
+        return items
+
+    def get_page(self, after=None, limit=1000, start=None, stop=None):
+        page = []
+        with self._lock:
+            i = 0
+            if after is not None:
+                i = bisect_left(self._sequence_ids, after[0])
+            if start is not None:
+                i = max(i, bisect_left(self._sequence_ids, start))
+            while i < len(self._sequence_ids) and len(page) < limit:
+                sequence_id = self._sequence_ids[i]
+                if stop is not None and sequence_id >= stop:
+                    break
+                positions, sequence = self._sequences[sequence_id]
+                j = 0
+                if after is not None and sequence_id == after[0]:
+                    j = bisect_right(positions, after[1])
+                page.extend(sequence[j:j + limit - len(page)])
+                i += 1
+        return page
+
+    def get_log_page(self, after=0, limit=1000, topic=None, sequence_id=None):
+        """Returns up to limit (log position, item) pairs. Log positions are 1-based indexes in the log."""
+        page = []
+        with self._lock:
+            for i in range(after, len(self._log)):
+                item = self._log[i]
+                if item is None:
+                    continue
+                if (topic is None or item.topic == topic) and (sequence_id is None or item.sequence_id == sequence_id):
+                    page.append((i + 1, item))
+                    if len(page) == limit:
+                        break
+        return page
+
+    def get_last_log_position(self):
+        with self._lock:
+            return len(self._log)
+
+    def get_appended_log_positions(self):
+        return getattr(self._appended, 'log_positions', None)
+
+    def all_items(self):
+        with self._lock:
+            return [item for item in self._log if item is not None]
+
+    def all_records(self, resume=None, *args, **kwargs):
+        with self._lock:
+            records = self._log[resume + 1:] if resume is not None else list(self._log)
+        start = resume + 1 if resume is not None else 0
+        for i, record in enumerate(records):
+            if record is not None:
+                yield record, start + i
+
+    def delete_record(self, record):
+        with self._lock:
+            positions, sequence = self._sequences[record.sequence_id]
+            i = bisect_left(positions, record.position)
+            assert positions[i] == record.position, record
+            del positions[i]
+            del sequence[i]
+            # Leaves a gap, so the log positions of later items don't change.
+            self._log[self._log.index(record)] = None
@@ -0,0 +1,343 @@
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from mmap import ACCESS_READ, mmap
+from threading import RLock
+from uuid import UUID
+
+from eventsourcing.exceptions import SequencedItemError
+from eventsourcing.infrastructure.activerecord import AbstractActiveRecordStrategy
+
+SEGMENT_SIZE = int(os.getenv('SEGMENT_SIZE', 64 * 2 ** 20))
+
+# crc32, flags, sequence_id, position, topic length, data length. The crc covers everything after itself.
+RECORD_HEADER = struct.Struct('<II16sqII')
+# sequence_id, position, location.
+INDEX_ENTRY = struct.Struct('<16sqQ')
+# Set on the last record of each append, so a torn multi-item append is discarded whole.
+END_OF_APPEND = 1
+# A location packs the segment number above the offset within the segment.
+OFFSET_BITS = 40
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+
+
+def _segment_name(segment):
+    return f'segment-{segment:06d}.log'
+
+
+class SegmentFileActiveRecordStrategy(AbstractActiveRecordStrategy):
+    """
+    Active record strategy that appends sequenced items to segment files.
+
+    Items are written to the current segment file, and the (sequence_id, position) ->
+    location of each is kept in memory and appended to a compact index file. At startup
+    the index is read back, then any records written after the last indexed one are
+    recovered by scanning the segments. A record with a bad checksum ends the scan, and
+    the torn tail is truncated. Without fsync, the index can reach the disk before the
+    segment it points into, so index entries at the end of the index are only trusted
+    once the append they end is found intact in its segment.
+
+    Reads slice a memoryview over an mmap of the segment, and decode the data straight
+    from it, without copying the record into an intermediate bytes object.
+
+    Like the database strategies, appending an item at a position that is already taken
+    raises SequencedItemError, and a list of items is appended all or nothing.
+    """
+
+    def __init__(self, path, active_record_class=None, segment_size=SEGMENT_SIZE, fsync=False, **kwargs):
+        """
+        :param path: Directory holding the segment and index files. Created if missing.
+        :param segment_size: Bytes after which appends roll over to a new segment.
+        :param fsync: Whether to fsync each append before returning.
+        """
+        super(SegmentFileActiveRecordStrategy, self).__init__(active_record_class=active_record_class, **kwargs)
+        self.path = path
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self._lock = RLock()
+        self._index = {}
+        self._sequence_ids = []
+        self._maps = {}
+        os.makedirs(path, exist_ok=True)
+        self._segment = 0
+        self._segment_file = None
+        self._index_file = None
+        self._open()
+
+    #
+    # Startup.
+    #
+    def _open(self):
+        index_path = os.path.join(self.path, 'index')
+        last_location = None
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                data = f.read()
+            entries = list(INDEX_ENTRY.iter_unpack(data[:len(data) - len(data) % INDEX_ENTRY.size]))
+            kept = len(entries)
+            while kept and not self._ends_intact_append(*entries[kept - 1]):
+                kept -= 1
+            for sequence_id, position, location in entries[:kept]:
+                self._add_to_index(UUID(bytes=sequence_id), position, location)
+                last_location = location if last_location is None else max(last_location, location)
+            if kept * INDEX_ENTRY.size != len(data):
+                with open(index_path, 'r+b') as f:
+                    f.truncate(kept * INDEX_ENTRY.size)
+        self._index_file = open(index_path, 'ab')
+        if last_location is None:
+            segment, offset = 0, 0
+        else:
+            segment, offset = last_location >> OFFSET_BITS, last_location & OFFSET_MASK
+            offset += self._record_size(segment, offset)
+        self._recover(segment, offset)
+
+    def _recover(self, segment, offset):
+        # Scans forward from (segment, offset), indexing complete appends and truncating anything after them.
+        while True:
+            path = os.path.join(self.path, _segment_name(segment))
+            if not os.path.exists(path):
+                break
+            with open(path, 'rb') as f:
+                data = f.read()
+            pending = []
+            committed_end = offset
+            while offset + RECORD_HEADER.size <= len(data):
+                crc, flags, sequence_id, position, topic_length, data_length = \
+                    RECORD_HEADER.unpack_from(data, offset)
+                end = offset + RECORD_HEADER.size + topic_length + data_length
+                if end > len(data) or zlib.crc32(data[offset + 4:end]) != crc:
+                    break
+                pending.append((sequence_id, position, segment << OFFSET_BITS | offset))
+                offset = end
+                if flags & END_OF_APPEND:
+                    self._index_entries(pending)
+                    pending = []
+                    committed_end = end
+            if committed_end < len(data):
+                with open(path, 'r+b') as f:
+                    f.truncate(committed_end)
+                self._segment = segment
+                break
+            self._segment = segment
+            segment, offset = segment + 1, 0
+        self._index_file.flush()
+        self._segment_file = open(os.path.join(self.path, _segment_name(self._segment)), 'ab')
+
+    def _ends_intact_append(self, sequence_id, position, location):
+        """Whether the record at location is the intact last record of an append of the indexed item."""
+        segment, offset = location >> OFFSET_BITS, location & OFFSET_MASK
+        try:
+            with open(os.path.join(self.path, _segment_name(segment)), 'rb') as f:
+                f.seek(offset)
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return False
+                crc, flags, record_sequence_id, record_position, topic_length, data_length = \
+                    RECORD_HEADER.unpack(header)
+                rest = f.read(topic_length + data_length)
+        except FileNotFoundError:
+            return False
+        return (len(rest) == topic_length + data_length
+                and zlib.crc32(rest, zlib.crc32(header[4:])) == crc
+                and (record_sequence_id, record_position) == (sequence_id, position)
+                and bool(flags & END_OF_APPEND))
+
+    def _record_size(self, segment, offset):
+        with open(os.path.join(self.path, _segment_name(segment)), 'rb') as f:
+            f.seek(offset)
+            header = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+        return RECORD_HEADER.size + header[4] + header[5]
+
+    #
+    # Index.
+    #
+    def _add_to_index(self, sequence_id, position, location):
+        if sequence_id not in self._index:
+            insort(self._sequence_ids, sequence_id)
+        positions, locations = self._index.setdefault(sequence_id, (array('q'), array('Q')))
+        i = bisect_left(positions, position)
+        positions.insert(i, position)
+        locations.insert(i, location)
+
+    def _index_entries(self, entries):
+        for sequence_id, position, location in entries:
+            self._add_to_index(UUID(bytes=sequence_id), position, location)
+            self._index_file.write(INDEX_ENTRY.pack(sequence_id, position, location))
+
+    def _is_taken(self, sequence_id, position):
+        positions, _ = self._index.get(sequence_id, ((), ()))
+        i = bisect_left(positions, position)
+        return i < len(positions) and positions[i] == position
+
+    #
+    # Writes.
+    #
+    def append(self, sequenced_item_or_items):
+        if isinstance(sequenced_item_or_items, list):
+            items = sequenced_item_or_items
+        else:
+            items = [sequenced_item_or_items]
+        if not items:
+            return
+        with self._lock:
+            taken = set()
+            for item in items:
+                key = (item.sequence_id, item.position)
+                if key in taken or self._is_taken(*key):
+                    self.raise_sequenced_item_error(item, "position already taken")
+                taken.add(key)
+            if self._segment_file.tell() >= self.segment_size:
+                self._roll_over()
+            offset = self._segment_file.tell()
+            buffer = bytearray()
+            entries = []
+            for i, item in enumerate(items):
+                sequence_id = item.sequence_id.bytes
+                topic = item.topic.encode('utf-8')
+                data = item.data.encode('utf-8')
+                flags = END_OF_APPEND if i == len(items) - 1 else 0
+                body = RECORD_HEADER.pack(0, flags, sequence_id, item.position, len(topic), len(data))[4:]
+                crc = zlib.crc32(data, zlib.crc32(topic, zlib.crc32(body)))
+                entries.append((sequence_id, item.position, self._segment << OFFSET_BITS | offset + len(buffer)))
+                buffer += struct.pack('<I', crc) + body + topic + data
+            self._segment_file.write(buffer)
+            self._segment_file.flush()
+            if self.fsync:
+                os.fsync(self._segment_file.fileno())
+            self._index_entries(entries)
+            self._index_file.flush()
+
+    def _roll_over(self):
+        self._segment_file.close()
+        self._segment += 1
+        self._segment_file = open(os.path.join(self.path, _segment_name(self._segment)), 'ab')
+
+    #
+    # Reads.
+    #
+    def _view(self, location):
+        """Returns the header and a memoryview of the record at location."""
+        segment, offset = location >> OFFSET_BITS, location & OFFSET_MASK
+        segment_map = self._maps.get(segment)
+        if segment_map is None or offset + RECORD_HEADER.size > len(segment_map):
+            segment_map = self._map(segment)
+        if offset + RECORD_HEADER.size > len(segment_map):
+            raise EOFError(f"{_segment_name(segment)} ends before the record at offset {offset}.")
+        header = RECORD_HEADER.unpack_from(segment_map, offset)
+        end = offset + RECORD_HEADER.size + header[4] + header[5]
+        if end > len(segment_map):
+            segment_map = self._map(segment)
+            if end > len(segment_map):
+                raise EOFError(f"{_segment_name(segment)} ends inside the record at offset {offset}.")
+        return header, memoryview(segment_map)[offset:end]
+
+    def _map(self, segment):
+        # Maps the segment as far as it has been written. Older, shorter maps are left to be
+        # unmapped once no views of them remain.
+        with self._lock:
+            with open(os.path.join(self.path, _segment_name(segment)), 'rb') as f:
+                segment_map = mmap(f.fileno(), 0, access=ACCESS_READ)
+            self._maps[segment] = segment_map
+            return segment_map
+
+    def _read(self, sequence_id, location):
+        (_, _, _, position, topic_length, data_length), view = self._view(location)
+        topic_start = RECORD_HEADER.size
+        data_start = topic_start + topic_length
+        return self.sequenced_item_class(
+            sequence_id,
+            position,
+            sys.intern(str(view[topic_start:data_start], 'utf-8')),
+            str(view[data_start:data_start + data_length], 'utf-8'),
+        )
+
+    def get_item(self, sequence_id, eq):
+        with self._lock:
+            positions, locations = self._index.get(sequence_id, ((), ()))
+            i = bisect_left(positions, eq)
+            if i < len(positions) and positions[i] == eq:
+                location = locations[i]
+            else:
+                location = None
+        if location is None:
+            self.raise_index_error(eq)
+        return self._read(sequence_id, location)
+
+    def get_items(self, sequence_id, gt=None, gte=None, lt=None, lte=None, limit=None,
+                  query_ascending=True, results_ascending=True):
+        assert limit is None or limit >= 1, limit
+        with self._lock:
+            positions, locations = self._index.get(sequence_id, ((), ()))
+            start, stop = 0, len(positions)
+            if gt is not None:
+                start = max(start, bisect_right(positions, gt))
+            if gte is not None:
+                start = max(start, bisect_left(positions, gte))
+            if lt is not None:
+                stop = min(stop, bisect_left(positions, lt))
+            if lte is not None:
+                stop = min(stop, bisect_right(positions, lte))
+            if limit is not None:
+                if query_ascending:
+                    stop = min(stop, start + limit)
+                else:
+                    start = max(start, stop - limit)
+            selected = list(locations[start:stop])
+        items = [self._read(sequence_id, location) for location in selected]
+        if not results_ascending:
+            items.reverse()
+        return items
+
+    def get_page(self, after=None, limit=1000, start=None, stop=None):
+        """Returns up to limit items, ordered by sequence and position."""
+        selected = []
+        with self._lock:
+            i = 0
+            if after is not None:
+                i = bisect_left(self._sequence_ids, after[0])
+            if start is not None:
+                i = max(i, bisect_left(self._sequence_ids, start))
+            while i < len(self._sequence_ids) and len(selected) < limit:
+                sequence_id = self._sequence_ids[i]
+                if stop is not None and sequence_id >= stop:
+                    break
+                positions, locations = self._index[sequence_id]
+                j = 0
+                if after is not None and sequence_id == after[0]:
+                    j = bisect_right(positions, after[1])
+                selected.extend((sequence_id, location) for location in locations[j:j + limit - len(selected)])
+                i += 1
+        return [self._read(sequence_id, location) for sequence_id, location in selected]
+
+    def all_items(self):
+        return (item for item, _ in self.all_records())
+
+    def all_records(self, resume=None, *args, **kwargs):
+        """Yields every item, in the order the items were appended."""
+        with self._lock:
+            locations = sorted(
+                (location, sequence_id)
+                for sequence_id, (_, sequence_locations) in self._index.items()
+                for location in sequence_locations
+            )
+        start = resume + 1 if resume is not None else 0
+        for i, (location, sequence_id) in enumerate(locations[start:], start):
+            yield self._read(sequence_id, location), i
+
+    def delete_record(self, record):
+        raise SequencedItemError(f"Segment files are append-only: {record} can't be deleted.")
+
+    def close(self):
+        with self._lock:
+            self._segment_file.close()
+            self._index_file.close()
+            for segment_map in self._maps.values():
+                try:
+                    segment_map.close()
+                except BufferError:
+                    # A caller still holds a view of the map. It is unmapped when released.
+                    pass
+            self._maps = {}
@@ -4,7 +4,6 @@ from eventsourcing.domain.model.aggregate import AggregateRoot
 from eventsourcing.domain.model.entity import WithReflexiveMutator
 # =============================================================================
 # Aggregate root
-from eventsourcing.domain.model.events import publish
 
 from utility.parse import valid_email, valid_domain, valid_encrypted_password
 
@@ -28,71 +27,54 @@ class User(WithReflexiveMutator, AggregateRoot):
             discarded="*Discarded* " if self._is_discarded else "",
             name=self.__class__.__name__,
             n=len(self._pending_events),
-            data=', '.join(sorted(["{0}={1}".format(k, v) for (k, v) in
-                                   {k: v for k, v
-                                    in self.__dict__.items()
-                                    if k != '_pending_events'}.items()
-                                   ])))
+            data=', '.join("{0}={1}".format(k, v) for k, v in self.__dict__.items() if k != '_pending_events'))
+
+    @classmethod
+    def _restore(cls, user_id, name, password, email, default_domain, **kwargs):
+        """Constructs a user from values that were validated when they were first published, e.g. on replay."""
+        entity = cls.__new__(cls)
+        super(User, entity).__init__(**kwargs)
+        entity.user_id = user_id
+        entity.name = name
+        entity.password = password
+        entity.email = email
+        entity.default_domain = default_domain
+        entity.domains = set()
+        return entity
 
     #
     # Domain events.
     #
     class Event(AggregateRoot.Event):
         """Layer supertype
+
+        Event attributes are read straight from the instance dict, which the library relies
+        on to construct, compare and store events, so there are no per-field properties.
         """
 
     class Created(Event, AggregateRoot.Created):
         """Published when a user is created."""
-
-        @property
-        def user_id(self):
-            return self.__dict__['user_id']
-
-        @property
-        def name(self):
-            return self.__dict__['name']
-
-        @property
-        def password(self):
-            return self.__dict__['password']
-
-        @property
-        def email(self):
-            return self.__dict__['email']
-
-        @property
-        def default_domain(self):
-            return self.__dict__['default_domain']
+        __encrypted_fields__ = ('password', 'email')
 
         def mutate(self, cls):
-            entity = cls(**self.__dict__)
+            entity = cls._restore(**self.__dict__)
             entity.domains.add(self.default_domain)
             entity.increment_version()
             return entity
 
-    class AttributeChanged(AggregateRoot.AttributeChanged):
+    class AttributeChanged(Event, AggregateRoot.AttributeChanged):
         """Published when a user attribute changes."""
-
-        @property
-        def name(self):
-            return self.__dict__['name']
-
-        @property
-        def value(self):
-            return self.__dict__['value']
+        __encrypted_fields__ = ('value',)
 
         def mutate(self, entity):
             setattr(entity, self.name, self.value)
+            entity._last_modified_on = self.timestamp
             entity.increment_version()
             return entity
 
     class Discarded(Event, AggregateRoot.Discarded):
         """Published when a user is discarded."""
 
-        @property
-        def domain_namespace(self):
-            return self.__dict__['domain_namespace']
-
         def mutate(self, entity):
             entity._is_discarded = True
             return None
@@ -100,43 +82,45 @@ class User(WithReflexiveMutator, AggregateRoot):
     class DomainAdded(Event):
         """Published when a domain is added."""
 
-        @property
-        def domain(self):
-            return self.__dict__['domain']
-
         def mutate(self, entity):
             entity.domains.add(self.domain)
+            entity._last_modified_on = self.timestamp
             entity.increment_version()
+            return entity
 
     class DomainDiscarded(Event):
         """Published when a domain is removed."""
 
-        @property
-        def domain(self):
-            return self.__dict__['domain']
-
         def mutate(self, entity):
             entity.domains.discard(self.domain)
+            entity._last_modified_on = self.timestamp
             entity.increment_version()
+            return entity
 
     #
     # Commands
     #
     @staticmethod
-    def create(name, password, email, default_domain, **kwargs):
-        """Creates a new user."""
-        user_id = uuid4()
+    def create(name, password, email, default_domain, user_id=None, **kwargs):
+        """Creates a new user.
+
+        The user_id is also the aggregate's id, so the user can be looked up by it.
+        The Created event is pending until the user is saved, so it is stored in the same
+        transaction as any events that follow it. The values are validated here, so
+        replaying the event doesn't validate them again.
+        """
+        user_id = user_id or uuid4()
         event = User.Created(
-            originator_id=uuid4(),
-            user_id=user_id,
-            name=name,
-            password=password,
-            email=email,
-            default_domain=default_domain,
+            originator_id=user_id,
+            user_id=User._validate_user_id(user_id),
+            name=User._validate_name(name),
+            password=User._validate_password(password),
+            email=User._validate_email(email),
+            default_domain=User._validate_domain(default_domain),
             **kwargs
         )
         entity = event.mutate(cls=User)
-        publish(event)
+        entity._publish(event)
         return entity
 
     def change_attribute(self, name, value, **kwargs):
@@ -0,0 +1,59 @@
+import os
+
+# The app keeps its events in memory under test, so runs are fast and leave nothing on disk.
+os.environ.setdefault('EVENT_STORE', 'memory')
+
+from eventsourcing.infrastructure.sqlalchemy.activerecords import IntegerSequencedItemRecord, SnapshotRecord
+from eventsourcing.infrastructure.sqlalchemy.datastore import ActiveRecord
+from pytest import fixture
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from infrastructure import datastore
+from infrastructure.kanban_application import KanbanApplication, in_memory_application_kwargs
+from infrastructure.record_strategies import EventLogRecord, KanbanSQLAlchemyActiveRecordStrategy
+
+
+@fixture
+def db_host():
+    return 'sqlite://'
+
+
+@fixture
+def session(db_host):
+    engine = create_engine(db_host)
+    ActiveRecord.metadata.create_all(engine)
+    return scoped_session(sessionmaker(bind=engine))
+
+
+@fixture
+def sqlite_application_kwargs(session):
+    return dict(
+        entity_active_record_strategy=KanbanSQLAlchemyActiveRecordStrategy(
+            active_record_class=IntegerSequencedItemRecord, session=session, log_record_class=EventLogRecord),
+        snapshot_active_record_strategy=KanbanSQLAlchemyActiveRecordStrategy(
+            active_record_class=SnapshotRecord, session=session),
+        session=session,
+        cipher=datastore.cipher,
+    )
+
+
+@fixture(params=['sqlite', 'memory'])
+def application_kwargs(request, sqlite_application_kwargs):
+    # Test modules that only run against SQLite override this with sqlite_application_kwargs.
+    if request.param == 'memory':
+        return in_memory_application_kwargs()
+    return sqlite_application_kwargs
+
+
+@fixture
+def application_options():
+    # Test modules override this to construct the application with other settings.
+    return {}
+
+
+@fixture
+def app(application_kwargs, application_options):
+    app = KanbanApplication(**dict(application_kwargs, **application_options))
+    yield app
+    app.close()
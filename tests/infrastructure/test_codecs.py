@@ -0,0 +1,83 @@
+import base64
+from collections import deque
+from uuid import uuid4
+
+from eventsourcing.infrastructure.sequenceditem import SequencedItem
+from pytest import mark
+
+from infrastructure.kanban_application import KanbanApplication, in_memory_application_kwargs
+from infrastructure.transcoding import BASE85_BINARY_TAG, BINARY_TAG, CODECS, KanbanSequencedItemMapper, \
+    LATIN1_BINARY_TAG
+from kanban.domain.model.user import User
+from tests.workflow_platform.domain.model.test_user import PASSWORDS
+
+
+def created_event():
+    return User.Created(originator_id=uuid4(), user_id=uuid4(), name="Ñame", password=PASSWORDS[0],
+                        email='email@dot.com', default_domain='dot.com')
+
+
+@mark.parametrize('codec', sorted(CODECS))
+def test_codec_round_trips_event_attrs(codec):
+    event = created_event()
+    attrs = dict(event.__dict__, domains={'dot.com', 'other.com'}, queue=deque([1, 2.5, None, True]),
+                 nested=[{'big': 2 ** 70}], pending=[event])
+    decoded = CODECS[codec].decode(CODECS[codec].encode(attrs))
+    assert decoded.pop('pending')[0].__dict__ == event.__dict__
+    attrs.pop('pending')
+    assert decoded == attrs
+
+
+def test_mapper_reads_items_written_with_any_codec():
+    event = created_event()
+    mappers = {name: KanbanSequencedItemMapper(sequence_id_attr_name='originator_id',
+                                               position_attr_name='originator_version', codec=name)
+               for name in CODECS}
+    assert mappers['binary'].to_sequenced_item(event).data[:1] == BINARY_TAG
+    for writer in mappers.values():
+        item = writer.to_sequenced_item(event)
+        for reader in mappers.values():
+            assert reader.from_sequenced_item(item).__dict__ == event.__dict__
+    assert len(mappers['binary'].to_sequenced_item(event).data) < len(mappers['json'].to_sequenced_item(event).data)
+
+
+@mark.parametrize('codec', sorted(CODECS))
+def test_application_replays_users_and_snapshots_with_codec(codec):
+    app = KanbanApplication(codec=codec, snapshot_max_events=2, **in_memory_application_kwargs(snapshotting=True))
+    try:
+        user = User.create("Name", PASSWORDS[0], 'email@dot.com', 'dot.com')
+        user.add_domain('other.com')
+        user.change_attribute('name', "Changed")
+        user.save()
+        assert app.snapshot_strategy.get_snapshot(user.id) is not None
+        loaded = app.user_repository.get_entity(user.id)
+        assert loaded.name == "Changed"
+        assert loaded.domains == {'dot.com', 'other.com'}
+    finally:
+        app.close()
+
+
+def test_legacy_json_rows_decode_with_binary_codec():
+    event = created_event()
+    json_item = KanbanSequencedItemMapper(sequence_id_attr_name='originator_id',
+                                          position_attr_name='originator_version',
+                                          codec='json').to_sequenced_item(event)
+    item = SequencedItem(*json_item)
+    mapper = KanbanSequencedItemMapper(sequence_id_attr_name='originator_id',
+                                       position_attr_name='originator_version', codec='binary')
+    assert mapper.from_sequenced_item(item).__dict__ == event.__dict__
+
+
+def test_binary_payloads_are_printable_and_older_payloads_still_decode():
+    event = created_event()
+    mapper = KanbanSequencedItemMapper(sequence_id_attr_name='originator_id',
+                                       position_attr_name='originator_version', codec='binary')
+    data = mapper.to_sequenced_item(event).data
+    assert data[:1] == BINARY_TAG and all(' ' <= c <= '~' for c in data[1:])
+    payload = base64.b64decode(data[1:])
+    latin1_data = LATIN1_BINARY_TAG + payload.decode('latin-1')
+    assert '\x00' in latin1_data
+    base85_data = BASE85_BINARY_TAG + base64.b85encode(payload).decode('ascii')
+    for older_data in (latin1_data, base85_data):
+        item = mapper.to_sequenced_item(event)._replace(data=older_data)
+        assert mapper.from_sequenced_item(item).__dict__ == event.__dict__
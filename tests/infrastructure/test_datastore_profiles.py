@@ -0,0 +1,56 @@
+import os
+from uuid import uuid4
+
+from eventsourcing.infrastructure.sequenceditem import SequencedItem
+from eventsourcing.infrastructure.sqlalchemy.activerecords import IntegerSequencedItemRecord
+from eventsourcing.infrastructure.sqlalchemy.datastore import SQLAlchemySettings
+from pytest import fixture, raises
+from sqlalchemy.exc import OperationalError
+
+from infrastructure.datastore import KanbanSQLAlchemyDatastore
+from infrastructure.record_strategies import KanbanSQLAlchemyActiveRecordStrategy
+
+
+@fixture
+def datastore(tmpdir):
+    db = KanbanSQLAlchemyDatastore(
+        profile='throughput',
+        settings=SQLAlchemySettings(uri=f"sqlite:///{os.path.join(str(tmpdir), 'event.db')}"),
+        tables=(IntegerSequencedItemRecord,),
+    )
+    db.setup_connection()
+    db.setup_tables()
+    yield db
+    db.drop_connection()
+
+
+def test_profile_pragmas_are_set_on_connections(datastore):
+    assert datastore.session.execute("PRAGMA journal_mode").scalar() == 'wal'
+    assert datastore.session.execute("PRAGMA synchronous").scalar() == 1
+    assert datastore.read_session.execute("PRAGMA mmap_size").scalar() == 256 * 2 ** 20
+    with raises(OperationalError):
+        datastore.read_session.execute("DELETE FROM integer_sequenced_items")
+
+
+def test_reads_see_writes_through_the_reader_engine(datastore):
+    strategy = KanbanSQLAlchemyActiveRecordStrategy(
+        active_record_class=IntegerSequencedItemRecord,
+        session=datastore.session,
+        read_session=datastore.read_session,
+    )
+    sequence_id = uuid4()
+    strategy.append(SequencedItem(sequence_id, 0, 'topic', '{}'))
+    assert strategy.get_item(sequence_id, 0).position == 0
+    strategy.append([SequencedItem(sequence_id, 1, 'topic', '{}')])
+    assert [item.position for item in strategy.get_items(sequence_id)] == [0, 1]
+
+
+def test_drop_connection_closes_pooled_connections(datastore):
+    datastore.session.execute("SELECT 1")
+    datastore.read_session.execute("SELECT 1")
+    datastore.session.close()
+    datastore.read_session.close()
+    engines = (datastore._engine, datastore._read_engine)
+    assert [engine.pool.checkedin() for engine in engines] == [1, 1]
+    datastore.drop_connection()
+    assert [engine.pool.checkedin() for engine in engines] == [0, 0]
@@ -0,0 +1,50 @@
+from pytest import mark
+
+from infrastructure.transcoding import ENCRYPTED_FIELD_KEY
+from kanban.domain.model.user import User
+from tests.workflow_platform.domain.model.test_user import PASSWORDS
+
+CREATED_TOPIC = 'kanban.domain.model.user#User.Created'
+
+
+def create_users(n):
+    users = []
+    for i in range(n):
+        user = User.create("Name", PASSWORDS[0], f'email{i}@dot.com', 'dot.com')
+        user.change_attribute('name', f"Name {i}")
+        user.save()
+        users.append(user)
+    return users
+
+
+def test_export_events_in_log_order_across_pages(app):
+    users = create_users(5)
+    rows = list(app.export_events(page_size=3))
+    assert [row['position'] for row in rows] == sorted(row['position'] for row in rows)
+    assert len({row['position'] for row in rows}) == 10
+    assert [(row['originator_id'], row['originator_version']) for row in rows] == [
+        (str(user.id), version) for user in users for version in (0, 1)]
+    assert rows[1]['data']['name'] == 'name'
+
+    resumed = list(app.export_events(from_position=rows[4]['position'], page_size=3))
+    assert resumed == rows[4:]
+
+
+def test_export_events_filters_by_topic_and_originator(app):
+    users = create_users(4)
+    created = list(app.export_events(topic=CREATED_TOPIC, page_size=2))
+    assert [row['originator_id'] for row in created] == [str(user.id) for user in users]
+    assert {row['topic'] for row in created} == {CREATED_TOPIC}
+
+    rows = list(app.export_events(originator_id=users[2].id, page_size=1))
+    assert [row['originator_version'] for row in rows] == [0, 1]
+    assert list(app.export_events(from_position=rows[-1]['position'] + 1, originator_id=users[2].id)) == []
+
+
+# Events are only encrypted in SQLite, where they are written with the datastore's cipher.
+@mark.parametrize('application_kwargs', ['sqlite'], indirect=True)
+def test_export_events_leaves_encrypted_fields_encrypted(app):
+    create_users(1)
+    created = next(app.export_events(topic=CREATED_TOPIC))
+    assert ENCRYPTED_FIELD_KEY in created['data']['email']
+    assert 'email0@dot.com' not in str(created)
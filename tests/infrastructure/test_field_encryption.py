@@ -0,0 +1,36 @@
+from uuid import uuid4
+
+from infrastructure.ciphers import get_cipher
+from infrastructure.kanban_application import KanbanApplication, in_memory_application_kwargs
+from infrastructure.transcoding import EncryptedField
+from kanban.domain.model.user import User
+from tests.workflow_platform.domain.model.test_user import PASSWORDS
+
+
+def test_declared_fields_are_encrypted_and_others_left_clear():
+    app = KanbanApplication(cipher=get_cipher('0123456789abcdef'), snapshot_max_events=2,
+                            **in_memory_application_kwargs(snapshotting=True))
+    try:
+        user = User.create("Name", PASSWORDS[0], 'secret@dot.com', 'dot.com', user_id=uuid4())
+        user.change_attribute('email', 'changed@dot.com')
+        user.add_domain('other.com')
+        user.save()
+
+        store = app.entity_event_store
+        items = store.active_record_strategy.get_items(user.id)
+        assert all('secret@dot.com' not in item.data and PASSWORDS[0] not in item.data for item in items)
+        assert 'changed@dot.com' not in items[1].data
+        assert 'dot.com' in items[0].data
+
+        created = store.sequenced_item_mapper.from_sequenced_item(items[0], decrypt=False)
+        assert isinstance(created.password, EncryptedField)
+        assert created.default_domain == 'dot.com'
+        created = store.sequenced_item_mapper.from_sequenced_item(items[0])
+        assert (created.password, created.email) == (PASSWORDS[0], 'secret@dot.com')
+
+        snapshot_items = app.snapshot_event_store.active_record_strategy.get_items(user.id)
+        assert snapshot_items and 'changed@dot.com' not in snapshot_items[-1].data
+        loaded = app.user_repository.get_entity(user.id)
+        assert (loaded.password, loaded.email) == (PASSWORDS[0], 'changed@dot.com')
+    finally:
+        app.close()
@@ -0,0 +1,58 @@
+from uuid import uuid4
+
+from pytest import fixture
+
+from kanban.domain.model.user import User
+from tests.workflow_platform.domain.model.test_user import PASSWORDS
+
+
+@fixture
+def application_options():
+    return dict(snapshot_max_events=3)
+
+
+def count_calls(active_record_strategy, label, calls):
+    """Records each read of the strategy in calls, as '<label>.<method name>'.
+
+    Reads a strategy makes of itself, as the in-memory strategy's get_items_after() does, aren't recorded.
+    """
+    reading = []
+    for name in ('get_item', 'get_items', 'get_last_items', 'get_items_after'):
+        method = getattr(active_record_strategy, name)
+
+        def counting(*args, _name=f'{label}.{name}', _method=method, **kwargs):
+            if not reading:
+                calls.append(_name)
+            reading.append(_name)
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                reading.pop()
+        setattr(active_record_strategy, name, counting)
+
+
+def test_get_many_matches_loading_users_one_at_a_time(app):
+    user_ids = []
+    for n_changes in range(8):
+        user = User.create("Name", PASSWORDS[0], f'email{n_changes}@dot.com', 'dot.com')
+        for i in range(n_changes):
+            user.change_attribute('name', f"Name {i}")
+        user.add_domain('other.com')
+        user.save()
+        user_ids.append(user.id)
+    discarded = app.user_repository[user_ids[0]]
+    discarded.discard()
+    discarded.save()
+    requested = list(reversed(user_ids)) + [uuid4()]
+
+    calls = []
+    count_calls(app.snapshot_strategy.event_store.active_record_strategy, 'snapshots', calls)
+    count_calls(app.entity_event_store.active_record_strategy, 'events', calls)
+    users = list(app.user_repository.get_many(requested))
+    batch_calls = list(calls)
+
+    assert [user.id for user in users] == list(reversed(user_ids[1:]))
+    for user in users:
+        expected = app.user_repository.get_entity(user.id)
+        assert (user.version, user.name, user.domains) == (expected.version, expected.name, expected.domains)
+    assert batch_calls == ['snapshots.get_last_items', 'events.get_items_after']
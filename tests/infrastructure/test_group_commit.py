@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from eventsourcing.exceptions import SequencedItemError
+from eventsourcing.infrastructure.sequenceditem import SequencedItem
+from eventsourcing.infrastructure.sqlalchemy.activerecords import IntegerSequencedItemRecord
+from eventsourcing.infrastructure.sqlalchemy.datastore import ActiveRecord
+from pytest import fixture, raises
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from infrastructure.record_strategies import EventLogRecord, GroupCommitActiveRecordStrategy
+
+
+@fixture
+def strategy():
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    ActiveRecord.metadata.create_all(engine)
+    yield GroupCommitActiveRecordStrategy(
+        active_record_class=IntegerSequencedItemRecord,
+        session=scoped_session(sessionmaker(bind=engine)),
+        commit_window=0.05,
+    )
+
+
+def item(sequence_id, position):
+    return SequencedItem(sequence_id, position, 'topic', '{}')
+
+
+def test_concurrent_appends_share_commits(strategy):
+    sequence_ids = [uuid4() for _ in range(20)]
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        list(executor.map(lambda sequence_id: strategy.append(item(sequence_id, 0)), sequence_ids))
+    for sequence_id in sequence_ids:
+        assert len(strategy.get_items(sequence_id)) == 1
+    assert strategy.stats['batch_size']['count'] < 20
+    assert strategy.stats['wait_time']['count'] == 20
+
+
+def test_conflict_fails_only_its_caller(strategy):
+    existing = uuid4()
+    strategy.append(item(existing, 0))
+    new = uuid4()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        conflicting = executor.submit(strategy.append, item(existing, 0))
+        ok = executor.submit(strategy.append, [item(new, 0), item(new, 1)])
+        with raises(SequencedItemError):
+            conflicting.result()
+        ok.result()
+    assert len(strategy.get_items(new)) == 2
+
+
+def test_callers_are_given_the_log_positions_of_their_commit(strategy):
+    strategy.log_record_class = EventLogRecord
+
+    def append(sequence_id):
+        strategy.append([item(sequence_id, 0), item(sequence_id, 1)])
+        return sequence_id, strategy.get_appended_log_positions()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        appended = list(executor.map(append, [uuid4() for _ in range(8)]))
+    for sequence_id, (first, last) in appended:
+        assert all(first <= position <= last for position, _ in strategy.get_log_page(sequence_id=sequence_id))
+    assert max(last for _, (_, last) in appended) == 16
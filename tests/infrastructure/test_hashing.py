@@ -0,0 +1,98 @@
+from concurrent.futures import Future
+from threading import current_thread
+
+from pytest import raises
+
+from infrastructure.hashing import HashingQueueFull, PasswordHashingExecutor
+from infrastructure.kanban_application import KanbanApplication, in_memory_application_kwargs
+from tests.workflow_platform.domain.model.test_user import PASSWORDS
+from utility.metrics import metrics
+from utility.parse import valid_encrypted_password
+
+
+def test_hashing_executor_hashes_password():
+    executor = PasswordHashingExecutor(max_workers=1, max_queue_depth=1)
+    try:
+        assert valid_encrypted_password(executor.submit('Mk91Q^U%').result())
+    finally:
+        executor.shutdown()
+
+
+def test_hashing_executor_fails_fast_when_queue_is_full():
+    executor = PasswordHashingExecutor(max_workers=1, max_queue_depth=1)
+    try:
+        pending = executor.submit('Mk91Q^U%')
+        with raises(HashingQueueFull):
+            executor.submit('z$XsntEXK%I73Z$c')
+        pending.result()
+    finally:
+        executor.shutdown()
+
+
+def test_hashing_executor_maps_batches_in_chunks():
+    executor = PasswordHashingExecutor(max_workers=1, max_queue_depth=1)
+    try:
+        progress = []
+        hashes = executor.map(['Mk91Q^U%'] * 3, on_progress=progress.append)
+        assert len(hashes) == 3 and all(map(valid_encrypted_password, hashes))
+        assert progress == [1, 2, 3]
+        # Each chunk's slot is released as its hashes are collected.
+        executor.submit('Mk91Q^U%').result()
+    finally:
+        executor.shutdown()
+
+
+def test_hashing_executor_records_the_hash_time_of_every_password(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', True)
+    histogram = metrics.histogram('kanban_password_hash_seconds')
+    count = histogram.count
+    executor = PasswordHashingExecutor(max_workers=1, max_queue_depth=4)
+    try:
+        executor.submit('Mk91Q^U%').result()
+        executor.map(['Mk91Q^U%'] * 3)
+    finally:
+        # Waits for the pool's result thread, which runs the futures' callbacks.
+        executor.shutdown()
+    assert histogram.count == count + 4
+
+
+def test_hashing_executor_rejects_batches_when_queue_is_full():
+    executor = PasswordHashingExecutor(max_workers=1, max_queue_depth=4)
+    try:
+        pending = [executor.submit('Mk91Q^U%') for _ in range(3)]
+        with raises(HashingQueueFull):
+            executor.map(['z$XsntEXK%I73Z$c'] * 2)
+        for future in pending:
+            future.result()
+    finally:
+        executor.shutdown()
+
+
+class DeferredHashingExecutor(object):
+    """Returns futures the test completes, as the process pool's result thread would."""
+
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, password):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def test_new_user_async_saves_users_off_the_thread_completing_the_hash():
+    hashing_executor = DeferredHashingExecutor()
+    app = KanbanApplication(hashing_executor=hashing_executor, **in_memory_application_kwargs())
+    try:
+        created = app.new_user_async("Name", 'Mk91Q^U%', 'email@dot.com', 'dot.com')
+        saving_threads = []
+        save = app._create_user
+        app._create_user = lambda *args: saving_threads.append(current_thread()) or save(*args)
+        hashing_executor.futures[0].set_result(PASSWORDS[0])
+        assert created.result(timeout=10).email == 'email@dot.com'
+        assert saving_threads and saving_threads[0] is not current_thread()
+    finally:
+        app.close()
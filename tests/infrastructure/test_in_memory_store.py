@@ -0,0 +1,86 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from uuid import uuid4
+
+from eventsourcing.exceptions import SequencedItemError
+from eventsourcing.infrastructure.sequenceditem import SequencedItem
+from eventsourcing.infrastructure.sqlalchemy.activerecords import IntegerSequencedItemRecord
+from pytest import fixture, raises
+
+from infrastructure.kanban_application import KanbanApplication, in_memory_application_kwargs
+from infrastructure.record_strategies import InMemoryActiveRecordStrategy
+from kanban.domain.model.user import User
+from tests.workflow_platform.domain.model.test_user import PASSWORDS
+
+
+@fixture
+def strategy():
+    return InMemoryActiveRecordStrategy(active_record_class=IntegerSequencedItemRecord)
+
+
+def item(sequence_id, position):
+    return SequencedItem(sequence_id, position, 'topic', '{}')
+
+
+def test_taken_positions_are_rejected_all_or_nothing(strategy):
+    sequence_id = uuid4()
+    strategy.append(item(sequence_id, 0))
+    with raises(SequencedItemError):
+        strategy.append([item(sequence_id, 1), item(sequence_id, 0)])
+    with raises(SequencedItemError):
+        strategy.append([item(sequence_id, 1), item(sequence_id, 1)])
+    assert [i.position for i in strategy.get_items(sequence_id)] == [0]
+    with raises(IndexError):
+        strategy.get_item(sequence_id, 1)
+
+
+def test_get_items_reads_position_ranges(strategy):
+    sequence_id = uuid4()
+    strategy.append([item(sequence_id, position) for position in range(10)])
+
+    def positions(**kwargs):
+        return [i.position for i in strategy.get_items(sequence_id, **kwargs)]
+
+    assert positions(gt=2, lte=5) == [3, 4, 5]
+    assert positions(gte=2, lt=5) == [2, 3, 4]
+    assert positions(limit=2) == [0, 1]
+    assert positions(limit=2, query_ascending=False) == [8, 9]
+    assert positions(limit=2, query_ascending=False, results_ascending=False) == [9, 8]
+    assert positions(lt=3, results_ascending=False) == [2, 1, 0]
+    assert strategy.get_items(uuid4()) == []
+
+
+def test_application_runs_in_memory():
+    app = KanbanApplication(snapshot_max_events=2, **in_memory_application_kwargs(snapshotting=True))
+    try:
+        user = User.create("Name", PASSWORDS[0], 'email@dot.com', 'dot.com')
+        for i in range(5):
+            user.change_attribute('name', f"Name {i}")
+        user.save()
+        assert app.user_repository[user.id].name == "Name 4"
+        assert app.user_email_index.get_user_id('email@dot.com') == user.id
+        assert app.snapshot_strategy.get_snapshot(user.id) is not None
+    finally:
+        app.close()
+
+
+class HashedHashingExecutor(object):
+    """Returns a ready hash, so concurrent requests contend only for the read model database."""
+
+    def submit(self, password):
+        future = Future()
+        future.set_result(PASSWORDS[0])
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def test_application_in_memory_serves_concurrent_requests():
+    app = KanbanApplication(hashing_executor=HashedHashingExecutor(), **in_memory_application_kwargs())
+    try:
+        emails = [f'email{i}@dot.com' for i in range(200)]
+        with ThreadPoolExecutor(8) as executor:
+            users = list(executor.map(lambda email: app.new_user("Name", 'Mk91Q^U%', email, 'dot.com'), emails))
+        assert [app.user_email_index.get_user_id(email) for email in emails] == [user.id for user in users]
+    finally:
+        app.close()
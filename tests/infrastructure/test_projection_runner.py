@@ -0,0 +1,115 @@
+from pytest import fixture, mark, raises
+
+from infrastructure.kanban_application import in_memory_application_kwargs
+from infrastructure.projections.runner import ProjectionRunner
+from infrastructure.projections.user_domain_index import UserDomainIndexPolicy
+from infrastructure.record_strategies import EventLogRecord
+from kanban.domain.model.user import User
+from tests.workflow_platform.domain.model.test_user import PASSWORDS
+from utility.metrics import metrics
+
+
+@fixture(params=['sqlite', 'memory'])
+def application_kwargs(request, sqlite_application_kwargs):
+    kwargs = in_memory_application_kwargs() if request.param == 'memory' else sqlite_application_kwargs
+    # Without a read model session the application doesn't maintain any projections.
+    return dict(kwargs, session=None)
+
+
+def projection_runner(app, session, projections=(), **kwargs):
+    return ProjectionRunner(session, app.entity_event_store.sequenced_item_mapper,
+                            app.entity_event_store.active_record_strategy, projections, **kwargs)
+
+
+def create_users(domain, n):
+    users = []
+    for i in range(n):
+        user = User.create("Name", PASSWORDS[0], f'email{i}@dot.com', domain)
+        user.save()
+        users.append(user)
+    return users
+
+
+def test_projection_runner_catches_up_in_pages(app, session):
+    users = create_users('dot.com', 5)
+    users[0].discard()
+    users[0].save()
+
+    domain_index = UserDomainIndexPolicy(session=session)
+    try:
+        runner = projection_runner(app, session, [domain_index], page_size=2)
+        assert runner.lag() == {'user_domain_index': 6}
+        assert runner.catch_up() == {'user_domain_index': 6}
+        assert runner.lag() == {'user_domain_index': 0}
+        user_ids, _ = domain_index.list_user_ids('dot.com')
+        assert sorted(user_ids) == sorted(u.id for u in users[1:])
+    finally:
+        domain_index.close()
+
+
+def test_projection_runner_resumes_from_checkpoint(app, session):
+    domain_index = UserDomainIndexPolicy(session=session)
+    domain_index.close()
+    runner = projection_runner(app, session, [domain_index])
+
+    create_users('dot.com', 2)
+    assert runner.catch_up() == {'user_domain_index': 2}
+    create_users('dot.com', 1)
+    assert runner.lag() == {'user_domain_index': 1}
+    assert runner.catch_up() == {'user_domain_index': 1}
+    assert len(domain_index.list_user_ids('dot.com')[0]) == 3
+
+
+def test_policies_advance_their_checkpoints_until_they_fail(app, session):
+    domain_index = UserDomainIndexPolicy(session=session, event_log=app.entity_event_store.active_record_strategy)
+    try:
+        runner = projection_runner(app, session, [domain_index])
+        assert runner.catch_up() == {'user_domain_index': 0}
+        create_users('dot.com', 2)
+        assert runner.lag() == {'user_domain_index': 0}
+
+        def fail(event):
+            raise RuntimeError("Projection failed.")
+        domain_index.apply = fail
+        with raises(RuntimeError):
+            create_users('other.com', 1)
+        del domain_index.apply
+        create_users('another.com', 1)
+        assert runner.lag() == {'user_domain_index': 2}
+        assert 'kanban_projection_lag{projection="user_domain_index"} 2' in metrics.render().splitlines()
+        assert runner.catch_up() == {'user_domain_index': 2}
+        assert len(domain_index.list_user_ids('other.com')[0]) == 1
+        create_users('dot.com', 1)
+        assert runner.lag() == {'user_domain_index': 0}
+    finally:
+        domain_index.close()
+
+
+@mark.parametrize('application_kwargs', ['sqlite'], indirect=True)
+def test_log_positions_survive_deletes_and_vacuum(app, session):
+    users = create_users('dot.com', 3)
+    strategy = app.entity_event_store.active_record_strategy
+    runner = projection_runner(app, session)
+    for record_class in (strategy.active_record_class, EventLogRecord):
+        session.query(record_class).filter_by(sequence_id=users[2].id).delete()
+    session.commit()
+    session.bind.execute('VACUUM')
+
+    assert [position for position, _ in strategy.get_log_page()] == [1, 2]
+    assert runner.get_head_position() == 2
+    create_users('other.com', 1)
+    assert [position for position, _ in strategy.get_log_page()] == [1, 2, 4]
+    assert runner.get_head_position() == 4
+
+
+@mark.parametrize('application_kwargs', ['sqlite'], indirect=True)
+def test_log_is_backfilled_in_rowid_order(app, session):
+    create_users('dot.com', 3)
+    strategy = app.entity_event_store.active_record_strategy
+    expected = strategy.get_log_page()
+    session.query(EventLogRecord).delete()
+    session.commit()
+
+    assert strategy.backfill_log() == 3
+    assert strategy.get_log_page() == expected
+    assert strategy.backfill_log() == 0
@@ -0,0 +1,78 @@
+from uuid import uuid4
+
+from pytest import fixture
+
+from infrastructure.projections.rebuild import partition_bounds, rebuild_projections
+from infrastructure.projections.runner import ProjectionCheckpointRecord
+from infrastructure.projections.user_details import UserDetailsRecord
+from infrastructure.projections.user_domain_index import UserDomainRecord
+from infrastructure.projections.user_email_index import UserEmailRecord
+from kanban.domain.model.user import User
+from tests.workflow_platform.domain.model.test_user import PASSWORDS
+
+
+@fixture
+def db_host(tmpdir):
+    # Rebuild workers connect to the database themselves, so it has to be a file.
+    return f"sqlite:///{tmpdir}/events.db"
+
+
+@fixture
+def application_kwargs(sqlite_application_kwargs):
+    return sqlite_application_kwargs
+
+
+def table(session, record_class, *columns):
+    try:
+        return sorted(session.query(*(getattr(record_class, c) for c in columns)))
+    finally:
+        session.close()
+
+
+def test_partition_bounds_cover_the_user_id_space():
+    bounds = partition_bounds(4)
+    assert bounds[0][0] is None and bounds[-1][1] is None
+    assert [start for start, _ in bounds[1:]] == [stop for _, stop in bounds[:-1]]
+
+
+def test_rebuilt_projections_match_projections_maintained_by_policies(app, db_host):
+    for i in range(20):
+        user = User.create("Name", PASSWORDS[0], f'email{i}@dot.com', 'dot.com')
+        user.add_domain(f'domain{i % 3}.com')
+        if i % 4 == 0:
+            user.change_attribute('email', f'changed{i}@dot.com')
+        if i % 5 == 0:
+            user.discard_domain(f'domain{i % 3}.com')
+        user.save()
+        if i % 7 == 0:
+            user.discard()
+            user.save()
+    session = app.projection_runner.session
+    emails = table(session, UserEmailRecord, 'email', 'user_id', 'is_confirmed')
+    domains = table(session, UserDomainRecord, 'domain', 'user_id')
+    details = table(session, UserDetailsRecord, *UserDetailsRecord.__table__.columns.keys())
+    session.query(UserDomainRecord).delete()
+    session.commit()
+
+    counts = rebuild_projections(app, db_host, workers=2)
+
+    assert counts == {'user_email_index': len(emails), 'user_domain_index': len(domains),
+                      'user_details': len(details)}
+    assert table(session, UserEmailRecord, 'email', 'user_id', 'is_confirmed') == emails
+    assert table(session, UserDomainRecord, 'domain', 'user_id') == domains
+    assert table(session, UserDetailsRecord, *UserDetailsRecord.__table__.columns.keys()) == details
+    head = app.projection_runner.get_head_position()
+    assert table(session, ProjectionCheckpointRecord, 'name', 'position') == [
+        ('user_details', head), ('user_domain_index', head), ('user_email_index', head)]
+
+
+def test_rebuilding_keeps_email_reservations(app, db_host):
+    user = User.create("Name", PASSWORDS[0], 'email@dot.com', 'dot.com')
+    user.save()
+    reserved_by = uuid4()
+    app.user_email_index.reserve('reserved@dot.com', reserved_by)
+
+    assert rebuild_projections(app, db_host, names=['user_email_index'], workers=1) == {'user_email_index': 1}
+
+    assert table(app.projection_runner.session, UserEmailRecord, 'email', 'user_id', 'is_confirmed') == sorted([
+        ('email@dot.com', user.id, True), ('reserved@dot.com', reserved_by, False)])
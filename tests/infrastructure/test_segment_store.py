@@ -0,0 +1,119 @@
+import os
+from uuid import uuid4
+
+from eventsourcing.exceptions import SequencedItemError
+from eventsourcing.infrastructure.sequenceditem import SequencedItem
+from pytest import raises
+
+from infrastructure.kanban_application import KanbanApplication
+from infrastructure.segment_store import SegmentFileActiveRecordStrategy
+from kanban.domain.model.user import User
+from tests.workflow_platform.domain.model.test_user import PASSWORDS
+
+
+def item(sequence_id, position, data='{"name":"Ñame"}'):
+    return SequencedItem(sequence_id, position, 'topic', data)
+
+
+def test_items_survive_reopening_and_segment_roll_over(tmpdir):
+    store = SegmentFileActiveRecordStrategy(str(tmpdir), segment_size=200)
+    sequence_id = uuid4()
+    for position in range(10):
+        store.append(item(sequence_id, position))
+    with raises(SequencedItemError):
+        store.append([item(sequence_id, 10), item(sequence_id, 3)])
+    store.close()
+    assert len([name for name in os.listdir(str(tmpdir)) if name.startswith('segment-')]) > 1
+
+    store = SegmentFileActiveRecordStrategy(str(tmpdir), segment_size=200)
+    try:
+        assert [i.position for i in store.get_items(sequence_id, gte=2, lt=5)] == [2, 3, 4]
+        assert [i.position for i in store.get_items(sequence_id, limit=2, query_ascending=False)] == [8, 9]
+        assert store.get_item(sequence_id, 9) == item(sequence_id, 9)
+        assert len(list(store.all_items())) == 10
+        with raises(IndexError):
+            store.get_item(sequence_id, 10)
+        with raises(SequencedItemError):
+            store.delete_record(item(sequence_id, 9))
+    finally:
+        store.close()
+
+
+def test_unindexed_appends_are_recovered_and_torn_appends_discarded(tmpdir):
+    store = SegmentFileActiveRecordStrategy(str(tmpdir))
+    sequence_id = uuid4()
+    store.append(item(sequence_id, 0))
+    store.append([item(sequence_id, 1), item(sequence_id, 2)])
+    store.append([item(sequence_id, 3), item(sequence_id, 4)])
+    store.close()
+    # Lose the index entries of the last two appends, and the end of the last append.
+    index_path = os.path.join(str(tmpdir), 'index')
+    with open(index_path, 'r+b') as f:
+        f.truncate(os.path.getsize(index_path) - 4 * 32 + 5)
+    segment_path = os.path.join(str(tmpdir), 'segment-000000.log')
+    with open(segment_path, 'r+b') as f:
+        f.truncate(os.path.getsize(segment_path) - 3)
+
+    store = SegmentFileActiveRecordStrategy(str(tmpdir))
+    try:
+        assert [i.position for i in store.get_items(sequence_id)] == [0, 1, 2]
+        store.append(item(sequence_id, 3))
+        assert store.get_item(sequence_id, 3) == item(sequence_id, 3)
+    finally:
+        store.close()
+
+
+def test_index_entries_past_the_end_of_their_segment_are_dropped(tmpdir):
+    store = SegmentFileActiveRecordStrategy(str(tmpdir))
+    sequence_id = uuid4()
+    store.append(item(sequence_id, 0))
+    store.append([item(sequence_id, 1), item(sequence_id, 2)])
+    store.append(item(sequence_id, 3))
+    store.close()
+    # The index reached the disk, but the end of the segment didn't.
+    segment_path = os.path.join(str(tmpdir), 'segment-000000.log')
+    with open(segment_path, 'r+b') as f:
+        f.truncate(os.path.getsize(segment_path) - 40)
+
+    store = SegmentFileActiveRecordStrategy(str(tmpdir))
+    try:
+        assert [i.position for i in store.get_items(sequence_id)] == [0, 1, 2]
+        store.append(item(sequence_id, 3, data='{"name":"Other"}'))
+        assert store.get_item(sequence_id, 3) == item(sequence_id, 3, data='{"name":"Other"}')
+        assert store.get_item(sequence_id, 2) == item(sequence_id, 2)
+    finally:
+        store.close()
+    assert os.path.getsize(os.path.join(str(tmpdir), 'index')) == 4 * 32
+
+
+def test_application_replays_users_from_segments(tmpdir):
+    store = SegmentFileActiveRecordStrategy(str(tmpdir))
+    app = KanbanApplication(entity_active_record_strategy=store)
+    try:
+        user = User.create("Name", PASSWORDS[0], 'email@dot.com', 'dot.com')
+        user.change_attribute('name', "Changed")
+        user.save()
+        assert app.user_repository[user.id].name == "Changed"
+    finally:
+        app.close()
+        store.close()
+
+
+def test_pages_are_ordered_by_sequence_and_position(tmpdir):
+    store = SegmentFileActiveRecordStrategy(str(tmpdir))
+    sequence_ids = [uuid4() for _ in range(3)]
+    for position in range(3):
+        for sequence_id in sequence_ids:
+            store.append(item(sequence_id, position))
+    try:
+        expected = [(s, p) for s in sorted(sequence_ids) for p in range(3)]
+        read, after = [], None
+        while True:
+            page = store.get_page(after=after, limit=4)
+            read.extend((i.sequence_id, i.position) for i in page)
+            if len(page) < 4:
+                break
+            after = (page[-1].sequence_id, page[-1].position)
+        assert read == expected
+    finally:
+        store.close()
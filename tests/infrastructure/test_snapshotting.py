@@ -0,0 +1,65 @@
+from infrastructure.kanban_application import KanbanApplication
+from kanban.domain.model.user import User
+from tests.workflow_platform.domain.model.test_user import PASSWORDS
+
+
+def test_user_is_snapshotted_after_max_events(sqlite_application_kwargs):
+    app = KanbanApplication(snapshot_max_events=5, **sqlite_application_kwargs)
+    try:
+        user = User.create("Name", PASSWORDS[0], 'email@dot.com', 'dot.com')
+        user.add_domain('other.com')
+        user.save()
+        assert app.snapshot_strategy.get_snapshot(user.id) is None
+        for i in range(4):
+            user.change_attribute('name', f"Name {i}")
+        user.save()
+        snapshot = app.snapshot_strategy.get_snapshot(user.id)
+        assert snapshot.originator_version == 5
+        assert snapshot.state['domains'] == {'dot.com', 'other.com'}
+
+        user.change_attribute('name', "Last Name")
+        user.save()
+        loaded = app.user_repository[user.id]
+        assert loaded.name == "Last Name"
+        assert loaded.domains == {'dot.com', 'other.com'}
+        assert loaded.version == user.version
+    finally:
+        app.close()
+
+
+def test_user_is_snapshotted_when_replay_is_slow(sqlite_application_kwargs):
+    app = KanbanApplication(snapshot_max_events=1000, snapshot_max_replay_time=0, **sqlite_application_kwargs)
+    try:
+        user = User.create("Name", PASSWORDS[0], 'email@dot.com', 'dot.com')
+        user.save()
+        assert app.snapshot_strategy.get_snapshot(user.id) is None
+        app.user_repository[user.id]
+        user.change_attribute('name', "Changed Name")
+        user.save()
+        assert app.snapshot_strategy.get_snapshot(user.id).originator_version == 1
+    finally:
+        app.close()
+
+
+def test_snapshot_versions_are_read_from_the_store_after_a_restart(sqlite_application_kwargs):
+    app = KanbanApplication(snapshot_max_events=5, **sqlite_application_kwargs)
+    try:
+        user = User.create("Name", PASSWORDS[0], 'email@dot.com', 'dot.com')
+        for i in range(5):
+            user.change_attribute('name', f"Name {i}")
+        user.save()
+        assert app.snapshot_strategy.get_snapshot(user.id).originator_version == 5
+    finally:
+        app.close()
+
+    app = KanbanApplication(snapshot_max_events=5, **sqlite_application_kwargs)
+    try:
+        user.change_attribute('name', "Restarted")
+        user.save()
+        assert app.snapshot_strategy.get_snapshot(user.id).originator_version == 5
+        for i in range(4):
+            user.change_attribute('name', f"Name {i}")
+        user.save()
+        assert app.snapshot_strategy.get_snapshot(user.id).originator_version == 10
+    finally:
+        app.close()
@@ -0,0 +1,80 @@
+import time
+
+from pytest import fixture
+
+from infrastructure.kanban_application import KanbanApplication, in_memory_application_kwargs
+from kanban.domain.model.user import User
+from tests.workflow_platform.domain.model.test_user import PASSWORDS
+
+
+@fixture
+def app():
+    app = KanbanApplication(snapshot_max_events=3, **in_memory_application_kwargs(snapshotting=True))
+    yield app
+    app.close()
+
+
+def create_user_with_history(n_changes):
+    """Returns the user, and the time after each of its versions was stored, by version."""
+    user = User.create("Name", PASSWORDS[0], 'email@dot.com', 'dot.com')
+    user.save()
+    times = {user.version: time.time()}
+    for i in range(n_changes):
+        time.sleep(0.001)
+        user.change_attribute('name', f"Name {i}")
+        user.save()
+        times[user.version] = time.time()
+    return user, times
+
+
+def test_get_as_of_version_matches_full_replay(app):
+    repository = app.user_repository
+    user, _ = create_user_with_history(10)
+    for version in range(1, user.version + 1):
+        as_of = repository.get_as_of(user.id, version=version)
+        assert as_of.version == version
+        assert as_of.name == ("Name" if version == 1 else f"Name {version - 2}")
+    assert repository.get_as_of(user.id, version=0) is None
+    assert repository.get_as_of(user.id, version=100).version == user.version
+    assert repository.get_as_of(user.id).name == "Name 9"
+
+
+def test_get_as_of_replays_from_nearest_earlier_snapshot(app):
+    repository = app.user_repository
+    user, _ = create_user_with_history(10)
+    replayed = []
+    mutator = repository.event_player.mutator
+    repository.event_player.mutator = lambda entity, event: replayed.append(event) or mutator(entity, event)
+
+    assert repository.get_as_of(user.id, version=8).name == "Name 6"
+    assert 0 < len(replayed) < 8
+
+
+def test_get_as_of_time(app):
+    repository = app.user_repository
+    user, times = create_user_with_history(5)
+    assert repository.get_as_of(user.id, at=times[1] - 60) is None
+    for version, at in times.items():
+        assert repository.get_as_of(user.id, at=at).version == version
+    assert repository.get_as_of(user.id, version=2, at=times[4]).version == 2
+
+
+def test_get_as_of_caches_past_states(app):
+    repository = app.user_repository
+    user, _ = create_user_with_history(3)
+    first = repository.get_as_of(user.id, version=2)
+    first.name = "Modified"
+    get_entity, repository.get_entity = repository.get_entity, None
+    try:
+        assert repository.get_as_of(user.id, version=2).name == "Name 0"
+    finally:
+        repository.get_entity = get_entity
+
+
+def test_get_as_of_discarded_user(app):
+    repository = app.user_repository
+    user, _ = create_user_with_history(2)
+    user.discard()
+    user.save()
+    assert repository.get_as_of(user.id) is None
+    assert repository.get_as_of(user.id, version=3).name == "Name 1"
@@ -0,0 +1,70 @@
+from pytest import fixture
+
+from infrastructure.kanban_repositories import UserRepository
+from kanban.domain.model.user import User
+from tests.workflow_platform.domain.model.test_user import PASSWORDS
+
+
+@fixture
+def application_kwargs(sqlite_application_kwargs):
+    return dict(sqlite_application_kwargs, session=None)
+
+
+def create_user(email='email@dot.com'):
+    user = User.create("Name", PASSWORDS[0], email, 'dot.com')
+    user.save()
+    return user
+
+
+def test_cached_user_is_updated_by_published_events(app):
+    repository = app.user_repository
+    user = create_user()
+    assert repository[user.id].name == "Name"
+    user.change_attribute('name', "Changed Name")
+    user.add_domain('other.com')
+    user.save()
+    loaded = repository[user.id]
+    assert loaded.name == "Changed Name"
+    assert loaded.domains == {'dot.com', 'other.com'}
+    assert repository.cache_stats == {'hits': 1, 'misses': 1, 'evictions': 0}
+
+
+def test_cached_user_changed_by_another_writer_is_replayed(app):
+    repository = app.user_repository
+    user = create_user()
+    repository[user.id]
+    # Store an event without publishing it, as another process would.
+    event = User.AttributeChanged(originator_id=user.id, originator_version=user.version, name='name',
+                                  value="Other Writer")
+    app.entity_event_store.append(event)
+    assert repository[user.id].name == "Other Writer"
+    assert repository.cache_stats == {'hits': 0, 'misses': 2, 'evictions': 1}
+
+
+def test_callers_cannot_change_cached_users(app):
+    user = create_user()
+    app.user_repository[user.id].name = "Not Saved"
+    assert app.user_repository[user.id].name == "Name"
+
+
+def test_least_recently_used_user_is_evicted(app):
+    repository = UserRepository(event_store=app.entity_event_store, cache_size=1)
+    try:
+        first, second = create_user('first@dot.com'), create_user('second@dot.com')
+        repository[first.id]
+        repository[second.id]
+        repository[first.id]
+        assert repository.cache_stats == {'hits': 0, 'misses': 3, 'evictions': 2}
+    finally:
+        repository.close()
+
+
+def test_expired_user_is_replayed(app):
+    repository = UserRepository(event_store=app.entity_event_store, cache_ttl=0)
+    try:
+        user = create_user()
+        repository[user.id]
+        repository[user.id]
+        assert repository.cache_stats == {'hits': 0, 'misses': 2, 'evictions': 1}
+    finally:
+        repository.close()
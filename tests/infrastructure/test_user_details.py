@@ -0,0 +1,102 @@
+from pytest import fixture, raises
+
+from infrastructure.projections.runner import ProjectionRunner
+from infrastructure.projections.user_details import UserDetailsPolicy, UserDetailsRecord, user_details
+from kanban.domain.model.user import User
+from tests.workflow_platform.domain.model.test_user import PASSWORDS
+
+
+@fixture
+def application_kwargs(sqlite_application_kwargs):
+    return sqlite_application_kwargs
+
+
+def create_users(n):
+    users = []
+    for i in range(n):
+        user = User.create("Name", PASSWORDS[0], f'email{i}@dot.com', 'dot.com')
+        user.add_domain(f'domain{i}.com')
+        user.change_attribute('name', f"Name {i}")
+        if i % 2:
+            user.discard_domain(f'domain{i}.com')
+        user.save()
+        users.append(user)
+    return users
+
+
+def test_user_details_match_replayed_users(app):
+    users = create_users(4)
+    users[3].discard()
+    users[3].save()
+    for user in users[:3]:
+        assert app.user_details.get_details(user.id) == user_details(app.user_repository[user.id])
+    assert app.user_details.get_details(users[3].id) is None
+
+
+def test_user_details_are_unchanged_by_catching_up_again(app, session):
+    users = create_users(3)
+    expected = [app.user_details.get_details(user.id) for user in users]
+    runner = ProjectionRunner(session, app.entity_event_store.sequenced_item_mapper,
+                              app.entity_event_store.active_record_strategy, [app.user_details])
+    assert runner.catch_up() == {'user_details': 10}
+    assert [app.user_details.get_details(user.id) for user in users] == expected
+
+
+def test_replayed_created_event_leaves_the_row_as_it_is(app):
+    user = create_users(1)[0]
+    expected = app.user_details.get_details(user.id)
+    created = next(iter(app.entity_event_store.get_domain_events(user.id)))
+    assert isinstance(created, User.Created)
+    app.user_details.handle(created)
+    assert app.user_details.get_details(user.id) == expected
+
+
+def test_event_after_a_skipped_version_is_not_applied(app):
+    user = create_users(1)[0]
+    expected = app.user_details.get_details(user.id)
+    event = User.AttributeChanged(originator_id=user.id, originator_version=user.version + 1, name='name',
+                                  value="Skipped Ahead")
+    app.user_details.handle(event)
+    assert app.user_details.get_details(user.id) == expected
+
+
+def test_get_user_reads_the_read_model_without_the_event_store(app):
+    user = create_users(1)[0]
+    active_record_strategy = app.entity_event_store.active_record_strategy
+    get_items, active_record_strategy.get_items = active_record_strategy.get_items, None
+    try:
+        details = app.get_user(user.id)
+    finally:
+        active_record_strategy.get_items = get_items
+    assert (details['name'], details['version'], details['password']) == ("Name 0", 3, '********')
+    assert details['domains'] == ['domain0.com', 'dot.com']
+    assert app.get_user(user.id, version=1)['name'] == "Name"
+
+
+def test_user_details_rows_are_rebuilt_from_users():
+    user = create_users(1)[0]
+    assert UserDetailsPolicy.rows(user)[0]['domains'] == '["domain0.com", "dot.com"]'
+
+
+def test_event_after_a_failed_event_brings_the_row_up_to_date(app):
+    user = create_users(1)[0]
+    apply = app.user_details.apply
+
+    def fail(event):
+        raise RuntimeError("Projection failed.")
+    app.user_details.apply = fail
+    user.change_attribute('name', "Missed")
+    with raises(RuntimeError):
+        user.save()
+    app.user_details.apply = apply
+    user.add_domain('added.com')
+    user.save()
+    assert app.user_details.get_details(user.id) == user_details(app.user_repository[user.id])
+
+
+def test_users_without_a_row_are_replayed(app, session):
+    user = create_users(1)[0]
+    session.query(UserDetailsRecord).delete()
+    session.commit()
+    details = app.get_user(user.id)
+    assert details['version'] == user.version and details['name'] == user.name
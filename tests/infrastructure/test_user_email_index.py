@@ -0,0 +1,140 @@
+import time
+from uuid import uuid4
+
+from pytest import fixture, raises
+
+from infrastructure.projections.user_email_index import EmailAlreadyRegistered, UserEmailIndexPolicy
+from kanban.domain.model.user import User
+from tests.workflow_platform.domain.model.test_user import PASSWORDS
+
+
+@fixture
+def email_index(session):
+    policy = UserEmailIndexPolicy(session=session)
+    yield policy
+    policy.close()
+
+
+def test_reserved_email_cannot_be_reserved_again(email_index):
+    email_index.reserve('Email@Dot.com', uuid4())
+    with raises(EmailAlreadyRegistered):
+        email_index.reserve('email@dot.com ', uuid4())
+
+
+def test_released_email_can_be_reserved(email_index):
+    user_id = uuid4()
+    email_index.reserve('email@dot.com', user_id)
+    email_index.release('email@dot.com', user_id)
+    email_index.reserve('email@dot.com', uuid4())
+
+
+def test_abandoned_reservation_is_taken_over(email_index):
+    email_index.reservation_timeout = -1
+    email_index.reserve('email@dot.com', uuid4())
+    user_id = uuid4()
+    email_index.reserve('email@dot.com', user_id)
+    user = User.create("Name", PASSWORDS[0], 'email@dot.com', 'dot.com', user_id=user_id)
+    user.save()
+    assert email_index.get_user_id('email@dot.com') == user_id
+
+
+def test_renewed_reservation_is_not_taken_over(email_index):
+    email_index.reservation_timeout = 0.2
+    user_id = uuid4()
+    email_index.reserve('email@dot.com', user_id)
+    time.sleep(0.3)
+    assert email_index.renew({'Email@dot.com': user_id, 'other@dot.com': uuid4()}) == {'other@dot.com'}
+    with raises(EmailAlreadyRegistered):
+        email_index.reserve('email@dot.com', uuid4())
+
+
+def test_email_index_follows_user_events(email_index):
+    user = User.create("Name", PASSWORDS[0], 'email@dot.com', 'dot.com')
+    user.save()
+    assert email_index.get_user_id('email@dot.com') == user.id
+    user.change_attribute('email', 'changed@dot.com')
+    user.save()
+    assert email_index.get_user_id('email@dot.com') is None
+    assert email_index.get_user_id('changed@dot.com') == user.id
+    user.discard()
+    user.save()
+    assert email_index.get_user_id('changed@dot.com') is None
+
+
+def test_reserve_many_rejects_only_taken_emails(email_index):
+    email_index.reserve('taken@dot.com', uuid4())
+    user_id = uuid4()
+    rejected = email_index.reserve_many({'Taken@dot.com': uuid4(), 'free@dot.com': user_id})
+    assert rejected == {'Taken@dot.com'}
+    with raises(EmailAlreadyRegistered):
+        email_index.reserve('free@dot.com', uuid4())
+
+
+def test_email_change_does_not_take_over_another_users_email(email_index):
+    owner = User.create("Name", PASSWORDS[0], 'taken@dot.com', 'dot.com')
+    owner.save()
+    user = User.create("Name", PASSWORDS[0], 'email@dot.com', 'dot.com')
+    user.save()
+    user.change_attribute('email', 'Taken@dot.com')
+    user.save()
+    assert email_index.get_user_id('taken@dot.com') == owner.id
+    assert email_index.get_user_id('email@dot.com') == user.id
+
+
+def test_change_user_email_reserves_the_new_email(app):
+    owner = app.new_user("Name", 'Mk91Q^U%', 'taken@dot.com', 'dot.com')
+    user = app.new_user("Name", 'Mk91Q^U%', 'email@dot.com', 'dot.com')
+    with raises(EmailAlreadyRegistered):
+        app.change_user_email(user.id, 'TAKEN@dot.com')
+    assert app.user_repository[user.id].email == 'email@dot.com'
+    app.change_user_email(user.id, 'Email@dot.com')
+    app.change_user_email(user.id, 'changed@dot.com')
+    assert app.user_repository[user.id].email == 'changed@dot.com'
+    assert app.user_email_index.get_user_id('changed@dot.com') == user.id
+    assert app.user_email_index.get_user_id('email@dot.com') is None
+    assert app.user_email_index.get_user_id('taken@dot.com') == owner.id
+
+
+def test_email_stays_reserved_when_a_policy_fails_after_the_event_is_stored(app):
+    user = app.new_user("Name", 'Mk91Q^U%', 'other@dot.com', 'dot.com')
+    confirm = app.user_email_index._confirm
+
+    def fail(email, user_id):
+        raise RuntimeError("Projection failed.")
+    app.user_email_index._confirm = fail
+    with raises(RuntimeError):
+        app.new_user("Name", 'Mk91Q^U%', 'email@dot.com', 'dot.com')
+    with raises(RuntimeError):
+        app.change_user_email(user.id, 'changed@dot.com')
+    app.user_email_index._confirm = confirm
+    with raises(EmailAlreadyRegistered):
+        app.new_user("Name", 'Mk91Q^U%', 'email@dot.com', 'dot.com')
+    with raises(EmailAlreadyRegistered):
+        app.new_user("Name", 'Mk91Q^U%', 'changed@dot.com', 'dot.com')
+
+
+def test_new_users_renew_their_reservations_while_hashing(app):
+    index = app.user_email_index
+    index.reservation_timeout = -1
+
+    class TakingOverHashingExecutor(object):
+        """Has another user take over a reservation while the batch is hashed."""
+
+        def map(self, passwords, on_progress=None):
+            hashes = [PASSWORDS[0] for _ in passwords]
+            on_progress(1)
+            index.reserve('taken@dot.com', uuid4())
+            return hashes
+
+        def shutdown(self, wait=True):
+            pass
+
+    app.hashing_executor = TakingOverHashingExecutor()
+    results = app.new_users([
+        {'name': "Name", 'password': 'Mk91Q^U%', 'email': 'email@dot.com'},
+        {'name': "Name", 'password': 'Mk91Q^U%', 'email': 'taken@dot.com'},
+    ])
+    assert results[0].user.email == 'email@dot.com'
+    assert isinstance(results[1].error, EmailAlreadyRegistered)
+    assert index.get_user_id('email@dot.com') == results[0].user.id
+    assert index.get_user_id('taken@dot.com') is None
@@ -0,0 +1,47 @@
+from pytest import fixture
+
+from kanban.domain.model.user import User
+from tests.workflow_platform.domain.model.test_user import PASSWORDS
+
+
+@fixture
+def user_ids(app):
+    app.user_repository.__page_size__ = 4
+    user_ids = []
+    for n_changes in range(10):
+        user = User.create("Name", PASSWORDS[0], f'email{n_changes}@dot.com', 'dot.com')
+        for i in range(n_changes):
+            user.change_attribute('name', f"Name {i}")
+        user.save()
+        user_ids.append(user.id)
+    discarded = app.user_repository[user_ids[3]]
+    discarded.discard()
+    discarded.save()
+    return sorted(set(user_ids) - {user_ids[3]})
+
+
+def test_scan_yields_every_user_in_order_of_id(app, user_ids):
+    page_sizes = []
+    get_page = app.user_repository.event_store.active_record_strategy.get_page
+
+    def counting_get_page(*args, **kwargs):
+        page = get_page(*args, **kwargs)
+        page_sizes.append(len(page))
+        return page
+    app.user_repository.event_store.active_record_strategy.get_page = counting_get_page
+
+    users = list(app.user_repository.scan())
+
+    assert [user.id for user in users] == user_ids
+    for user in users:
+        expected = app.user_repository.get_entity(user.id)
+        assert (user.version, user.name) == (expected.version, expected.name)
+    assert max(page_sizes) == 4
+
+
+def test_scan_filters(app, user_ids):
+    users = app.user_repository.scan(predicate=lambda user: user.name == "Name")
+    assert [user.email for user in users] == ['email0@dot.com']
+
+    users = app.user_repository.scan(start=user_ids[2], stop=user_ids[5])
+    assert [user.id for user in users] == user_ids[2:5]
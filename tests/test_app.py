@@ -1,16 +1,23 @@
-from uuid import UUID
+import json
+from uuid import UUID, uuid4
 
 from apistar import TestClient
 from hypothesis import given, settings
 from hypothesis.extra.fakefactory import fake_factory
 from hypothesis.strategies import sampled_from
 
+import app as app_module
 from app import app
 
 VALID_PASSWORDS = ['z$XsntEXK%I73Z$c', 'Mk91Q^U%']
 INVALID_PASSWORDS = ['bK0j4$M', 'password']
 
 
+def unique_email(email):
+    """Emails must be unique across users, including those left in event.db by earlier runs."""
+    return f"{uuid4().hex[:12]}.{email}"
+
+
 @settings(max_examples=10)
 @given(name=fake_factory('name'),
        password=sampled_from(VALID_PASSWORDS),
@@ -21,7 +28,7 @@ def test_new_user(name, password, email, default_domain):
     payload = {
         "name": name,
         "password": password,
-        "email": email,
+        "email": unique_email(email),
         "default_domain": default_domain
     }
     response = client.post('/NewUser', json=payload)
@@ -35,27 +42,151 @@ def test_new_user(name, password, email, default_domain):
     assert '_created_on' in record['data']
     assert '_last_modified_on' in record['data']
 
-# @settings(max_examples=10)
-# @given(name=fake_factory('name'),
-#        password=sampled_from(VALID_PASSWORDS),
-#        email=fake_factory('email'),
-#        default_domain=fake_factory('domain_name'))
-# def test_list_users(name, password, email, default_domain):
-#     with UnitOfWork(session=get_session().session) as do:
-#         new_user = do.new_user(name, password, email, default_domain)
-#
-#     user_id = str(new_user.id)
-#
-#     client = TestClient(app)
-#     params = {
-#         'domain_namespace': default_domain
-#     }
-#     response = client.get('/ListUsers', params=params)
-#     assert response.status_code == 200
-#     users = response.json()['data']
-#     assert user_id in users
-#
-#
+
+def test_new_user_w_registered_email_returns_conflict():
+    client = TestClient(app)
+    email = unique_email("email@dot.com")
+    payload = {
+        "name": "Name",
+        "password": VALID_PASSWORDS[0],
+        "email": email,
+    }
+    assert client.post('/NewUser', json=payload).status_code == 202
+    payload['email'] = email.upper()
+    response = client.post('/NewUser', json=payload)
+    assert response.status_code == 409
+    assert response.json()['error'] == "EmailAlreadyRegisteredError"
+
+
+def test_bulk_new_users_reports_each_row():
+    client = TestClient(app)
+    email = unique_email("email@dot.com")
+    payload = [
+        {"name": "Name", "password": VALID_PASSWORDS[0], "email": email, "default_domain": "dot.com"},
+        {"name": "Name", "password": INVALID_PASSWORDS[0], "email": unique_email("email@dot.com")},
+        {"name": "Name", "password": VALID_PASSWORDS[1], "email": email.upper()},
+        {"name": "Name", "password": VALID_PASSWORDS[1]},
+    ]
+    response = client.post('/BulkNewUsers', json=payload)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line['row'] for line in lines] == [0, 1, 2, 3]
+    assert [line['status'] for line in lines] == [202, 400, 409, 400]
+    assert lines[0]['data']['email'] == email
+    assert lines[0]['data']['password'] == '********'
+    assert lines[3]['error'] == "MissingRequiredParameterError"
+    assert client.post('/NewUser', json=payload[0]).status_code == 409
+
+
+def test_export_events_streams_gzipped_ndjson():
+    client = TestClient(app)
+    response = client.post('/NewUser', json={
+        "name": "Name", "password": VALID_PASSWORDS[0], "email": unique_email("email@dot.com")})
+    user_id = response.json()['data']['user_id']
+    response = client.get('/events/export', params={'originator_id': user_id},
+                          headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/x-ndjson'
+    assert response.headers['Content-Encoding'] == 'gzip'
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line['originator_id'] for line in lines] == [user_id]
+    assert lines[0]['topic'] == 'kanban.domain.model.user#User.Created'
+
+    response = client.get('/events/export', params={'from_position': lines[0]['position'] + 1,
+                                                    'originator_id': user_id},
+                          headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.text == ''
+    assert client.get('/events/export', params={'from_position': 0}).status_code == 400
+
+
+def test_get_user_as_of():
+    client = TestClient(app)
+    email = unique_email("email@dot.com")
+    response = client.post('/NewUser', json={"name": "Name", "password": VALID_PASSWORDS[0], "email": email})
+    user_id = response.json()['data']['user_id']
+
+    response = client.get('/GetUser', params={'user_id': user_id})
+    assert response.status_code == 200
+    user = response.json()['data']
+    assert (user['name'], user['email'], user['password']) == ("Name", email, '********')
+    as_of = response.json()['data']['_created_on']
+    response = client.get('/GetUser', params={'user_id': user_id, 'as_of': as_of})
+    assert response.json()['data'] == user
+    assert client.get('/GetUser', params={'user_id': user_id, 'as_of': '2000-01-01T00:00:00Z'}).status_code == 404
+    assert client.get('/GetUser', params={'user_id': user_id, 'as_of': 'yesterday'}).status_code == 400
+    assert client.get('/GetUser', params={'user_id': str(uuid4())}).status_code == 404
+
+
+def test_get_user_answers_if_none_match_with_not_modified():
+    client = TestClient(app)
+    response = client.post('/NewUser', json={
+        "name": "Name", "password": VALID_PASSWORDS[0], "email": unique_email("email@dot.com")})
+    user_id = response.json()['data']['user_id']
+
+    response = client.get('/GetUser', params={'user_id': user_id})
+    assert response.headers['ETag'] == '"1"'
+    assert response.json()['data']['version'] == 1
+    response = client.get('/GetUser', params={'user_id': user_id}, headers={'If-None-Match': '"1"'})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == '"1"'
+    assert response.content == b''
+    response = client.get('/GetUser', params={'user_id': user_id}, headers={'If-None-Match': 'W/"0", "2"'})
+    assert response.status_code == 200
+
+
+def list_all_users(client, domain_namespace, limit=None):
+    users = []
+    params = {'domain_namespace': domain_namespace}
+    if limit:
+        params['limit'] = limit
+    while True:
+        response = client.get('/ListUsers', params=params)
+        assert response.status_code == 200
+        users += response.json()['data']
+        if response.json()['next_cursor'] is None:
+            return users
+        params['cursor'] = response.json()['next_cursor']
+
+
+@settings(max_examples=10)
+@given(name=fake_factory('name'),
+       password=sampled_from(VALID_PASSWORDS),
+       email=fake_factory('email'),
+       default_domain=fake_factory('domain_name'))
+def test_list_users(name, password, email, default_domain):
+    client = TestClient(app)
+    payload = {
+        "name": name,
+        "password": password,
+        "email": unique_email(email),
+        "default_domain": default_domain
+    }
+    record = client.post('/NewUser', json=payload).json()
+    user_id = record['data']['user_id']
+
+    users = list_all_users(client, record['data']['default_domain'])
+    assert user_id in users
+
+
+def test_list_users_pages_with_cursor():
+    client = TestClient(app)
+    domain = f"{uuid4().hex}.example.com"
+    created = set()
+    for _ in range(3):
+        payload = {
+            "name": "Name",
+            "password": VALID_PASSWORDS[0],
+            "email": unique_email("email@dot.com"),
+            "default_domain": domain
+        }
+        created.add(client.post('/NewUser', json=payload).json()['data']['user_id'])
+
+    listed = list_all_users(client, domain, limit=2)
+    assert listed == sorted(listed, key=UUID)
+    assert set(listed) == created
+
 # @settings(max_examples=10)
 # @given(name=fake_factory('name'),
 #        password=sampled_from(VALID_PASSWORDS),
@@ -206,3 +337,8 @@ def test_new_user(name, password, email, default_domain):
 #     response = client.get('/ListUsers')
 #     users = response.json()['data']
 #     assert new_user_id not in users
+
+
+def test_memory_event_store_has_no_database_setting():
+    assert app_module.EVENT_STORE == 'memory'
+    assert 'DATABASE' not in app_module.settings
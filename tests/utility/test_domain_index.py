@@ -0,0 +1,35 @@
+from utility import parse
+from utility.domain_index import DomainIndex
+from utility.parse import whitelist_domain
+
+
+def test_domain_index_matches_exact_domain():
+    index = DomainIndex(['163.com', 'zzom.co.uk'])
+    assert '163.com' in index
+    assert 'ZZOM.co.uk.' in index
+    assert 'example.com' not in index
+
+
+def test_domain_index_matches_subdomains():
+    index = DomainIndex(['163.com'])
+    assert 'mail.163.com' in index
+    assert 'a.b.mail.163.com' in index
+    assert '2163.com' not in index
+    assert 'com' not in index
+
+
+def test_whitelist_domain_replaces_blacklisted_subdomain():
+    assert whitelist_domain('mail.163.com') == 'public.example.com'
+    assert whitelist_domain('163.com') == 'public.example.com'
+    assert whitelist_domain('company.example.org') == 'company.example.org'
+
+
+def test_load_blacklist_files(tmpdir):
+    blacklist = tmpdir.join('blacklist.txt')
+    blacklist.write("# extra domains\nblocked.example.org\n\n")
+    try:
+        parse.load_blacklist_files(str(blacklist))
+        assert whitelist_domain('mx.blocked.example.org') == 'public.example.com'
+    finally:
+        parse._blacklist_files.clear()
+        parse._blacklist_index = None
@@ -0,0 +1,13 @@
+from utility.histogram import Histogram, exponential_buckets
+
+
+def test_histogram_counts_values_into_cumulative_buckets():
+    histogram = Histogram(exponential_buckets(1, 10, 3))
+    for value in (0.5, 1, 5, 50, 500):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == 5
+    assert snapshot['sum'] == 556.5
+    assert snapshot['buckets'] == [(1, 2), (10, 3), (100, 4), (float('inf'), 5)]
+    assert histogram.quantile(0.5) == 10
+    assert Histogram([1]).quantile(0.5) is None
@@ -0,0 +1,43 @@
+from utility.metrics import Metrics
+
+
+def test_timed_functions_are_recorded_only_while_enabled():
+    metrics = Metrics(enabled=False)
+
+    @metrics.timed('work_seconds', kind='test')
+    def work(x):
+        return x * 2
+
+    assert work(1) == 2
+    with metrics.timer('block_seconds'):
+        pass
+    assert metrics.render() == '\n'
+
+    metrics.enabled = True
+    assert work(2) == 4
+    with metrics.timer('block_seconds'):
+        pass
+    assert metrics.histogram('work_seconds', kind='test').count == 1
+    assert metrics.histogram('block_seconds').count == 1
+
+
+def test_render_uses_the_prometheus_text_format():
+    metrics = Metrics(enabled=True)
+    metrics.describe('work_seconds', "Time taken by work.")
+    metrics.histogram('work_seconds', kind='a"b').observe(0.0001)
+    lines = metrics.render().splitlines()
+    assert lines[:3] == [
+        '# HELP work_seconds Time taken by work.',
+        '# TYPE work_seconds histogram',
+        'work_seconds_bucket{kind="a\\"b",le="5e-05"} 0',
+    ]
+    assert 'work_seconds_bucket{kind="a\\"b",le="+Inf"} 1' in lines
+    assert lines[-2:] == ['work_seconds_sum{kind="a\\"b"} 0.0001', 'work_seconds_count{kind="a\\"b"} 1']
+
+
+def test_gauges_are_read_as_they_are_rendered():
+    metrics = Metrics(enabled=True)
+    values = iter([3, 0])
+    metrics.gauge('queue_length', lambda: next(values), queue='a')
+    assert metrics.render().splitlines() == ['# TYPE queue_length gauge', 'queue_length{queue="a"} 3']
+    assert metrics.render().splitlines()[-1] == 'queue_length{queue="a"} 0'
@@ -0,0 +1,46 @@
+import os
+import time
+
+from apistar import Route, TestClient
+from apistar.frameworks.wsgi import WSGIApp as App
+
+from webapi.profiling import ProfilingMiddleware, StackSampler
+
+
+def slow_handler():
+    time.sleep(0.05)
+    return {"data": "ok"}
+
+
+def test_sampled_requests_are_written_as_collapsed_stacks_by_route(tmpdir):
+    sampler = StackSampler(directory=str(tmpdir), sample_rate=1, interval=0.001, flush_interval=60)
+    client = TestClient(ProfilingMiddleware(App(routes=[Route('/slow', 'GET', slow_handler)]), sampler))
+
+    assert client.get('/slow').json() == {"data": "ok"}
+    assert not sampler.requests
+
+    sampler.start()
+    try:
+        assert client.get('/slow').status_code == 200
+        assert client.get('/missing').status_code == 404
+    finally:
+        sampler.stop()
+
+    assert sampler.requests == {'slow_handler': 1, 'not_found': 1}
+    [name] = [name for name in os.listdir(str(tmpdir)) if name.startswith('slow_handler-')]
+    assert name.endswith('.folded')
+    with open(os.path.join(str(tmpdir), name)) as f:
+        lines = f.read().splitlines()
+    stack, count = lines[0].rsplit(' ', 1)
+    assert 'slow_handler (test_profiling.py:' in stack
+    assert int(count) > 1
+
+
+def test_flushes_in_the_same_second_write_separate_files(tmpdir):
+    sampler = StackSampler(directory=str(tmpdir), max_files=2)
+    paths = []
+    for count in range(3):
+        sampler._stacks['route']['main (app.py:1)'] = count + 1
+        paths.extend(sampler.flush())
+    assert len(set(paths)) == 3
+    assert sorted(os.listdir(str(tmpdir))) == [os.path.basename(path) for path in paths[1:]]
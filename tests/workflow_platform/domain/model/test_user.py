@@ -107,3 +107,15 @@ def test_add_invalid_domain_to_user_raises_attribute_error(name, email, password
     user = User.create(name=name, password=password, email=email, default_domain=default_domain)
     with raises(AttributeError):
         user.add_domain('not_domain')
+
+
+@given(password=sampled_from(PASSWORDS))
+def test_replaying_created_event_matches_validated_user(password):
+    user = User.create(name="Name", password=password, email="email@dot.com", default_domain="dot.com")
+    created = user._pending_events[0]
+    replayed = User._mutate(None, created)
+    validated = User(**created.__dict__)
+    validated.domains.add(created.default_domain)
+    validated.increment_version()
+    assert replayed.__dict__.keys() == validated.__dict__.keys()
+    assert replayed == validated
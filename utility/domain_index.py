@@ -0,0 +1,65 @@
+# Trie nodes are dicts keyed by label; this key marks a node as the end of an indexed domain.
+_TERMINAL = None
+
+
+def normalize_domain(domain):
+    """Lower-cases a domain and strips surrounding whitespace and any trailing root dot."""
+    return domain.strip().lower().rstrip('.')
+
+
+class DomainIndex(object):
+    """Compiled set of domains supporting exact and subdomain membership tests.
+
+    Exact matches are answered from a frozenset. Subdomain matches walk a trie of
+    reversed labels, so 'mail.163.com' is found under 'com' -> '163', which is marked
+    terminal because '163.com' was indexed. Lookups cost O(number of labels), not
+    O(number of indexed domains).
+    """
+
+    def __init__(self, domains=()):
+        exact = set()
+        trie = {}
+        for domain in domains:
+            domain = normalize_domain(domain)
+            if not domain:
+                continue
+            exact.add(domain)
+            node = trie
+            for label in reversed(domain.split('.')):
+                node = node.setdefault(label, {})
+            node[_TERMINAL] = True
+        self._exact = frozenset(exact)
+        self._trie = trie
+
+    def __len__(self):
+        return len(self._exact)
+
+    def __contains__(self, domain):
+        return self.matches(domain)
+
+    def matches(self, domain):
+        """Returns True if domain, or any parent domain of it, is in the index.
+
+        :param domain: Domain name, e.g. 'mail.163.com'.
+        :returns: bool
+        """
+        domain = normalize_domain(domain)
+        if domain in self._exact:
+            return True
+        node = self._trie
+        for label in reversed(domain.split('.')):
+            node = node.get(label)
+            if node is None:
+                return False
+            if _TERMINAL in node:
+                return True
+        return False
+
+
+def read_domain_file(path):
+    """Reads domains from a text file with one domain per line. Blank lines and '#' comments are ignored."""
+    with open(path) as f:
+        for line in f:
+            domain = line.split('#', 1)[0].strip()
+            if domain:
+                yield domain
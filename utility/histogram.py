@@ -0,0 +1,61 @@
+from bisect import bisect_left
+from threading import Lock
+
+
+def exponential_buckets(start, factor, count):
+    """Upper bounds start, start * factor, ... for count buckets."""
+    return tuple(start * factor ** i for i in range(count))
+
+
+class Histogram(object):
+    """Fixed-bucket histogram of observed values.
+
+    Observing a value is a bisect over the bucket bounds and two additions, so it is cheap
+    enough to record on every call. Values above the last bound are counted in an overflow
+    bucket.
+    """
+
+    def __init__(self, bounds):
+        """
+        :param bounds: Ascending upper bounds of the buckets.
+        """
+        self.bounds = tuple(bounds)
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._sum = 0
+        self._lock = Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    def snapshot(self):
+        """Returns the histogram as a dict of count, sum and cumulative bucket counts.
+
+        The buckets are (upper bound, number of values <= bound) pairs, ending with
+        (inf, count), the shape Prometheus expects.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        buckets = []
+        cumulative = 0
+        for bound, n in zip(self.bounds + (float('inf'),), counts):
+            cumulative += n
+            buckets.append((bound, cumulative))
+        return {'count': cumulative, 'sum': total, 'buckets': buckets}
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding the q-th quantile, or None if empty."""
+        snapshot = self.snapshot()
+        if not snapshot['count']:
+            return None
+        rank = max(q * snapshot['count'], 1)
+        for bound, cumulative in snapshot['buckets']:
+            if cumulative >= rank:
+                return bound
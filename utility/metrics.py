@@ -0,0 +1,151 @@
+import os
+import time
+from functools import wraps
+from threading import Lock
+
+from utility.histogram import Histogram, exponential_buckets
+
+METRICS_ENABLED = os.getenv('METRICS', '0') == '1'
+# 50 microseconds to about 6.5 seconds.
+LATENCY_BUCKETS = exponential_buckets(0.00005, 2, 18)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class Metrics(object):
+    """Registry of latency histograms and gauges, rendered in the Prometheus text format.
+
+    Histograms are identified by a metric name and labels, and created on first use. While
+    disabled, timers and timed functions check one attribute and record nothing, so hot
+    paths can stay instrumented in production. Gauges are functions called as the metrics
+    are rendered, so they cost nothing until they are scraped.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._histograms = {}
+        self._gauges = {}
+        self._help = {}
+        self._lock = Lock()
+
+    def describe(self, name, documentation):
+        """Sets the HELP text of a metric."""
+        self._help[name] = documentation
+
+    def histogram(self, name, **labels):
+        """Returns the histogram of name with labels, creating it if needed."""
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(LATENCY_BUCKETS))
+        return histogram
+
+    def register(self, name, histogram, **labels):
+        """Adds a histogram kept elsewhere, e.g. with other buckets, to the rendered metrics."""
+        with self._lock:
+            self._histograms[(name, tuple(sorted(labels.items())))] = histogram
+
+    def gauge(self, name, value, **labels):
+        """Adds a gauge whose value is returned by calling value() when the metrics are rendered."""
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def timer(self, name, **labels):
+        """Returns a context manager that records the seconds its block takes, if enabled."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self.histogram(name, **labels))
+
+    def timed(self, name, **labels):
+        """Decorates a function to record the seconds each call takes, if enabled."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.histogram(name, **labels).observe(time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._gauges.clear()
+
+    def render(self):
+        """Returns every histogram and gauge in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            gauges = sorted(self._gauges.items(), key=lambda item: item[0])
+        lines = []
+        described = set()
+
+        def describe(name, metric_type):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), histogram in histograms:
+            describe(name, 'histogram')
+            snapshot = histogram.snapshot()
+            for bound, cumulative in snapshot['buckets']:
+                le = '+Inf' if bound == float('inf') else format(bound, 'g')
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {snapshot['sum']!r}")
+            lines.append(f"{name}_count{_format_labels(labels)} {snapshot['count']}")
+        for (name, labels), value in gauges:
+            describe(name, 'gauge')
+            lines.append(f"{name}{_format_labels(labels)} {value()!r}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
+metrics.describe('kanban_new_user_seconds', "Time taken by KanbanApplication.new_user.")
+metrics.describe('kanban_password_hash_seconds', "Time taken to hash a password, including queueing.")
+metrics.describe('kanban_store_seconds', "Time taken by event store operations, by table and operation.")
+metrics.describe('kanban_event_encode_seconds', "Time taken to encode an event as a sequenced item.")
+metrics.describe('kanban_event_decode_seconds', "Time taken to decode an event from a sequenced item.")
+metrics.describe('kanban_policy_seconds', "Time taken by policies handling published events, by policy.")
+metrics.describe('kanban_group_commit_batch_size', "Appends written by each group commit.")
+metrics.describe('kanban_group_commit_wait_seconds', "Time each append waited for its group commit.")
+metrics.describe('kanban_projection_lag', "Events stored after those each projection's checkpoint covers.")
@@ -1,20 +1,52 @@
 import re
+from datetime import timezone
 from email.utils import parseaddr
 from urllib.parse import urlparse
 
+import dateutil.parser
+
+from utility.domain_index import DomainIndex, read_domain_file
 from utility.fixtures import BLACKLIST_DOMAINS
 
 ORG_MATCH = re.compile(r".*@(?P<organization>.*)")
 
+_blacklist_files = []
+_blacklist_index = None
+
+
+def load_blacklist_files(*paths):
+    """Adds blacklist files (one domain per line) to the built-in blacklist.
+
+    Intended to be called once at startup. The domains are read when the index is next built.
+
+    :param paths: Paths of blacklist files.
+    """
+    global _blacklist_index
+    _blacklist_files.extend(paths)
+    _blacklist_index = None
+
+
+def get_blacklist_index():
+    """Returns the blacklist domain index, building it on first use."""
+    global _blacklist_index
+    if _blacklist_index is None:
+        domains = list(BLACKLIST_DOMAINS)
+        for path in _blacklist_files:
+            domains.extend(read_domain_file(path))
+        _blacklist_index = DomainIndex(domains)
+    return _blacklist_index
+
 
 def whitelist_domain(default_domain):
     """Parses a non-blacklisted domain from an email address.
 
+    Subdomains of blacklisted domains, e.g. 'mail.163.com', are blacklisted too.
+
     :param default_domain: Valid domain.
     :raises AttributeError: If email is an invalid email address.
     :returns: A domain.
     """
-    if default_domain not in BLACKLIST_DOMAINS:
+    if default_domain not in get_blacklist_index():
         return default_domain
     else:
         return "public.example.com"
@@ -58,3 +90,19 @@ def valid_unencrypted_password(password):
         return True
     else:
         return False
+
+
+def parse_timestamp(value):
+    """Parses a Unix timestamp, or an ISO 8601 date and time that is UTC unless it has an offset.
+
+    :raises ValueError: If value is neither.
+    :returns: Unix timestamp as a float.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parsed = dateutil.parser.parse(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
@@ -58,7 +58,7 @@ class UserIdList(typing.List[typesystem.String]):
     description = "List of DomainNamespace stringified IDs."
 
 
-class Version(typesystem.Number):
+class Version(typesystem.Integer):
     description = "Current version of this User"
 
 
@@ -0,0 +1,207 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+PROFILER_SAMPLE_RATE = float(os.getenv('PROFILER_SAMPLE_RATE', 0.01))
+PROFILER_INTERVAL_MS = float(os.getenv('PROFILER_INTERVAL_MS', 5))
+PROFILER_FLUSH_SECONDS = float(os.getenv('PROFILER_FLUSH_SECONDS', 60))
+PROFILER_MAX_FILES = int(os.getenv('PROFILER_MAX_FILES', 60))
+PROFILER_DIR = os.getenv('PROFILER_DIR', os.path.join(os.getcwd(), 'profiles'))
+# Routes of requests the app has no handler for.
+UNKNOWN_ROUTE = 'not_found'
+
+
+def _collapse(frame):
+    """Returns the stack ending at frame in the collapsed format, outermost frame first."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(object):
+    """
+    Samples the stacks of threads serving profiled requests, aggregated by route.
+
+    While running, a background thread reads the current frame of each thread with a
+    profiled request every interval seconds and counts its stack under the request's route.
+    Every flush_interval seconds, and when stopped, the counts of each route are written to
+    a new '<route>-<timestamp>.<microseconds>-<flush number>.folded' file in directory, so
+    flushes in the same second don't overwrite each other, one 'frame;frame;... count' line
+    per stack, as flamegraph.pl and speedscope read. Only the newest max_files files of a
+    route are kept.
+
+    Unlike a deterministic profiler, the profiled code runs at full speed, and the cost is
+    one stack walk per profiled thread per interval.
+    """
+
+    def __init__(self, directory=PROFILER_DIR, sample_rate=PROFILER_SAMPLE_RATE, interval=None,
+                 flush_interval=PROFILER_FLUSH_SECONDS, max_files=PROFILER_MAX_FILES):
+        """
+        :param directory: Directory the collapsed stack files are written to.
+        :param sample_rate: Fraction of requests that are profiled.
+        :param interval: Seconds between samples. Defaults to PROFILER_INTERVAL_MS.
+        :param flush_interval: Seconds between writing files.
+        :param max_files: Files kept per route.
+        """
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.interval = PROFILER_INTERVAL_MS / 1000 if interval is None else interval
+        self.flush_interval = flush_interval
+        self.max_files = max_files
+        self.running = False
+        self.requests = Counter()
+        self._active = {}
+        self._stacks = defaultdict(Counter)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._flushes = 0
+
+    def start(self, sample_rate=None):
+        with self._lock:
+            if sample_rate is not None:
+                self.sample_rate = sample_rate
+            if self.running:
+                return
+            self.running = True
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+            self._stopped.set()
+            thread, self._thread = self._thread, None
+        thread.join()
+        self.flush()
+
+    def should_profile(self):
+        return self.running and random.random() < self.sample_rate
+
+    def begin(self, route):
+        """Starts sampling the calling thread's stack under route."""
+        self._active[threading.get_ident()] = route
+        with self._lock:
+            self.requests[route] += 1
+
+    def end(self):
+        self._active.pop(threading.get_ident(), None)
+
+    def sample(self):
+        """Counts the current stack of each thread with a profiled request."""
+        frames = sys._current_frames()
+        own = threading.get_ident()
+        with self._lock:
+            for thread_id, route in list(self._active.items()):
+                frame = frames.get(thread_id)
+                if frame is not None and thread_id != own:
+                    self._stacks[route][_collapse(frame)] += 1
+
+    def flush(self):
+        """Writes the stacks counted since the last flush, one file per route.
+
+        :returns: List of the paths written.
+        """
+        with self._lock:
+            stacks, self._stacks = self._stacks, defaultdict(Counter)
+            if not stacks:
+                return []
+            self._flushes += 1
+            flushes = self._flushes
+        os.makedirs(self.directory, exist_ok=True)
+        now = time.time()
+        # Names sort in the order they were written, as _remove_old_files() relies on.
+        timestamp = f"{time.strftime('%Y%m%dT%H%M%S', time.localtime(now))}.{int(now % 1 * 1e6):06d}-{flushes:06d}"
+        paths = []
+        for route, counts in stacks.items():
+            path = os.path.join(self.directory, f'{route}-{timestamp}.folded')
+            with open(path + '.tmp', 'w') as f:
+                for stack, count in counts.most_common():
+                    f.write(f'{stack} {count}\n')
+            os.replace(path + '.tmp', path)
+            paths.append(path)
+            self._remove_old_files(route)
+        return paths
+
+    def _remove_old_files(self, route):
+        prefix = f'{route}-'
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith(prefix) and name.endswith('.folded'))
+        for name in names[:-self.max_files]:
+            os.remove(os.path.join(self.directory, name))
+
+    def _run(self):
+        flushed = time.monotonic()
+        while not self._stopped.wait(self.interval):
+            if self._active:
+                self.sample()
+            if time.monotonic() - flushed >= self.flush_interval:
+                self.flush()
+                flushed = time.monotonic()
+
+
+class _ProfiledBody(object):
+    """Keeps sampling a request's thread while its response body is written, e.g. a stream."""
+
+    def __init__(self, body, sampler):
+        self.body = body
+        self.sampler = sampler
+
+    def __iter__(self):
+        try:
+            yield from self.body
+        finally:
+            self.sampler.end()
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.sampler.end()
+
+
+class ProfilingMiddleware(object):
+    """
+    WSGI middleware that samples the stacks of a fraction of requests.
+
+    While the sampler isn't running, requests go straight to the app. Other attributes,
+    e.g. main() for the command line, are the app's.
+    """
+
+    def __init__(self, app, sampler):
+        self.app = app
+        self.sampler = sampler
+
+    def __getattr__(self, name):
+        return getattr(self.app, name)
+
+    def __call__(self, environ, start_response):
+        if not self.sampler.should_profile():
+            return self.app(environ, start_response)
+        self.sampler.begin(self._route(environ))
+        try:
+            body = self.app(environ, start_response)
+        except BaseException:
+            self.sampler.end()
+            raise
+        return _ProfiledBody(body, self.sampler)
+
+    def _route(self, environ):
+        try:
+            handler, _ = self.app.router.lookup(environ['PATH_INFO'], environ['REQUEST_METHOD'].upper())
+        except Exception:
+            return UNKNOWN_ROUTE
+        return handler.__name__
+
+
+sampler = StackSampler()
@@ -0,0 +1,58 @@
+import json
+import zlib
+
+from apistar import Response
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+
+def ndjson_response(rows, status=200, headers=None, gzip=False):
+    """Streams rows as newline delimited JSON, one row per line.
+
+    Rows are encoded as the response is written, so the body is never held in memory.
+
+    :param rows: Iterable of JSON serializable rows.
+    :param gzip: Whether to compress the body with gzip, as it is written.
+    :returns: Response.
+    """
+    content = (json.dumps(row).encode('utf-8') + b'\n' for row in rows)
+    if gzip:
+        content = _gzip_chunks(content)
+        headers = dict(headers or {}, **{'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+    return Response(content, status, headers, content_type=NDJSON_CONTENT_TYPE)
+
+
+def accepts_gzip(accept_encoding):
+    """Returns whether an Accept-Encoding header value allows a gzip encoded response."""
+    for coding in (accept_encoding or '').split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() == 'gzip':
+            _, _, q = params.partition('q=')
+            try:
+                return float(q or 1) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def etag_matches(if_none_match, etag):
+    """Returns whether an If-None-Match header value matches etag, comparing weakly as RFC 7232 says to."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque_tag = _strip_weak(etag)
+    return any(_strip_weak(tag.strip()) == opaque_tag for tag in if_none_match.split(','))
+
+
+def _strip_weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,31 @@
+from uuid import UUID
+
+from apistar import Response, Route, http
+
+from infrastructure.kanban_application import get_kanban_application
+from webapi.responses import accepts_gzip, ndjson_response
+
+
+def export_events(from_position: http.QueryParam, topic: http.QueryParam, originator_id: http.QueryParam,
+                  accept_encoding: http.Header):
+    """Stream stored events as NDJSON, in the order they were written, gzipped if accepted.
+
+    Each line has the event's log 'position'. Pass the last position read plus one back as
+    'from_position' to resume an export.
+    """
+    try:
+        from_position = int(from_position) if from_position else 1
+        if from_position < 1:
+            raise ValueError("from_position must be at least 1.")
+        originator_id = UUID(originator_id) if originator_id else None
+    except ValueError as e:
+        error = {"error": "ValueError", "message": str(e)}
+        return Response(error, 400)
+    events = get_kanban_application().export_events(from_position=from_position, topic=topic or None,
+                                                    originator_id=originator_id)
+    return ndjson_response(events, gzip=accepts_gzip(accept_encoding))
+
+
+event_routes = [
+    Route('/events/export', 'GET', export_events),
+]
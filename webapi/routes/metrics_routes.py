@@ -0,0 +1,13 @@
+from apistar import Response, Route
+
+from utility.metrics import PROMETHEUS_CONTENT_TYPE, metrics
+
+
+def get_metrics():
+    """Dump the latency histograms in the Prometheus text format."""
+    return Response(metrics.render().encode('utf-8'), 200, content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+metrics_routes = [
+    Route('/metrics', 'GET', get_metrics),
+]
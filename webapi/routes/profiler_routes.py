@@ -0,0 +1,39 @@
+from apistar import Response, Route, http
+
+from webapi.profiling import sampler
+
+
+def _status():
+    return {
+        "running": sampler.running,
+        "sample_rate": sampler.sample_rate,
+        "directory": sampler.directory,
+        "requests": dict(sampler.requests),
+    }
+
+
+def get_profiler():
+    """Show whether requests are being profiled, and how many have been profiled per route."""
+    return Response({"data": _status()}, 200)
+
+
+def set_profiler(settings: http.RequestData):
+    """Start or stop profiling requests. Body: {"running": true|false, "sample_rate": 0.01}."""
+    if not isinstance(settings, dict) or not isinstance(settings.get('running'), bool):
+        error = {"error": "ValueError", "message": "Request body must be an object with a boolean 'running'."}
+        return Response(error, 400)
+    sample_rate = settings.get('sample_rate')
+    if sample_rate is not None and (not isinstance(sample_rate, (int, float)) or not 0 < sample_rate <= 1):
+        error = {"error": "ValueError", "message": "sample_rate must be greater than 0 and at most 1."}
+        return Response(error, 400)
+    if settings['running']:
+        sampler.start(sample_rate=sample_rate)
+    else:
+        sampler.stop()
+    return Response({"data": _status()}, 200)
+
+
+profiler_routes = [
+    Route('/admin/profiler', 'GET', get_profiler),
+    Route('/admin/profiler', 'POST', set_profiler),
+]
@@ -1,7 +1,16 @@
-from apistar import Response, Route
+from uuid import UUID
 
+from apistar import Response, Route, http
+
+from infrastructure.hashing import HashingQueueFull
 from infrastructure.kanban_application import get_kanban_application
+from infrastructure.projections.user_email_index import EmailAlreadyRegistered
 from webapi.models.user_model import CreateUser, User
+from utility.parse import parse_timestamp
+from webapi.responses import etag_matches, ndjson_response
+
+LIST_USERS_MAX_LIMIT = 1000
+BULK_NEW_USERS_MAX_BATCH = 10000
 
 
 def new_user(user: CreateUser):
@@ -14,14 +23,110 @@ def new_user(user: CreateUser):
     except KeyError as e:
         error = {"error": "MissingRequiredParameterError", "message": str(e)}
         return Response(error, 400)
+    except EmailAlreadyRegistered as e:
+        error = {"error": "EmailAlreadyRegisteredError", "message": str(e)}
+        return Response(error, 409)
     except AttributeError as e:
         error = {"error": "AttributeError", "message": str(e)}
         return Response(error, 400)
+    except HashingQueueFull as e:
+        error = {"error": "ServiceUnavailableError", "message": str(e)}
+        return Response(error, 503, {"Retry-After": "1"})
     else:
         data = {"data": User(user)}
         return Response(data, 202)
 
 
+def bulk_new_users(users: http.RequestData):
+    """Create many Users in one transaction. Streams one NDJSON line per user, in order.
+
+    Each line has the row index and status of the user: 202 with the User, or the error
+    new_user would have returned for it. If the password hashing queue fills up, no users
+    are created and the response is a 503.
+    """
+    if not isinstance(users, list):
+        error = {"error": "ValueError", "message": "Request body must be a JSON array of users."}
+        return Response(error, 400)
+    if len(users) > BULK_NEW_USERS_MAX_BATCH:
+        error = {"error": "ValueError", "message": f"Batches are limited to {BULK_NEW_USERS_MAX_BATCH} users."}
+        return Response(error, 400)
+    try:
+        results = get_kanban_application().new_users(users)
+    except HashingQueueFull as e:
+        error = {"error": "ServiceUnavailableError", "message": str(e)}
+        return Response(error, 503, {"Retry-After": "1"})
+    return ndjson_response(_bulk_new_user_line(row, result) for row, result in enumerate(results))
+
+
+def _bulk_new_user_line(row, result):
+    if result.error is None:
+        return {"row": row, "status": 202, "data": User(result.user)}
+    if isinstance(result.error, KeyError):
+        error, status = "MissingRequiredParameterError", 400
+    elif isinstance(result.error, EmailAlreadyRegistered):
+        error, status = "EmailAlreadyRegisteredError", 409
+    else:
+        error, status = "AttributeError", 400
+    return {"row": row, "status": status, "error": error, "message": str(result.error)}
+
+
+def list_users(domain_namespace: http.QueryParam, cursor: http.QueryParam, limit: http.QueryParam):
+    """List the IDs of users in a domain namespace, a page at a time. Pass 'next_cursor' back as 'cursor'."""
+    try:
+        if not domain_namespace:
+            raise KeyError('domain_namespace')
+        limit = int(limit) if limit else 100
+        if not 0 < limit <= LIST_USERS_MAX_LIMIT:
+            raise ValueError(f"limit must be between 1 and {LIST_USERS_MAX_LIMIT}.")
+        cursor = UUID(cursor) if cursor else None
+        user_ids, next_cursor = get_kanban_application().list_users(domain_namespace, cursor=cursor, limit=limit)
+    except KeyError as e:
+        error = {"error": "MissingRequiredParameterError", "message": str(e)}
+        return Response(error, 400)
+    except ValueError as e:
+        error = {"error": "ValueError", "message": str(e)}
+        return Response(error, 400)
+    else:
+        data = {
+            "data": [str(user_id) for user_id in user_ids],
+            "next_cursor": str(next_cursor) if next_cursor else None
+        }
+        return Response(data, 200)
+
+
+def get_user(user_id: http.QueryParam, as_of: http.QueryParam, version: http.QueryParam,
+             if_none_match: http.Header):
+    """Get a User, or the User as it was at a past time or version.
+
+    'as_of' is an ISO 8601 date and time, UTC unless it has an offset, or a Unix timestamp.
+    'version' is the number of changes made to the User. The ETag is the User's version:
+    send it back as If-None-Match to get a 304 Not Modified if the User hasn't changed.
+    """
+    try:
+        if not user_id:
+            raise KeyError('user_id')
+        user_id = UUID(user_id)
+        at = parse_timestamp(as_of) if as_of else None
+        version = int(version) if version else None
+        user = get_kanban_application().get_user(user_id, version=version, at=at)
+    except KeyError as e:
+        error = {"error": "MissingRequiredParameterError", "message": str(e)}
+        return Response(error, 400)
+    except ValueError as e:
+        error = {"error": "ValueError", "message": str(e)}
+        return Response(error, 400)
+    if user is None:
+        error = {"error": "NotFoundError", "message": f"User {user_id} not found."}
+        return Response(error, 404)
+    etag = f'"{user["version"]}"'
+    if etag_matches(if_none_match, etag):
+        return Response(b'', 304, {"ETag": etag})
+    return Response({"data": User(user)}, 200, {"ETag": etag})
+
+
 user_routes = [
     Route('/NewUser', 'POST', new_user),
+    Route('/BulkNewUsers', 'POST', bulk_new_users),
+    Route('/ListUsers', 'GET', list_users),
+    Route('/GetUser', 'GET', get_user),
 ]